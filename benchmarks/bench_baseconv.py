@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for shortener.baseconv.
+
+Compares the table driven BaseConverter against the original string based
+implementation it replaced:
+
+    python benchmarks/bench_baseconv.py [--number N] [--repeat R]
+"""
+from __future__ import print_function
+
+import optparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shortener.baseconv import base62
+
+
+DIGITS = string.digits + string.letters
+
+
+def legacy_convert(number, fromdigits, todigits):
+    # the implementation BaseConverter.convert had before the rewrite
+    if str(number)[0] == '-':
+        number = str(number)[1:]
+        neg = 1
+    else:
+        neg = 0
+    x = 0
+    for digit in str(number):
+        x = x * len(fromdigits) + fromdigits.index(digit)
+    if x == 0:
+        res = todigits[0]
+    else:
+        res = ''
+        while x > 0:
+            digit = x % len(todigits)
+            res = todigits[digit] + res
+            x = int(x / len(todigits))
+        if neg:
+            res = '-' + res
+    return res
+
+
+def legacy_from_decimal(i):
+    return legacy_convert(i, string.digits, DIGITS)
+
+
+def legacy_to_decimal(s):
+    for index, char in enumerate(s):
+        if char not in DIGITS and not char == '-' and not index == 0:
+            raise ValueError(char)
+    return int(legacy_convert(s, DIGITS, string.digits))
+
+
+def best_of(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--number', type='int', default=2000,
+                      help='calls per timing run')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='timing runs; the best one is reported')
+    options, args = parser.parse_args()
+
+    rng = random.Random(0)
+    # typical ids (up to a few million) and custom codes decoded to large ids
+    ids = ([rng.randint(1, 10 ** 7) for x in xrange(100)] +
+           [rng.randint(1, 2 ** 53) for x in xrange(100)])
+    codes = base62.encode_many(ids)
+
+    cases = [
+        ('encode', lambda: [legacy_from_decimal(i) for i in ids],
+                   lambda: [base62.from_decimal(i) for i in ids]),
+        ('decode', lambda: [legacy_to_decimal(s) for s in codes],
+                   lambda: [base62.to_decimal(s) for s in codes]),
+        ('encode_many', lambda: [legacy_from_decimal(i) for i in ids],
+                        lambda: base62.encode_many(ids)),
+        ('decode_many', lambda: [legacy_to_decimal(s) for s in codes],
+                        lambda: base62.decode_many(codes)),
+    ]
+    print('%-12s %14s %14s %8s' % ('case', 'legacy us/op', 'new us/op',
+                                    'speedup'))
+    for name, legacy, new in cases:
+        legacy_time = best_of(legacy, options.number, options.repeat)
+        new_time = best_of(new, options.number, options.repeat)
+        per_op = 1e6 / len(ids)
+        print('%-12s %14.3f %14.3f %7.1fx' % (
+            name, legacy_time * per_op, new_time * per_op,
+            legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
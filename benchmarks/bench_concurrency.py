@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Measures how many concurrent connections one worker process serves
+redirects to, while the database is slow to write clicks:
+
+    python benchmarks/bench_concurrency.py [--links N] [--requests N]
+        [--concurrency 1,8,32,64] [--db-latency MS] [--output results.json]
+
+The project's WSGI application (with the redirect fast path) is served by
+one forked process, as a single threaded worker and as a threaded worker,
+flushing clicks in the request that makes them due or in the background.
+Each click flush is delayed by --db-latency milliseconds, standing in for a
+database under load.
+"""
+from __future__ import print_function
+
+import httplib
+import optparse
+import os
+import random
+import signal
+import threading
+import time
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from common import (
+    percentile, print_table, seed_links, setup_django, summarize,
+    write_results)
+
+
+# name, threaded server, background flushing
+CONFIGURATIONS = [
+    ('single_thread', False, False),
+    ('threads', True, False),
+    ('threads_background', True, True),
+]
+
+
+class Server(WSGIServer):
+    request_queue_size = 256
+
+
+class ThreadingServer(ThreadingMixIn, Server):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def slow_updates(click_buffer, latency):
+    update_counts = click_buffer.update_counts
+
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return update_counts(*args, **kwargs)
+    click_buffer.update_counts = delayed
+
+
+def serve(application, threaded, background, latency):
+    """
+    Starts a worker process serving ``application`` and returns its
+    (pid, port).
+    """
+    from django.db import connections
+    from shortener.clicks import click_buffer
+
+    server = make_server('127.0.0.1', 0, application,
+                         server_class=ThreadingServer if threaded else Server,
+                         handler_class=QuietHandler)
+    # the worker must not share the parent's database connections
+    for connection in connections.all():
+        connection.close()
+    pid = os.fork()
+    if pid == 0:
+        click_buffer.background = background
+        slow_updates(click_buffer, latency)
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.socket.close()
+    return pid, server.server_port
+
+
+def run(port, paths, concurrency):
+    """
+    Requests ``paths`` from ``concurrency`` client threads, each request on
+    a new connection.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(paths):
+        for path in paths:
+            started = time.time()
+            try:
+                connection = httplib.HTTPConnection('127.0.0.1', port,
+                                                    timeout=30)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                ok = response.status == 301
+            except Exception:
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.time() - started)
+                else:
+                    errors.append(path)
+
+    threads = [threading.Thread(target=client, args=(paths[i::concurrency],))
+               for i in xrange(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.time() - started)
+    result['max_ms'] = percentile(sorted(latencies), 1.0) * 1000
+    result['errors'] = len(errors)
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--links', type='int', default=1000,
+                      help='number of links to seed')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='redirects per configuration and concurrency')
+    parser.add_option('--concurrency', default='1,8,32,64',
+                      help='comma separated numbers of concurrent clients')
+    parser.add_option('--db-latency', type='float', default=50,
+                      help='milliseconds added to each click flush')
+    parser.add_option('--flush-threshold', type='int', default=100,
+                      help='clicks buffered before a flush')
+    parser.add_option('--output', help='write the results to this JSON file')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from shortener.baseconv import base62
+    from shortener.clicks import click_buffer
+    from shortener.fastpath import RedirectFastPath
+
+    settings.SHORTENER_CLICK_ANALYTICS = False
+    click_buffer.analytics = False
+    click_buffer.unique_visitors = False
+    click_buffer.flush_threshold = options.flush_threshold
+    rng = random.Random(0)
+    ids = seed_links(options.links)
+    paths = ['/' + base62.from_decimal(rng.choice(ids))
+             for i in xrange(options.requests)]
+    application = RedirectFastPath(WSGIHandler())
+
+    results = []
+    for name, threaded, background in CONFIGURATIONS:
+        pid, port = serve(application, threaded, background,
+                          options.db_latency / 1000.0)
+        try:
+            # warm up the redirect cache
+            run(port, paths[:200], 4)
+            for concurrency in map(int, options.concurrency.split(',')):
+                result = run(port, paths, concurrency)
+                result['configuration'] = name
+                result['concurrency'] = concurrency
+                results.append(result)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    print_table(results, ['configuration', 'concurrency',
+                          'requests_per_second', 'p50_ms', 'p99_ms',
+                          'max_ms', 'errors'])
+    if options.output:
+        write_results(options.output, 'concurrency', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Compares redirect throughput and latency of the regular Django WSGI
+application with the RedirectFastPath WSGI middleware:
+
+    python benchmarks/bench_fastpath.py [--links N] [--requests N]
+"""
+from __future__ import print_function
+
+import optparse
+import random
+import time
+
+from common import (
+    call_wsgi, print_table, seed_links, setup_django, summarize,
+    write_results, wsgi_environ)
+
+
+def run(application, paths):
+    latencies = []
+    started = time.time()
+    for path in paths:
+        request_started = time.time()
+        status = call_wsgi(application, wsgi_environ(path))
+        latencies.append(time.time() - request_started)
+        assert status.startswith('301'), status
+    return summarize(latencies, time.time() - started)
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--links', type='int', default=10000,
+                      help='number of links to seed')
+    parser.add_option('--requests', type='int', default=20000,
+                      help='redirects per application')
+    parser.add_option('--output', help='write the results to this JSON file')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from django.core.handlers.wsgi import WSGIHandler
+    from shortener.baseconv import base62
+    from shortener.fastpath import RedirectFastPath
+
+    rng = random.Random(0)
+    ids = seed_links(options.links)
+    paths = ['/' + base62.from_decimal(rng.choice(ids))
+             for i in xrange(options.requests)]
+
+    django_app = WSGIHandler()
+    applications = [
+        ('django', django_app),
+        ('fastpath', RedirectFastPath(django_app)),
+    ]
+    results = []
+    for name, application in applications:
+        # warm up the redirect cache and the URL resolver
+        run(application, paths[:1000])
+        result = run(application, paths)
+        result['application'] = name
+        results.append(result)
+
+    print_table(results, ['application', 'requests_per_second', 'p50_ms',
+                          'p99_ms'])
+    if options.output:
+        write_results(options.output, 'fastpath', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Measures the time taken to serve the index, info and submit success pages
+with and without the cached template loader and the template fragment
+cache:
+
+    python benchmarks/bench_render.py [--links N] [--requests N]
+        [--output results.json]
+"""
+from __future__ import print_function
+
+import optparse
+import random
+import time
+
+from common import (
+    print_table, seed_links, setup_django, summarize, write_results)
+
+
+PLAIN_LOADERS = (
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+)
+CONFIGURATIONS = [
+    # name, template loaders, fragment cache timeout
+    ('baseline', PLAIN_LOADERS, 0),
+    ('cached_loader', (('django.template.loaders.cached.Loader',
+                        PLAIN_LOADERS),), 0),
+    ('fragments', PLAIN_LOADERS, 300),
+    ('both', (('django.template.loaders.cached.Loader', PLAIN_LOADERS),),
+     300),
+]
+
+
+def configure(loaders, fragment_timeout):
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.template import loader
+
+    settings.TEMPLATE_LOADERS = loaders
+    settings.SHORTENER_FRAGMENT_CACHE_TIMEOUT = fragment_timeout
+    # the loaders are instantiated on first use
+    loader.template_source_loaders = None
+    cache.clear()
+
+
+def run(client, page, paths, count, rng):
+    latencies = []
+    started = time.time()
+    for i in xrange(count):
+        request_started = time.time()
+        if page == 'submit':
+            # resubmitting a known URL returns the existing link
+            response = client.post('/submit/', {'url': rng.choice(paths)})
+        else:
+            response = client.get(rng.choice(paths))
+        latencies.append(time.time() - request_started)
+        assert response.status_code == 200, response.status_code
+    return summarize(latencies, time.time() - started)
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--links', type='int', default=1000,
+                      help='number of links to seed')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='requests per page and configuration')
+    parser.add_option('--output', help='write the results to this JSON file')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.test.client import Client
+    from shortener.baseconv import base62
+    from shortener.models import Link
+
+    settings.SHORTENER_DEDUPLICATE = True
+    ids = seed_links(options.links)
+    # a working set of pages, visited repeatedly as popular pages are
+    popular = ids[:20]
+    pages = [
+        ('index', ['/']),
+        ('info', ['/info/%s' % base62.from_decimal(link_id)
+                  for link_id in popular]),
+        ('submit', list(Link.objects.filter(id__in=popular).values_list(
+            'url', flat=True))),
+    ]
+
+    client = Client(HTTP_HOST='bench.example.com')
+    results = []
+    for name, loaders, fragment_timeout in CONFIGURATIONS:
+        configure(loaders, fragment_timeout)
+        for page, paths in pages:
+            rng = random.Random(0)
+            # warm up the loaders and the caches
+            run(client, page, paths, 100, rng)
+            result = run(client, page, paths, options.requests, rng)
+            result['configuration'] = name
+            result['page'] = page
+            results.append(result)
+
+    print_table(results, ['configuration', 'page', 'requests_per_second',
+                          'p50_ms', 'p95_ms', 'p99_ms'])
+    if options.output:
+        write_results(options.output, 'render', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Load test for the follow, submit, info and index views.
+
+Seeds a SQLite database with links (some with custom codes, with a skewed
+popularity distribution), then drives each view in-process from concurrent
+worker threads and reports throughput, latency percentiles and database
+queries per request:
+
+    python benchmarks/bench_views.py [--links N] [--workers N]
+        [--requests N] [--output results.json]
+
+Compare the JSON output of two runs to spot regressions.
+"""
+from __future__ import print_function
+
+import optparse
+import random
+import string
+import threading
+import time
+
+from common import print_table, seed_links, setup_django, summarize, \
+    write_results
+
+
+VIEWS = ('follow', 'submit', 'info', 'index')
+
+
+def seed(options, rng):
+    """
+    Creates the links and gives them Zipf distributed usage counts. Returns
+    the ids ordered from most to least popular.
+    """
+    from shortener.baseconv import base62
+    from shortener.bulk import create_links
+    from shortener.models import Link
+
+    custom_count = int(options.links * options.custom_fraction)
+    ids = seed_links(options.links - custom_count)
+    codes = set()
+    while len(codes) < custom_count:
+        codes.add(''.join(rng.choice(string.ascii_letters)
+                          for i in xrange(rng.randint(4, 8))))
+    for link in create_links([('http://www.example.com/custom/%s' % code,
+                               base62.to_decimal(code)) for code in codes]):
+        if link is not None:
+            ids.append(link.id)
+
+    rng.shuffle(ids)
+    for rank, link_id in enumerate(ids[:1000], 1):
+        Link.objects.filter(id=link_id).update(
+            usage_count=int(1000000 / rank ** options.skew))
+    return ids
+
+
+class ZipfSampler(object):
+    """
+    Picks ids with probability proportional to 1 / rank ** skew.
+    """
+    def __init__(self, ids, skew, rng):
+        import bisect
+        self.bisect = bisect.bisect
+        self.ids = ids
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in xrange(1, len(ids) + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self):
+        index = self.bisect(self.cumulative, self.rng.random() * self.total)
+        return self.ids[min(index, len(self.ids) - 1)]
+
+
+def make_request(view, client, sample, numbers):
+    from django.core.urlresolvers import reverse
+    from shortener.baseconv import base62
+
+    if view == 'follow':
+        return client.get(reverse('follow', kwargs={
+            'base62_id': base62.from_decimal(sample())}))
+    elif view == 'info':
+        return client.get(reverse('info', kwargs={
+            'base62_id': base62.from_decimal(sample())}))
+    elif view == 'index':
+        return client.get(reverse('index'))
+    else:
+        return client.post(reverse('submit'), {
+            'url': 'http://www.example.org/submitted/%d' % next(numbers)})
+
+
+def run_view(view, options, ids, seed_value):
+    from django.db import connection
+    from django.test.client import Client
+
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+    per_worker = options.requests // options.workers
+
+    def worker(number):
+        rng = random.Random(seed_value + number)
+        sample = ZipfSampler(ids, options.skew, rng)
+        client = Client(HTTP_HOST='bench.example.com')
+        connection.use_debug_cursor = True
+        local_latencies = []
+        local_queries = []
+        local_errors = 0
+        # unique URLs for submit
+        numbers = iter(xrange(number * per_worker, (number + 1) * per_worker))
+        for i in xrange(per_worker):
+            started = time.time()
+            response = make_request(view, client, sample, numbers)
+            local_latencies.append(time.time() - started)
+            # request_started resets the query log, so it holds the queries
+            # of this request only
+            local_queries.append(len(connection.queries))
+            if response.status_code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in xrange(options.workers)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.time() - started)
+    result['view'] = view
+    result['queries_per_request'] = (
+        sum(queries) / float(len(queries)) if queries else 0.0)
+    result['errors'] = sum(errors)
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--links', type='int', default=10000,
+                      help='number of links to seed')
+    parser.add_option('--custom-fraction', type='float', default=0.1,
+                      help='fraction of links with custom codes')
+    parser.add_option('--skew', type='float', default=1.1,
+                      help='Zipf exponent of link popularity')
+    parser.add_option('--workers', type='int', default=4,
+                      help='concurrent worker threads')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='requests per view')
+    parser.add_option('--views', default=','.join(VIEWS),
+                      help='comma separated views to run')
+    parser.add_option('--database',
+                      help='SQLite file to use instead of a temporary one')
+    parser.add_option('--seed', type='int', default=0,
+                      help='random seed')
+    parser.add_option('--output', help='write the results to this JSON file')
+    options, args = parser.parse_args()
+    views = options.views.split(',')
+    for view in views:
+        if view not in VIEWS:
+            parser.error('unknown view %r' % view)
+
+    setup_django(options.database)
+    rng = random.Random(options.seed)
+    ids = seed(options, rng)
+
+    from shortener.clicks import flush_clicks
+    results = []
+    for view in views:
+        results.append(run_view(view, options, ids, options.seed))
+        flush_clicks()
+
+    print_table(results, ['view', 'requests_per_second', 'p50_ms', 'p95_ms',
+                          'p99_ms', 'queries_per_request', 'errors'])
+    if options.output:
+        write_results(options.output, 'views', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
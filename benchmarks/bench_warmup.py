@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Measures the startup time of a new worker process and the latency of its
+first requests, with and without the warm-up of ``shortener.warmup``:
+
+    python benchmarks/bench_warmup.py [--links N] [--runs N]
+        [--output results.json]
+
+Each run starts a fresh Python process that loads the WSGI application
+(warming it up or not), then times its first and second request to each of
+the index, follow and info pages. The medians over all runs are reported.
+"""
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+# before Django is imported, for the startup time
+STARTED = time.time()
+
+from common import (
+    call_wsgi, print_table, seed_links, setup_django, write_results,
+    wsgi_environ)
+
+
+PAGES = ('index', 'follow', 'info')
+CACHED_LOADERS = (('django.template.loaders.cached.Loader', (
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+)),)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def worker(database, code, warm):
+    """
+    Loads the application as a worker process would, then times the first
+    requests. Prints the results as JSON.
+    """
+    setup_django(database)
+    from django.conf import settings
+    settings.TEMPLATE_LOADERS = CACHED_LOADERS
+    # what django_url_shortener/wsgi.py does
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    if warm:
+        from shortener.warmup import warm_up
+        warm_up()
+    result = {'startup_ms': (time.time() - STARTED) * 1000}
+
+    paths = {'index': '/', 'follow': '/' + code, 'info': '/info/' + code}
+    for attempt in ('first', 'second'):
+        for page in PAGES:
+            started = time.time()
+            status = call_wsgi(application, wsgi_environ(paths[page]))
+            result['%s_%s_ms' % (attempt, page)] = (
+                time.time() - started) * 1000
+            assert status[:3] in ('200', '301'), status
+    print(json.dumps(result))
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--links', type='int', default=10000,
+                      help='number of links to seed')
+    parser.add_option('--runs', type='int', default=5,
+                      help='worker processes started per configuration')
+    parser.add_option('--output', help='write the results to this JSON file')
+    parser.add_option('--worker', nargs=2, metavar='DATABASE CODE',
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option('--warm', action='store_true',
+                      help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.worker:
+        worker(options.worker[0], options.worker[1], options.warm)
+        return
+
+    database = setup_django()
+    from shortener.models import Link
+    ids = seed_links(options.links)
+    Link.objects.filter(id__in=ids[:100]).update(usage_count=100)
+    code = Link.objects.get(id=ids[0]).to_base62()
+
+    results = []
+    for name, warm in (('cold', False), ('warm', True)):
+        runs = []
+        for i in xrange(options.runs):
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--worker', database, code]
+            if warm:
+                command.append('--warm')
+            runs.append(json.loads(
+                subprocess.check_output(command).splitlines()[-1]))
+        result = dict((key, median([run[key] for run in runs]))
+                      for key in runs[0])
+        result['configuration'] = name
+        results.append(result)
+
+    print_table(results, ['configuration', 'startup_ms'] + [
+        '%s_%s_ms' % (attempt, page)
+        for attempt in ('first', 'second') for page in PAGES])
+    if options.output:
+        write_results(options.output, 'warmup', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
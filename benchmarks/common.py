@@ -0,0 +1,152 @@
+"""
+Helpers shared by the benchmarks that need a configured Django project.
+
+Benchmarks run against a throwaway SQLite database so that they can be
+compared between runs on a development machine.
+"""
+from __future__ import print_function
+
+import atexit
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+
+def setup_django(database=None):
+    """
+    Configures the project's settings with a fresh SQLite database at
+    ``database`` (a temporary file that is removed on exit by default) and
+    creates its tables. Returns the database path.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                          'django_url_shortener.settings')
+    from django.conf import settings
+    if database is None:
+        fd, database = tempfile.mkstemp(suffix='.sqlite3',
+                                        prefix='shortener-bench-')
+        os.close(fd)
+        atexit.register(os.remove, database)
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': database,
+    }
+    settings.DEBUG = False
+    settings.TEMPLATE_DEBUG = False
+    settings.ALLOWED_HOSTS = ['*']
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+    return database
+
+
+def seed_links(count, chunk_size=1000):
+    """
+    Bulk inserts ``count`` links and returns their ids.
+    """
+    from shortener.bulk import create_links
+    ids = []
+    for start in xrange(0, count, chunk_size):
+        links = create_links([
+            ('http://www.example.com/%d' % i, None)
+            for i in xrange(start, min(start + chunk_size, count))])
+        ids.extend(link.id for link in links)
+    return ids
+
+
+def wsgi_environ(path, method='GET', host='bench.example.com'):
+    return {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def call_wsgi(application, environ):
+    """
+    Calls a WSGI application, returning its status line after consuming the
+    response body.
+    """
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+    result = application(environ, start_response)
+    try:
+        for chunk in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    """
+    Returns throughput and latency percentiles (in milliseconds) for a list
+    of per-request latencies in seconds measured over ``elapsed`` seconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def write_results(path, name, results, options=None):
+    """
+    Writes ``results`` to ``path`` as JSON along with enough context to tell
+    runs apart.
+    """
+    import django
+    data = {
+        'benchmark': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'options': options or {},
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def print_table(rows, columns):
+    """
+    Prints a list of dicts as a fixed width table.
+    """
+    print(' '.join('%14s' % column for column in columns))
+    for row in rows:
+        print(' '.join(
+            '%14.2f' % row[column] if isinstance(row[column], float)
+            else '%14s' % row[column] for column in columns))
@@ -0,0 +1,36 @@
+"""
+Settings for a primary database with a read replica, using local SQLite
+files. The replica here is the primary's own file, which is enough to run
+the management commands and tests:
+
+    python manage.py syncdb --settings=django_url_shortener.settings_replicas
+    python manage.py test shortener --settings=django_url_shortener.settings_replicas
+
+With real replication, point 'replica' at the replica server and keep its
+TEST_MIRROR so that tests do not need a second test database.
+"""
+import os
+
+from django_url_shortener.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(SITE_ROOT, 'shortener.sqlite3'),
+        # a file rather than memory, so that the mirror can open it
+        'TEST_NAME': os.path.join(SITE_ROOT, 'test-shortener.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(SITE_ROOT, 'shortener.sqlite3'),
+        'TEST_MIRROR': 'default',
+    },
+}
+
+DATABASE_ROUTERS = ['shortener.routers.ReplicaRouter']
+SHORTENER_READ_REPLICAS = ['replica']
+
+MIDDLEWARE_CLASSES = (
+    MIDDLEWARE_CLASSES[0],
+    'shortener.middleware.ReplicaPinMiddleware',
+) + MIDDLEWARE_CLASSES[1:]
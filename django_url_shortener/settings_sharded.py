@@ -0,0 +1,31 @@
+"""
+Settings splitting links between two databases by a hash of their id, using
+local SQLite files. Every database needs its tables:
+
+    python manage.py syncdb --settings=django_url_shortener.settings_sharded
+    python manage.py syncdb --database=shard1 --settings=django_url_shortener.settings_sharded
+    python manage.py test shortener --settings=django_url_shortener.settings_sharded
+
+To split by id range instead, use:
+
+    SHORTENER_SHARDING = 'range'
+    SHORTENER_SHARDS = [(0, 'default'), (1000000, 'shard1')]
+"""
+import os
+
+from django_url_shortener.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(SITE_ROOT, 'shortener-default.sqlite3'),
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(SITE_ROOT, 'shortener-shard1.sqlite3'),
+    },
+}
+
+DATABASE_ROUTERS = ['shortener.routers.ShardRouter']
+SHORTENER_SHARDING = 'hash'
+SHORTENER_SHARDS = ['default', 'shard1']
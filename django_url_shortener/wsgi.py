@@ -24,5 +24,18 @@ from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
 # Apply WSGI middleware here.
+from django.conf import settings
+if getattr(settings, 'SHORTENER_LINK_FILTER', False):
+    # build the filter now rather than in the first request
+    from shortener.models import link_filter
+    link_filter.load()
+if getattr(settings, 'SHORTENER_WARMUP', False):
+    # import the views, compile the templates and fill the caches now
+    from shortener.warmup import warm_up
+    warm_up()
+if getattr(settings, 'SHORTENER_FAST_REDIRECTS', False):
+    from shortener.fastpath import RedirectFastPath
+    application = RedirectFastPath(application)
+
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
@@ -0,0 +1,95 @@
+import datetime
+import re
+
+from django.utils import timezone
+
+from shortener.baseconv import base62, DecodingError
+from shortener.batches import QUERY_BATCH_SIZE
+from shortener.clicks import click_buffer
+from shortener.models import Link
+
+
+# a redirect in the combined log format used by nginx, Apache and most CDNs
+DEFAULT_LOG_PATTERN = (
+    r'\[(?P<time>[^\]]+)\] "(?:GET|HEAD) /(?P<code>\w+) HTTP/[\d.]+" 30[12] ')
+DEFAULT_INGEST_BATCH_SIZE = QUERY_BATCH_SIZE
+
+
+def parse_log_time(value):
+    """
+    Parses a log timestamp such as "18/Oct/2026:10:00:00 +0200" into an
+    aware datetime, or returns None if it cannot be parsed.
+
+    >>> parse_log_time('18/Oct/2026:10:00:00 +0200')
+    datetime.datetime(2026, 10, 18, 8, 0, tzinfo=<UTC>)
+    """
+    local, _, offset = value.partition(' ')
+    try:
+        parsed = datetime.datetime.strptime(local, '%d/%b/%Y:%H:%M:%S')
+        minutes = int(offset[1:3] or 0) * 60 + int(offset[3:5] or 0)
+    except ValueError:
+        return None
+    if offset.startswith('-'):
+        minutes = -minutes
+    parsed -= datetime.timedelta(minutes=minutes)
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_log_line(line, pattern):
+    """
+    Returns the (link id, clicked_at) of a redirect logged on ``line``, or
+    None if ``pattern`` does not match it. clicked_at is None when the
+    pattern has no "time" group.
+    """
+    match = pattern.search(line)
+    if match is None:
+        return None
+    try:
+        link_id = base62.to_decimal(match.group('code'))
+    except DecodingError:
+        return None
+    groups = match.groupdict()
+    clicked_at = None
+    if groups.get('time'):
+        clicked_at = parse_log_time(groups['time'])
+    return link_id, clicked_at
+
+
+def ingest_clicks(lines, pattern=DEFAULT_LOG_PATTERN,
+                  batch_size=DEFAULT_INGEST_BATCH_SIZE):
+    """
+    Counts the redirects logged in ``lines`` through the click buffer, as
+    if ``follow`` had served them. Codes of links that do not exist are
+    skipped, looked up ``batch_size`` lines at a time. Returns the number
+    of clicks counted and of lines skipped.
+    """
+    pattern = re.compile(pattern)
+    counted = skipped = 0
+    clicks = []
+
+    def record(clicks):
+        urls = Link.objects.resolve_many(
+            set(link_id for link_id, clicked_at in clicks))
+        recorded = 0
+        for link_id, clicked_at in clicks:
+            if link_id in urls:
+                click_buffer.record(link_id, clicked_at=clicked_at)
+                recorded += 1
+        return recorded
+
+    for line in lines:
+        click = parse_log_line(line, pattern)
+        if click is None:
+            skipped += 1
+            continue
+        clicks.append(click)
+        if len(clicks) >= batch_size:
+            recorded = record(clicks)
+            counted += recorded
+            skipped += len(clicks) - recorded
+            clicks = []
+    recorded = record(clicks)
+    counted += recorded
+    skipped += len(clicks) - recorded
+    click_buffer.flush()
+    return counted, skipped
@@ -1,10 +1,234 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.template.response import TemplateResponse
 
-from shortener.models import Link
+from shortener.baseconv import DecodingError, base62
+from shortener.batches import iter_batches
+from shortener.cache import links_version
+from shortener.models import Link, popular_links
+from shortener.routers import group_by_shard
+
+
+# the most rows counted to size the pages of a filtered changelist
+DEFAULT_COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """
+    Returns the number of rows in the table of ``queryset`` according to the
+    database's statistics, or None when the backend keeps none.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+    elif connection.vendor == 'mysql':
+        cursor.execute(
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+    else:
+        return None
+    row = cursor.fetchone()
+    # PostgreSQL reports a negative or zero count for unanalyzed tables
+    if row is None or row[0] is None or row[0] <= 0:
+        return None
+    return int(row[0])
+
+
+def bounded_count(queryset, limit):
+    """
+    Counts the rows of ``queryset``, stopping at ``limit``.
+    """
+    ids = queryset.order_by().values_list('pk', flat=True)[:limit]
+    sql, params = ids.query.get_compiler(ids.db).as_sql()
+    cursor = connections[ids.db].cursor()
+    cursor.execute('SELECT COUNT(*) FROM (%s) bounded' % sql, params)
+    return cursor.fetchone()[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that never counts a whole table: an unfiltered queryset is
+    counted from the database's statistics, anything else is counted up to
+    ``count_limit`` rows. ``estimated`` and ``capped`` tell which happened.
+    """
+    count_limit = DEFAULT_COUNT_LIMIT
+
+    def __init__(self, *args, **kwargs):
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+        self.estimated = self.capped = False
+
+    def _get_count(self):
+        if self._count is None:
+            queryset = self.object_list
+            count = None
+            if not queryset.query.where:
+                count = estimated_count(queryset)
+                self.estimated = count is not None
+            if count is None:
+                count = bounded_count(queryset, self.count_limit)
+                self.capped = count >= self.count_limit
+            self._count = count
+        return self._count
+    count = property(_get_count)
+
+
+def search_filter(term):
+    """
+    Returns the filter for a changelist search: links whose URL starts with
+    ``term``, or whose code is ``term``. Both are index lookups, unlike the
+    admin's default ``icontains`` search.
+    """
+    condition = Q(url__startswith=term)
+    try:
+        link_id = base62.to_decimal(term)
+    except DecodingError:
+        return condition
+    return condition | Q(id=link_id)
+
+
+class LinkChangeList(ChangeList):
+    """
+    A changelist for tables of millions of links.
+
+    Searches use ``search_filter``, counts come from EstimatedCountPaginator,
+    and when the links are ordered by id, the default, pages are read from
+    after the last id of the previous page (carried in the ``id__lt`` or
+    ``id__gt`` filter) instead of with an OFFSET that scans every earlier
+    row. Other orderings fall back to numbered pages.
+    """
+    def get_query_set(self, request):
+        query, self.query = self.query, ''
+        try:
+            queryset = super(LinkChangeList, self).get_query_set(request)
+        finally:
+            self.query = query
+        if query.strip():
+            queryset = queryset.filter(search_filter(query.strip()))
+        return queryset
+
+    def keyset_lookup(self):
+        """
+        Returns the filter continuing after an id in the current ordering,
+        or None if the links are not ordered by id.
+        """
+        ordering = self.query_set.query.order_by
+        if not ordering or any(field.lstrip('-') not in ('id', 'pk')
+                               for field in ordering):
+            return None
+        if ordering[0].startswith('-'):
+            return 'id__lt'
+        return 'id__gt'
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(
+            request, self.query_set, self.list_per_page)
+        self.paginator = paginator
+        self.result_count = paginator.count
+        if not self.query_set.query.where:
+            self.full_result_count = self.result_count
+        else:
+            self.full_result_count = self.model_admin.get_paginator(
+                request, self.root_query_set, self.list_per_page).count
+        self.can_show_all = False
+        self.lookup = self.keyset_lookup()
+        self.first_page_url = self.next_page_url = None
+        if self.lookup is not None:
+            cursors = ['id__lt', 'id__gt']
+            rows = list(self.query_set[:self.list_per_page + 1])
+            self.result_list = rows[:self.list_per_page]
+            if len(rows) > self.list_per_page:
+                self.next_page_url = self.get_query_string(
+                    {self.lookup: self.result_list[-1].id}, cursors)
+            if any(cursor in self.params for cursor in cursors):
+                self.first_page_url = self.get_query_string(remove=cursors)
+            self.multi_page = bool(self.next_page_url or self.first_page_url)
+            return
+        self.multi_page = self.result_count > self.list_per_page
+        if not self.multi_page:
+            self.result_list = self.query_set._clone()
+            return
+        try:
+            self.result_list = paginator.page(self.page_num + 1).object_list
+        except InvalidPage:
+            raise IncorrectLookupParameters
 
 
 class LinkAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('code', 'url', 'usage_count', 'date_submitted')
+    # date ranges such as "past 7 days", which use the date_submitted index
+    list_filter = ('date_submitted',)
+    # shows the search box; the search itself is done by LinkChangeList
+    search_fields = ('url',)
+    ordering = ('-id',)
+    list_per_page = 100
+    paginator = EstimatedCountPaginator
+    actions = ['reset_usage_count', 'delete_links']
+
+    def get_changelist(self, request, **kwargs):
+        return LinkChangeList
+
+    def get_actions(self, request):
+        actions = super(LinkAdmin, self).get_actions(request)
+        # loads, and lists on its confirmation page, every selected link;
+        # delete_links confirms with a count instead
+        actions.pop('delete_selected', None)
+        return actions
+
+    def code(self, link):
+        return link.to_base62()
+    code.admin_order_field = 'id'
+
+    def reset_usage_count(self, request, queryset):
+        count = 0
+        for batch in iter_batches(queryset.values_list('id', flat=True)):
+            for db, ids in group_by_shard(batch).items():
+                count += Link.objects.using(db).filter(
+                    id__in=ids).update(usage_count=0)
+        popular_links.refresh()
+        links_version.bump()
+        self.message_user(request, 'Reset the usage count of %d links.' % count)
+    reset_usage_count.short_description = 'Reset the usage count of the selected links'
+
+    def delete_links(self, request, queryset):
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        if not request.POST.get('post'):
+            return self.delete_links_confirmation(request, queryset)
+        count = 0
+        for batch in iter_batches(queryset.values_list('id', flat=True)):
+            for db, ids in group_by_shard(batch).items():
+                Link.objects.using(db).filter(id__in=ids).delete()
+                count += len(ids)
+        self.message_user(request, 'Deleted %d links.' % count)
+    delete_links.short_description = 'Delete the selected links'
+
+    def delete_links_confirmation(self, request, queryset):
+        """
+        Asks for confirmation before delete_links runs, showing how many
+        links are selected, counted as the changelist counts them, rather
+        than listing them.
+        """
+        opts = self.model._meta
+        paginator = self.get_paginator(request, queryset, self.list_per_page)
+        return TemplateResponse(
+            request, 'admin/shortener/link/delete_links_confirmation.html', {
+                'title': 'Are you sure?',
+                'opts': opts,
+                'app_label': opts.app_label,
+                'paginator': paginator,
+                'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+                'select_across': request.POST.get('select_across') == '1',
+                'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            }, current_app=self.admin_site.name)
 
 
 admin.site.register(Link, LinkAdmin)
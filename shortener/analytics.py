@@ -0,0 +1,163 @@
+import datetime
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from shortener.batches import QUERY_BATCH_SIZE, chunks
+from shortener.hll import HyperLogLog
+from shortener.models import (
+    ClickEvent, DailyClicks, DailyVisitors, HourlyClicks)
+from shortener.routers import databases_for
+
+
+ROLLUP_VERSION_KEY = 'shortener:rollup-version'
+
+
+def truncate_to_hour(dt):
+    return dt.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0)
+
+
+def truncate_to_day(dt):
+    return dt.astimezone(timezone.utc).date()
+
+
+def add_to_buckets(model, field, counts, using=None):
+    """
+    Adds ``counts``, a dict mapping (link id, bucket) to a number of clicks,
+    to the rollup ``model`` whose bucket column is ``field``. Existing
+    buckets are incremented and missing ones are created in bulk.
+    """
+    objects = model.objects.using(using)
+    keys = counts.keys()
+    existing = set()
+    for batch in chunks(keys):
+        existing.update(objects.filter(
+            link__in=set(link_id for link_id, bucket in batch),
+            **{field + '__in': set(bucket for link_id, bucket in batch)}
+        ).values_list('link', field))
+    for link_id, bucket in existing.intersection(keys):
+        objects.filter(link=link_id, **{field: bucket}).update(
+            count=F('count') + counts[link_id, bucket])
+    objects.bulk_create([
+        model(link_id=link_id, count=count, **{field: bucket})
+        for (link_id, bucket), count in counts.iteritems()
+        if (link_id, bucket) not in existing], batch_size=QUERY_BATCH_SIZE)
+
+
+def add_sketches(sketches, using=None):
+    """
+    Merges ``sketches``, a dict mapping (link id, day) to a HyperLogLog of
+    visitors, into the DailyVisitors rows of the same link and day. Must be
+    called in a transaction, which holds the rows being merged into.
+    """
+    objects = DailyVisitors.objects.using(using)
+    keys = sketches.keys()
+    existing = {}
+    for batch in chunks(keys):
+        for row in objects.select_for_update().filter(
+                link__in=set(link_id for link_id, day in batch),
+                day__in=set(day for link_id, day in batch)):
+            if (row.link_id, row.day) in sketches:
+                existing[row.link_id, row.day] = row
+    for key, row in existing.iteritems():
+        sketch = HyperLogLog.decode(row.sketch)
+        sketch.merge(sketches[key])
+        objects.filter(id=row.id).update(sketch=sketch.encode())
+    objects.bulk_create([
+        DailyVisitors(link_id=link_id, day=day, sketch=sketch.encode())
+        for (link_id, day), sketch in sketches.iteritems()
+        if (link_id, day) not in existing], batch_size=QUERY_BATCH_SIZE)
+
+
+def roll_up_clicks(batch_size=10000):
+    """
+    Aggregates click events into hourly and daily buckets and deletes them,
+    ``batch_size`` events per transaction. Returns the number of events that
+    were rolled up.
+    """
+    rolled_up = 0
+    for db in databases_for(ClickEvent):
+        while True:
+            # read inside the transaction so that a replica is not used
+            with transaction.commit_on_success(using=db):
+                events = list(ClickEvent.objects.using(db).order_by(
+                    'id').values_list('id', 'link', 'clicked_at')[:batch_size])
+                if not events:
+                    break
+                hourly = defaultdict(int)
+                daily = defaultdict(int)
+                for event_id, link_id, clicked_at in events:
+                    hourly[link_id, truncate_to_hour(clicked_at)] += 1
+                    daily[link_id, truncate_to_day(clicked_at)] += 1
+                add_to_buckets(HourlyClicks, 'hour', hourly, using=db)
+                add_to_buckets(DailyClicks, 'day', daily, using=db)
+                # a flush may have committed lower ids since they were read
+                for batch in chunks([event[0] for event in events]):
+                    ClickEvent.objects.using(db).filter(
+                        id__in=batch).delete()
+            rolled_up += len(events)
+    if rolled_up:
+        cache.set(ROLLUP_VERSION_KEY, time.time())
+    return rolled_up
+
+
+def rollup_version():
+    """
+    Returns a value that changes whenever clicks are rolled up, for
+    validating cached pages showing click counts.
+    """
+    return cache.get(ROLLUP_VERSION_KEY, 0)
+
+
+def compact_hourly_clicks(days):
+    """
+    Deletes hourly buckets older than ``days`` days; their clicks remain
+    counted in the daily buckets.
+    """
+    cutoff = truncate_to_hour(timezone.now()) - datetime.timedelta(days=days)
+    for db in databases_for(HourlyClicks):
+        HourlyClicks.objects.using(db).filter(hour__lt=cutoff).delete()
+
+
+def hourly_series(link, hours=24):
+    """
+    Returns a list of (hour, clicks) pairs for the last ``hours`` hours,
+    including hours without clicks.
+    """
+    end = truncate_to_hour(timezone.now())
+    start = end - datetime.timedelta(hours=hours - 1)
+    counts = dict(HourlyClicks.objects.using(link._state.db).filter(
+        link=link, hour__gte=start).values_list('hour', 'count'))
+    return [(hour, counts.get(hour, 0)) for hour in (
+        start + datetime.timedelta(hours=i) for i in xrange(hours))]
+
+
+def daily_series(link, days=30):
+    """
+    Returns a list of (day, clicks) pairs for the last ``days`` days,
+    including days without clicks.
+    """
+    end = truncate_to_day(timezone.now())
+    start = end - datetime.timedelta(days=days - 1)
+    counts = dict(DailyClicks.objects.using(link._state.db).filter(
+        link=link, day__gte=start).values_list('day', 'count'))
+    return [(day, counts.get(day, 0)) for day in (
+        start + datetime.timedelta(days=i) for i in xrange(days))]
+
+
+def unique_visitors(link, days=30):
+    """
+    Returns the estimated number of distinct visitors of ``link`` over the
+    last ``days`` days, merging its daily sketches.
+    """
+    start = truncate_to_day(timezone.now()) - datetime.timedelta(days=days - 1)
+    total = HyperLogLog()
+    for sketch in DailyVisitors.objects.using(link._state.db).filter(
+            link=link, day__gte=start).values_list('sketch', flat=True):
+        total.merge(HyperLogLog.decode(sketch))
+    return total.count()
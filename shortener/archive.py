@@ -0,0 +1,107 @@
+"""
+Archiving of inactive links.
+
+Links that have not been followed for a long time are moved out of the
+links table into ArchivedLink, which has none of its indexes, so that the
+links table and its indexes only hold the links in use. An archived link
+keeps its id and therefore its short code: ``info``, the API and redirects
+read it from the archive, and it is moved back into the links table once it
+is followed often enough again.
+
+The click counts, visitor sketches and target check of an archived link are
+deleted with it; keep links for longer than the info page's 30 days of
+history.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from shortener.batches import QUERY_BATCH_SIZE, iter_batches
+from shortener.cache import link_cache, links_version
+from shortener.models import (
+    ArchivedLink, ClickEvent, DailyClicks, DailyVisitors, HourlyClicks, Link,
+    LinkCheck, popular_links, recent_links)
+from shortener.routers import databases_for
+
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = QUERY_BATCH_SIZE
+
+# the rows belonging to a link, deleted when it is archived
+RELATED_MODELS = (
+    ClickEvent, HourlyClicks, DailyClicks, DailyVisitors, LinkCheck)
+
+
+def archive_cutoff(days=None):
+    """
+    Returns the time before which links were last followed to be archived,
+    ``days`` (by default SHORTENER_ARCHIVE_AFTER_DAYS) days ago.
+    """
+    if days is None:
+        days = getattr(settings, 'SHORTENER_ARCHIVE_AFTER_DAYS',
+                       DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def inactive(cutoff):
+    """
+    Returns the filter of links not followed since ``cutoff``; links never
+    followed count from their submission.
+    """
+    return (Q(last_followed__lt=cutoff) |
+            Q(last_followed__isnull=True, date_submitted__lt=cutoff))
+
+
+def archive_links(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Moves the links not followed since ``cutoff`` into the archive, in one
+    transaction per ``batch_size`` links. Returns the number of links
+    archived.
+
+    Links are found by walking the primary key, so that last_followed,
+    which every click flush writes, needs no index.
+    """
+    archived = 0
+    for db in databases_for(Link):
+        links = Link.objects.using(db).filter(inactive(cutoff))
+        for link_ids in iter_batches(links.values_list('id', flat=True),
+                                     batch_size):
+            archived += archive_batch(db, link_ids, cutoff)
+    if archived:
+        links_version.bump()
+    return archived
+
+
+def archive_batch(db, link_ids, cutoff):
+    """
+    Moves the links with the given ids in database ``db`` that are still
+    inactive into the archive in one transaction. Returns the number of
+    links archived.
+    """
+    db = db or router.db_for_write(Link)
+    with transaction.commit_on_success(using=db):
+        # a click may have been flushed since the ids were read
+        links = list(Link.objects.using(db).select_for_update().filter(
+            inactive(cutoff), id__in=link_ids))
+        if not links:
+            return 0
+        link_ids = [link.id for link in links]
+        ArchivedLink.objects.using(db).bulk_create(
+            [ArchivedLink.from_link(link) for link in links])
+        for model in RELATED_MODELS:
+            model.objects.using(db).filter(link__in=link_ids).delete()
+        # a queryset delete would send post_delete for each link, which
+        # records them as missing from the link filter
+        connection = connections[db]
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (
+            connection.ops.quote_name(Link._meta.db_table),
+            ', '.join(['%s'] * len(link_ids))), link_ids)
+    for link_id in link_ids:
+        link_cache.delete(link_id)
+        recent_links.remove(link_id)
+        popular_links.remove(link_id)
+    return len(link_ids)
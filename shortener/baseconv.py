@@ -16,12 +16,24 @@ class DecodingError(ValueError):
     pass
 
 
+class DecodingOverflowError(DecodingError, OverflowError):
+    """
+    The decoded value does not fit in the converter's max_value
+    """
+    pass
+
+
 class BaseConverter(object):
     """
     Convert numbers from base 10 integers to base X strings and back again.
 
     Original: http://www.djangosnippets.org/snippets/1431/
 
+    If ``max_value`` is given, decoding a string whose value lies outside of
+    ``[-max_value - 1, max_value]`` raises a DecodingOverflowError. Strings
+    with more digits than such a value can have are rejected without being
+    decoded at all.
+
     Sample usage:
 
     >>> base20 = BaseConverter('0123456789abcdefghij')
@@ -29,51 +41,110 @@ class BaseConverter(object):
     '31e'
     >>> base20.to_decimal('31e')
     1234
+    >>> base20.encode_many([1, 20])
+    ['1', '10']
+    >>> base20.decode_many(['1', '10'])
+    [1, 20]
     """
     decimal_digits = string.digits
 
-    def __init__(self, digits):
+    def __init__(self, digits, max_value=None):
         self.digits = digits
+        self.base = len(digits)
+        self.values = dict((char, value) for value, char in enumerate(digits))
+        self.charset = frozenset(digits)
+        self.max_value = max_value
+        if max_value is None:
+            self.max_length = None
+        else:
+            self.max_length = len(self.from_decimal(max_value + 1))
 
     def from_decimal(self, i):
-        if not isinstance(i, numbers.Real):
+        if not isinstance(i, numbers.Integral):
             raise EncodingError('%s is not an int()' % i)
-        return self.convert(i, self.decimal_digits, self.digits)
+        digits = self.digits
+        base = self.base
+        if i == 0:
+            return digits[0]
+        x = -i if i < 0 else i
+        res = []
+        while x:
+            x, digit = divmod(x, base)
+            res.append(digits[digit])
+        if i < 0:
+            res.append('-')
+        res.reverse()
+        return ''.join(res)
 
     def to_decimal(self, s):
         if not isinstance(s, basestring):
             raise DecodingError('%s is not a basestring()' % s)
-        for index, char in enumerate(s):
-            if char not in self.digits and not char == '-' and not index == 0:
-                raise DecodingError('Invalid character for encoding: %s' % char)
-        return int(self.convert(s, self.digits, self.decimal_digits))
+        neg = s[:1] == '-'
+        digits = s[1:] if neg else s
+        if not digits:
+            raise DecodingError('Nothing to decode')
+        if not self.charset.issuperset(digits):
+            for char in digits:
+                if char not in self.charset:
+                    raise DecodingError(
+                        'Invalid character for encoding: %s' % char)
+        if self.max_length is not None and len(digits) > self.max_length:
+            raise DecodingOverflowError('%s is too long to decode' % s)
+
+        values = self.values
+        base = self.base
+        x = 0
+        for char in digits:
+            x = x * base + values[char]
+        if self.max_value is not None and x > self.max_value + neg:
+            raise DecodingOverflowError('%s is too large to decode' % s)
+        return -x if neg else x
+
+    def encode_many(self, numbers):
+        """
+        Encodes each of ``numbers``, returning a list of strings.
+        """
+        from_decimal = self.from_decimal
+        return [from_decimal(i) for i in numbers]
+
+    def decode_many(self, strings):
+        """
+        Decodes each of ``strings``, returning a list of integers.
+        """
+        to_decimal = self.to_decimal
+        return [to_decimal(s) for s in strings]
 
     @staticmethod
     def convert(number, fromdigits, todigits):
-        # Based on http://code.activestate.com/recipes/111286/
-        if str(number)[0] == '-':
-            number = str(number)[1:]
+        """
+        Converts the string representation of ``number`` from the base given
+        by ``fromdigits`` to the base given by ``todigits``.
+        """
+        number = str(number)
+        if number[0] == '-':
+            number = number[1:]
             neg = 1
         else:
             neg = 0
 
         # make an integer out of the number
+        values = dict((char, value) for value, char in enumerate(fromdigits))
         x = 0
-        for digit in str(number):
-            x = x * len(fromdigits) + fromdigits.index(digit)
+        for digit in number:
+            x = x * len(fromdigits) + values[digit]
 
         # create the result in base 'len(todigits)'
         if x == 0:
-            res = todigits[0]
-        else:
-            res = ''
-            while x > 0:
-                digit = x % len(todigits)
-                res = todigits[digit] + res
-                x = int(x / len(todigits))
-            if neg:
-                res = '-' + res
-        return res
-
-
-base62 = BaseConverter(string.digits + string.letters)
+            return todigits[0]
+        res = []
+        while x:
+            x, digit = divmod(x, len(todigits))
+            res.append(todigits[digit])
+        if neg:
+            res.append('-')
+        res.reverse()
+        return ''.join(res)
+
+
+# ids are decoded into Link.id, a signed 64 bit integer column
+base62 = BaseConverter(string.digits + string.letters, max_value=2 ** 63 - 1)
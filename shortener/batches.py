@@ -0,0 +1,57 @@
+"""
+Reading and writing rows in batches.
+"""
+import itertools
+
+from django.db import models
+
+
+# keep the IN lists of queries well below SQLite's limit on query parameters
+QUERY_BATCH_SIZE = 500
+
+
+def chunks(items, size=QUERY_BATCH_SIZE):
+    """
+    Yields consecutive slices of up to ``size`` items of the list ``items``.
+
+    >>> list(chunks([1, 2, 3, 4, 5], 2))
+    [[1, 2], [3, 4], [5]]
+    """
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
+def row_id(row):
+    if isinstance(row, models.Model):
+        return row.pk
+    if isinstance(row, tuple):
+        return row[0]
+    return row
+
+
+def iter_batches(queryset, size=QUERY_BATCH_SIZE, after=None):
+    """
+    Yields the rows of ``queryset`` in id order, in lists of up to ``size``
+    rows. Each list is read with one query continuing after the last id
+    read, or after ``after``, rather than using OFFSET, so every query is an
+    index range scan and memory use does not grow with the table. The rows
+    of a ``values_list`` queryset must start with the id.
+    """
+    queryset = queryset.order_by('id')
+    while True:
+        batch = queryset
+        if after is not None:
+            batch = batch.filter(id__gt=after)
+        batch = list(batch[:size])
+        if not batch:
+            return
+        yield batch
+        after = row_id(batch[-1])
+
+
+def iter_rows(queryset, size=QUERY_BATCH_SIZE):
+    """
+    Yields the rows of ``queryset`` in id order, reading them with
+    ``iter_batches``.
+    """
+    return itertools.chain.from_iterable(iter_batches(queryset, size))
@@ -0,0 +1,339 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from shortener.batches import iter_rows
+from shortener.cache import LRUCache
+from shortener.files import WatchedFile, atomic_write, file_id
+from shortener.routers import databases_for
+
+
+DEFAULT_LINK_FILTER_CAPACITY = 1000000
+DEFAULT_LINK_FILTER_ERROR_RATE = 0.01
+DEFAULT_LINK_FILTER_REFRESH_INTERVAL = 15 * 60
+DEFAULT_LINK_FILTER_MISS_TIMEOUT = 10
+DEFAULT_LINK_FILTER_MISS_CACHE_SIZE = 10000
+
+# number of ids read per query while building a filter
+SCAN_BATCH_SIZE = 10000
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of integers backed by a bytearray, or by a shared memory
+    map of a file written with ``save``.
+
+    >>> bloom = BloomFilter.for_capacity(1000, 0.01)
+    >>> bloom.add(42)
+    >>> 42 in bloom, 43 in bloom
+    (True, False)
+    """
+    magic = b'SBF1'
+    header = struct.Struct('<4sIQ')
+
+    def __init__(self, num_bits, num_hashes, bits=None, offset=0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        if bits is None:
+            bits = bytearray((num_bits + 7) // 8)
+        self.bits = bits
+        self.offset = offset
+        # mmap items are one character strings rather than integers
+        self._mapped = isinstance(bits, mmap.mmap)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """
+        Returns an empty filter sized to hold ``capacity`` items with a false
+        positive rate of ``error_rate``.
+        """
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, int(round(num_bits * math.log(2) / capacity)))
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps the filter saved at ``path``. Bits added to it are written to
+        the file and seen by every process that has it mapped.
+        """
+        with open(path, 'r+b') as f:
+            bits = mmap.mmap(f.fileno(), 0)
+        magic, num_hashes, num_bits = cls.header.unpack_from(bits)
+        if magic != cls.magic:
+            bits.close()
+            raise ValueError('%s is not a Bloom filter' % path)
+        return cls(num_bits, num_hashes, bits, offset=cls.header.size)
+
+    def save(self, path):
+        """
+        Writes the filter to ``path``, replacing any existing file
+        atomically.
+        """
+        with atomic_write(path) as f:
+            f.write(self.header.pack(
+                self.magic, self.num_hashes, self.num_bits))
+            f.write(bytes(self.bits[self.offset:]))
+
+    def close(self):
+        if self._mapped:
+            self.bits.close()
+
+    def positions(self, value):
+        digest = hashlib.md5(struct.pack('<q', value)).digest()
+        first, second = struct.unpack('<QQ', digest)
+        for i in xrange(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, value):
+        bits = self.bits
+        for position in self.positions(value):
+            index = self.offset + (position >> 3)
+            if self._mapped:
+                bits[index] = chr(ord(bits[index]) | 1 << (position & 7))
+            else:
+                bits[index] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        bits = self.bits
+        for position in self.positions(value):
+            byte = bits[self.offset + (position >> 3)]
+            if self._mapped:
+                byte = ord(byte)
+            if not byte & 1 << (position & 7):
+                return False
+        return True
+
+
+class LinkFilter(object):
+    """
+    Answers whether a link id may exist without querying the database, so
+    that requests for codes that were never created are rejected cheaply.
+
+    A Bloom filter of every id of ``model``, and of ``archive_model`` if
+    given, is built from a scan of the tables, then kept up to date as links
+    are saved. It is rebuilt in the
+    background every ``refresh_interval`` seconds, which also drops the ids
+    of deleted links. With ``path``, the filter is saved to that file and
+    memory mapped, so that the processes on a host share one copy; a process
+    that finds the file older than ``refresh_interval`` rebuilds it and the
+    others map the new file when they next notice it changed.
+
+    Links saved by other processes are only added to the local filter when
+    it is next rebuilt (or straight away when the file is shared), so the
+    filter must only be consulted after the redirect cache, where every new
+    link is put. In case they were evicted from it, each process records in
+    Django's cache when it added each link; an id missing from the filter
+    but recorded after the filter was scanned is looked up in the database.
+    Ids found missing from the database are remembered for ``miss_timeout``
+    seconds.
+
+    Enabled by the ``SHORTENER_LINK_FILTER`` setting and configured with the
+    ``SHORTENER_LINK_FILTER_CAPACITY``, ``SHORTENER_LINK_FILTER_ERROR_RATE``,
+    ``SHORTENER_LINK_FILTER_PATH``, ``SHORTENER_LINK_FILTER_REFRESH_INTERVAL``
+    and ``SHORTENER_LINK_FILTER_MISS_TIMEOUT`` settings.
+    """
+    # when a link was added by any process
+    added_key_prefix = 'shortener:link-filter-added:'
+
+    def __init__(self, model, capacity=None, error_rate=None, path=None,
+                 refresh_interval=None, miss_timeout=None, archive_model=None):
+        self.model = model
+        self.archive_model = archive_model
+        self.capacity = capacity or getattr(
+            settings, 'SHORTENER_LINK_FILTER_CAPACITY',
+            DEFAULT_LINK_FILTER_CAPACITY)
+        self.error_rate = error_rate or getattr(
+            settings, 'SHORTENER_LINK_FILTER_ERROR_RATE',
+            DEFAULT_LINK_FILTER_ERROR_RATE)
+        self.path = path or getattr(
+            settings, 'SHORTENER_LINK_FILTER_PATH', None)
+        self.refresh_interval = refresh_interval or getattr(
+            settings, 'SHORTENER_LINK_FILTER_REFRESH_INTERVAL',
+            DEFAULT_LINK_FILTER_REFRESH_INTERVAL)
+        if miss_timeout is None:
+            miss_timeout = getattr(
+                settings, 'SHORTENER_LINK_FILTER_MISS_TIMEOUT',
+                DEFAULT_LINK_FILTER_MISS_TIMEOUT)
+        self.misses = LRUCache(DEFAULT_LINK_FILTER_MISS_CACHE_SIZE,
+                               miss_timeout)
+        self.file = WatchedFile(self.path, BloomFilter.load)
+        self._filter = None
+        self._built_at = 0
+        self._added = set()
+        self._building = False
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'SHORTENER_LINK_FILTER', False)
+
+    def iter_ids(self, db=None, model=None):
+        """
+        Yields the id of every link, or row of ``model``, in database ``db``,
+        SCAN_BATCH_SIZE at a time.
+        """
+        model = model or self.model
+        return iter_rows(model.objects.using(db).values_list('id', flat=True),
+                         SCAN_BATCH_SIZE)
+
+    def build(self):
+        """
+        Returns a new filter of the ids of all links, with room for the
+        table to double in size.
+        """
+        models = [model for model in (self.model, self.archive_model)
+                  if model is not None]
+        count = sum(model.objects.using(db).count() for model in models
+                    for db in databases_for(model))
+        bloom = BloomFilter.for_capacity(
+            max(self.capacity, count * 2), self.error_rate)
+        for model in models:
+            for db in databases_for(model):
+                for link_id in self.iter_ids(db, model):
+                    bloom.add(link_id)
+        return bloom
+
+    def load(self):
+        """
+        Builds the filter, or maps the shared file if it is fresh enough.
+        Call it at startup to avoid building the filter in a request.
+        """
+        if self.path is not None and self._file_is_fresh():
+            self._install(self.file.current(), self.file.modified_at)
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._building = True
+            self._added = set()
+        try:
+            # links added by other processes during the scan may be missing
+            built_at = time.time()
+            bloom = self.build()
+            if self.path is not None:
+                bloom.save(self.path)
+                os.utime(self.path, (built_at, built_at))
+                self.file.reset()
+                bloom = self.file.current()
+                built_at = self.file.modified_at
+        except Exception:
+            with self._lock:
+                self._building = False
+            raise
+        self._install(bloom, built_at)
+
+    def _install(self, bloom, built_at):
+        with self._lock:
+            if self._building:
+                # links saved while the table was being scanned
+                for link_id in self._added:
+                    bloom.add(link_id)
+                self._building = False
+                self._added = set()
+            self._filter = bloom
+            self._built_at = built_at
+
+    def _file_is_fresh(self):
+        current_id = file_id(self.path)
+        return (current_id is not None and
+                time.time() - current_id[1] < self.refresh_interval)
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def current(self):
+        """
+        Returns the filter, loading it on first use and starting a rebuild
+        in a background thread once it is out of date.
+        """
+        if self._filter is None:
+            self.load()
+            return self._filter
+        if self.path is not None:
+            mapped = self.file.current()
+            if mapped is not None and mapped is not self._filter:
+                # another process replaced the file
+                self._install(mapped, self.file.modified_at)
+        now = time.time()
+        if now - self._built_at > self.refresh_interval and not self._rebuilding:
+            self._rebuilding = True
+            thread = threading.Thread(target=self._rebuild_in_background)
+            thread.daemon = True
+            thread.start()
+        return self._filter
+
+    def might_exist(self, link_id):
+        """
+        Returns False if there is certainly no link with ``link_id``.
+        """
+        if not self.enabled:
+            return True
+        if self.misses.get(link_id) is not None:
+            return False
+        if link_id in self.current():
+            return True
+        return self.added_since_built(link_id)
+
+    def make_added_key(self, link_id):
+        return '%s%d' % (self.added_key_prefix, link_id)
+
+    def added_since_built(self, link_id):
+        """
+        Returns True if a process added ``link_id`` after the filter was
+        scanned.
+        """
+        return cache.get(self.make_added_key(link_id), 0) >= self._built_at
+
+    def add(self, link_id):
+        self.add_many([link_id])
+
+    def add_many(self, link_ids):
+        """
+        Adds the ids of links created without sending post_save.
+        """
+        link_ids = list(link_ids)
+        if link_ids and self.enabled:
+            # every filter in use is rebuilt within refresh_interval
+            now = time.time()
+            cache.set_many(dict((self.make_added_key(link_id), now)
+                                for link_id in link_ids),
+                           self.refresh_interval * 2)
+        with self._lock:
+            for link_id in link_ids:
+                self.misses.delete(link_id)
+                if self._filter is not None:
+                    self._filter.add(link_id)
+                if self._building:
+                    self._added.add(link_id)
+
+    def record_miss(self, link_id):
+        if self.enabled:
+            self.misses.set(link_id, True)
+
+    def reset(self):
+        """
+        Drops the filter and the remembered misses; the filter is rebuilt on
+        next use.
+        """
+        with self._lock:
+            self._filter = None
+            self._built_at = 0
+            self.misses.clear()
+        self.file.reset()
@@ -0,0 +1,135 @@
+from django.db import IntegrityError, router, transaction
+
+from shortener.batches import QUERY_BATCH_SIZE, chunks
+from shortener.cache import link_cache, links_version
+from shortener.models import (
+    ArchivedLink, hash_url, id_allocator, Link, link_filter, normalize_url,
+    recent_links)
+from shortener.routers import databases_for, group_by_shard, shard_for
+
+
+def taken_ids(ids):
+    """
+    Returns the subset of ``ids`` that belong to existing links, active or
+    archived, using one query per QUERY_BATCH_SIZE ids and table.
+    """
+    taken = set()
+    for db, ids in group_by_shard(ids).iteritems():
+        for model in (Link, ArchivedLink):
+            links = model.objects.using(db or router.db_for_write(model))
+            for batch in chunks(ids):
+                taken.update(links.filter(
+                    id__in=batch).values_list('id', flat=True))
+    return taken
+
+
+def existing_links_by_url(urls):
+    """
+    Returns a dict mapping the normalized form of each of ``urls`` that has
+    already been shortened to the oldest such link, using one query per
+    QUERY_BATCH_SIZE urls.
+    """
+    hashes = list(set(hash_url(url) for url in urls))
+    found = []
+    for db in databases_for(Link):
+        links = Link.objects.using(db or router.db_for_write(Link))
+        for batch in chunks(hashes):
+            found.extend(links.filter(url_hash__in=batch))
+    # newest first, so that the oldest link for each URL wins
+    found.sort(key=lambda link: link.id, reverse=True)
+    return dict((normalize_url(link.url), link) for link in found)
+
+
+def create_links(entries, deduplicate=False):
+    """
+    Inserts a link for each ``(url, custom_id)`` pair in ``entries`` using
+    bulk inserts, one transaction per database. ``custom_id`` is None for
+    links that should get an auto-generated id.
+
+    Returns a list with one item per entry: the created Link, or None when
+    the entry's custom id is already taken (either by an existing link or
+    by an earlier entry). With ``deduplicate``, entries without a custom id
+    whose URL has already been shortened get the existing Link instead.
+    """
+    custom_ids = set(custom_id for url, custom_id in entries
+                     if custom_id is not None)
+    auto_count = sum(1 for url, custom_id in entries if custom_id is None)
+    # reserving id blocks is done outside of any transaction; ids that end
+    # up unused are simply skipped
+    auto_ids = id_allocator.allocate(auto_count, exclude=custom_ids)
+    results, links = _plan_links(
+        entries, custom_ids, iter(auto_ids), deduplicate)
+
+    by_db = {}
+    for link in links:
+        by_db.setdefault(shard_for(link.id), []).append(link)
+    rejected = set()
+    for db, links in by_db.iteritems():
+        try:
+            with transaction.commit_on_success(using=db):
+                Link.objects.using(db).bulk_create(
+                    links, batch_size=QUERY_BATCH_SIZE)
+        except IntegrityError:
+            # an id was claimed concurrently, either one of the custom ids
+            # or one of the allocated ones
+            rejected.update(_insert_links(links, custom_ids))
+    results = [None if link in rejected else link for link in results]
+
+    # bulk_create does not send post_save
+    created = [link for link in results if link is not None]
+    link_cache.set_many(dict((link.id, link.url) for link in created))
+    link_filter.add_many(link.id for link in created)
+    recent_links.update_links(created)
+    if created:
+        links_version.bump()
+    return results
+
+
+def _plan_links(entries, custom_ids, auto_ids, deduplicate):
+    """
+    Returns the list of results for ``create_links`` and the list of new
+    links to insert.
+    """
+    taken = taken_ids(custom_ids)
+    existing = {}
+    if deduplicate:
+        existing = existing_links_by_url(
+            url for url, custom_id in entries if custom_id is None)
+
+    results = []
+    links = []
+    for url, custom_id in entries:
+        if custom_id is None:
+            normalized = normalize_url(url)
+            if normalized in existing:
+                results.append(existing[normalized])
+                continue
+            link = Link(id=next(auto_ids), url=url, url_hash=hash_url(url))
+            if deduplicate:
+                existing[normalized] = link
+        elif custom_id in taken:
+            link = None
+        else:
+            taken.add(custom_id)
+            link = Link(id=custom_id, url=url, url_hash=hash_url(url))
+        if link is not None:
+            links.append(link)
+        results.append(link)
+    return results, links
+
+
+def _insert_links(links, custom_ids):
+    """
+    Inserts ``links`` one at a time after their bulk insert failed, and
+    returns the set of links whose custom id turned out to be taken. Links
+    with an auto-generated id are given a new one if theirs was taken.
+    """
+    rejected = set()
+    for link in links:
+        if link.id in custom_ids:
+            if not Link.objects.insert(link):
+                rejected.add(link)
+        else:
+            link.id = None
+            link.save()
+    return rejected
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_LOCAL_TIMEOUT = 60
+DEFAULT_CACHE_TIMEOUT = 60 * 60
+
+# backends whose entries the other processes never see
+UNSHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared():
+    """
+    Returns True if Django's default cache is shared between processes, so
+    that what one process writes to it, such as the deletion of a link, is
+    seen by the others.
+    """
+    return settings.CACHES['default']['BACKEND'] not in UNSHARED_CACHE_BACKENDS
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, least-recently-used mapping whose entries expire
+    after ``timeout`` seconds.
+
+    >>> lru = LRUCache(max_size=2, timeout=60)
+    >>> lru.set('a', 1)
+    >>> lru.set('b', 2)
+    >>> lru.get('a')
+    1
+    >>> lru.set('c', 3)
+    >>> lru.get('b') is None
+    True
+    """
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            # re-insert so that the key becomes the most recently used
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.timeout)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LinkCache(object):
+    """
+    Two-tier cache mapping a link id (the decoded base62 code) to the URL it
+    redirects to.
+
+    The first tier is a bounded in-process LRU, the second tier is Django's
+    cache framework, which is shared between processes when it is backed by
+    memcached or similar. Entries in the local tier expire quickly so that
+    changes made by other processes are picked up. The deletions and edits
+    of other processes are only seen through a shared backend, so with a
+    local one the second tier keeps entries no longer than the first.
+
+    Configured with the ``SHORTENER_CACHE_SIZE``,
+    ``SHORTENER_CACHE_LOCAL_TIMEOUT`` and ``SHORTENER_CACHE_TIMEOUT`` settings.
+    """
+    key_prefix = 'shortener:link:'
+
+    def __init__(self, max_size=None, local_timeout=None, timeout=None):
+        if max_size is None:
+            max_size = getattr(
+                settings, 'SHORTENER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        if local_timeout is None:
+            local_timeout = getattr(
+                settings, 'SHORTENER_CACHE_LOCAL_TIMEOUT',
+                DEFAULT_CACHE_LOCAL_TIMEOUT)
+        if timeout is None:
+            timeout = getattr(
+                settings, 'SHORTENER_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+        if not cache_is_shared():
+            timeout = min(timeout, local_timeout)
+        self.timeout = timeout
+        self.local = LRUCache(max_size, local_timeout)
+        self.reset_stats()
+
+    def make_key(self, link_id):
+        return '%s%d' % (self.key_prefix, link_id)
+
+    def get(self, link_id):
+        """
+        Returns the cached URL for ``link_id``, or None on a miss in both
+        tiers.
+        """
+        url = self.local.get(link_id)
+        if url is not None:
+            self.local_hits += 1
+            return url
+        url = cache.get(self.make_key(link_id))
+        if url is not None:
+            self.shared_hits += 1
+            self.local.set(link_id, url)
+            return url
+        self.misses += 1
+        return None
+
+    def set(self, link_id, url):
+        self.local.set(link_id, url)
+        cache.set(self.make_key(link_id), url, self.timeout)
+
+    def set_many(self, urls):
+        """
+        Caches the URLs of a dict mapping link ids to URLs, with one request
+        to the shared tier.
+        """
+        for link_id, url in urls.iteritems():
+            self.local.set(link_id, url)
+        cache.set_many(dict((self.make_key(link_id), url)
+                            for link_id, url in urls.iteritems()),
+                       self.timeout)
+
+    def delete(self, link_id):
+        self.local.delete(link_id)
+        cache.delete(self.make_key(link_id))
+
+    def clear(self):
+        """
+        Empties the local tier. Shared entries are left to expire.
+        """
+        self.local.clear()
+
+    def reset_stats(self):
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'local_size': len(self.local),
+        }
+
+
+link_cache = LinkCache()
+
+
+class CacheVersion(object):
+    """
+    A counter kept in Django's cache, for building the keys of cached content
+    that is dropped by bumping the counter rather than by deleting every key.
+
+    A counter that was evicted starts again from the current time in
+    milliseconds, so that it does not return to a version already used.
+    """
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        version = cache.get(self.key)
+        if version is None:
+            version = int(time.time() * 1000)
+            cache.add(self.key, version, DEFAULT_CACHE_TIMEOUT)
+            version = cache.get(self.key, version)
+        return version
+
+    def bump(self):
+        try:
+            cache.incr(self.key)
+        except ValueError:
+            self.get()
+
+
+# the version of pages listing links, bumped when links are saved, deleted
+# or clicked
+links_version = CacheVersion('shortener:links-version')
@@ -0,0 +1,389 @@
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, IntegrityError, transaction
+from django.db.models import F
+from django.utils import six, timezone
+
+from shortener.analytics import add_sketches, truncate_to_day
+from shortener.cache import links_version
+from shortener.batches import QUERY_BATCH_SIZE, chunks
+from shortener.hll import HyperLogLog
+from shortener.models import ClickEvent, Link, popular_links
+from shortener.routers import group_by_shard
+
+
+DEFAULT_CLICK_FLUSH_THRESHOLD = 100
+DEFAULT_CLICK_FLUSH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer(object):
+    """
+    Write-behind counter for link usage.
+
+    Clicks are added up in memory per link and written to the database once
+    ``flush_threshold`` clicks are pending or ``flush_interval`` seconds have
+    passed since the last flush, whichever comes first. A flush issues one
+    UPDATE per distinct increment instead of one per click. Unless
+    ``analytics`` is off, each click is also queued as a ClickEvent and
+    inserted in bulk by the same flush.
+
+    Unless ``unique_visitors`` is off, the visitors of each link are added to
+    a HyperLogLog sketch per day, which the flush merges into DailyVisitors.
+    At most one sketch per clicked link is held, so memory stays bounded by
+    the flush threshold.
+
+    With ``background``, flushes run in a daemon thread of each process
+    instead of in the request that makes them due, so that no redirect
+    waits for the database, even while it is slow. Otherwise a failed flush
+    is logged rather than failing the request, and retried
+    ``flush_interval`` seconds later.
+
+    Configured with the ``SHORTENER_CLICK_FLUSH_THRESHOLD``,
+    ``SHORTENER_CLICK_FLUSH_INTERVAL``, ``SHORTENER_CLICK_ANALYTICS``,
+    ``SHORTENER_UNIQUE_VISITORS`` and ``SHORTENER_CLICK_FLUSH_BACKGROUND``
+    settings.
+    """
+    def __init__(self, flush_threshold=None, flush_interval=None,
+                 analytics=None, unique_visitors=None, background=None):
+        if flush_threshold is None:
+            flush_threshold = getattr(
+                settings, 'SHORTENER_CLICK_FLUSH_THRESHOLD',
+                DEFAULT_CLICK_FLUSH_THRESHOLD)
+        if flush_interval is None:
+            flush_interval = getattr(
+                settings, 'SHORTENER_CLICK_FLUSH_INTERVAL',
+                DEFAULT_CLICK_FLUSH_INTERVAL)
+        if analytics is None:
+            analytics = getattr(settings, 'SHORTENER_CLICK_ANALYTICS', True)
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        if unique_visitors is None:
+            unique_visitors = getattr(
+                settings, 'SHORTENER_UNIQUE_VISITORS', True)
+        if background is None:
+            background = getattr(
+                settings, 'SHORTENER_CLICK_FLUSH_BACKGROUND', False)
+        self.analytics = analytics
+        self.unique_visitors = unique_visitors
+        self.background = background
+        self._pending = {}
+        self._events = []
+        self._sketches = {}
+        self._pending_total = 0
+        self._first_pending = None
+        self._last_flush = time.time()
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher_pid = None
+        self._stop = threading.Event()
+
+    def record(self, link_id, count=1, clicked_at=None, visitor=None):
+        """
+        Counts ``count`` clicks on the link with the given id, made at
+        ``clicked_at`` (by default now) by ``visitor``, a string identifying
+        the client such as ``visitor_fingerprint`` returns, flushing the
+        buffer if it is due.
+        """
+        if clicked_at is None:
+            clicked_at = timezone.now()
+        with self._lock:
+            if not self._pending:
+                self._first_pending = time.time()
+            self._pending[link_id] = self._pending.get(link_id, 0) + count
+            self._pending_total += count
+            if self.unique_visitors and visitor is not None:
+                key = (link_id, truncate_to_day(clicked_at))
+                sketch = self._sketches.get(key)
+                if sketch is None:
+                    sketch = self._sketches[key] = HyperLogLog()
+                sketch.add(visitor)
+            if self.analytics:
+                self._events.extend([(link_id, clicked_at)] * count)
+            now = time.time()
+            due = ((self._pending_total >= self.flush_threshold or
+                    now - self._last_flush >= self.flush_interval) and
+                   now >= self._retry_at)
+        if self.background:
+            self.start_flusher()
+            if due:
+                self._wake.set()
+        elif due:
+            try:
+                self.flush()
+            except Exception:
+                # the clicks were put back; the link has been resolved, so
+                # the request that made the flush due carries on
+                logger.exception('Flushing clicks failed')
+                self._retry_at = time.time() + self.flush_interval
+
+    def start_flusher(self):
+        """
+        Starts the thread flushing the buffer in the background, unless this
+        process already has it.
+        """
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            # a process forked from one that had a flusher has none
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+            self._stop = stop = threading.Event()
+        thread = threading.Thread(target=self._flush_in_background,
+                                  args=(stop,))
+        thread.daemon = True
+        thread.start()
+
+    def stop_flusher(self):
+        """
+        Makes the background thread flush one last time and exit.
+        """
+        self._stop.set()
+        self._flusher_pid = None
+        self._wake.set()
+
+    def _flush_in_background(self, stop):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the clicks were put back for the next attempt; failures
+                # also show as a growing shortener_click_flush_lag_seconds
+                logger.exception('Flushing clicks failed')
+            finally:
+                for connection in connections.all():
+                    connection.close()
+            if stop.is_set():
+                return
+
+    def pending(self, link_id):
+        """
+        Returns the number of clicks on ``link_id`` not yet written to the
+        database by this process.
+        """
+        return self._pending.get(link_id, 0)
+
+    def pending_total(self):
+        """
+        Returns the number of clicks not yet written to the database by this
+        process.
+        """
+        return self._pending_total
+
+    def lag(self):
+        """
+        Returns the number of seconds the oldest unwritten click has been
+        waiting for, or 0 if there are none.
+        """
+        first_pending = self._first_pending
+        if not self._pending or first_pending is None:
+            return 0.0
+        return time.time() - first_pending
+
+    def apply_pending(self, links):
+        """
+        Adds unflushed clicks to the ``usage_count`` of each of ``links`` so
+        that they can be displayed with live counts. The links must not be
+        saved afterwards.
+        """
+        for link in links:
+            link.usage_count += self.pending(link.id)
+        return links
+
+    def flush(self):
+        """
+        Writes all pending clicks to the database. Returns the number of
+        links that were updated. Events and visitors are only written for
+        links that still exist, since a row for a deleted or archived link
+        would fail the insert of the whole shard's rows.
+
+        If the counts of a shard cannot be written, its clicks, events and
+        sketches are put back for the next flush, those of the other shards
+        are written, and the error is raised.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, []
+            sketches, self._sketches = self._sketches, {}
+            self._pending_total = 0
+            self._last_flush = time.time()
+        if not pending:
+            return 0
+
+        failed = {}
+        updated = set()
+        exc_info = None
+        for db, link_ids in group_by_shard(pending).iteritems():
+            try:
+                updated.update(self.update_counts(db, dict(
+                    (link_id, pending[link_id]) for link_id in link_ids)))
+            except Exception:
+                failed.update((link_id, pending[link_id])
+                              for link_id in link_ids)
+                exc_info = sys.exc_info()
+        if failed:
+            failed_events = [event for event in events if event[0] in failed]
+            events = [event for event in events if event[0] not in failed]
+            failed_sketches = dict(
+                (key, sketch) for key, sketch in sketches.iteritems()
+                if key[0] in failed)
+            for key in failed_sketches:
+                del sketches[key]
+            self.put_back(failed, failed_events, failed_sketches)
+        if updated:
+            self.update_leaderboard(list(updated))
+            links_version.bump()
+            self.insert_events(
+                [event for event in events if event[0] in updated])
+            self.merge_sketches(dict(
+                (key, sketch) for key, sketch in sketches.iteritems()
+                if key[0] in updated))
+        if exc_info is not None:
+            six.reraise(*exc_info)
+        return len(updated)
+
+    def put_back(self, pending, events, sketches):
+        """
+        Returns clicks taken by a failed flush to the buffer, so that they
+        are retried on the next flush.
+        """
+        with self._lock:
+            if not self._pending:
+                self._first_pending = self._last_flush
+            for link_id, count in pending.iteritems():
+                self._pending[link_id] = self._pending.get(link_id, 0) + count
+                self._pending_total += count
+            self._events[:0] = events
+            for key, sketch in sketches.iteritems():
+                if key in self._sketches:
+                    sketch.merge(self._sketches[key])
+                self._sketches[key] = sketch
+
+    def update_counts(self, db, pending):
+        """
+        Adds the ``pending`` clicks, a dict mapping link ids to counts, to
+        the links in database ``db`` in one transaction, and marks them as
+        followed now. Returns the set of ids of the links that exist.
+        """
+        now = timezone.now()
+        by_count = {}
+        for link_id, count in pending.iteritems():
+            by_count.setdefault(count, []).append(link_id)
+        updated = set()
+        with transaction.commit_on_success(using=db):
+            for count, link_ids in by_count.iteritems():
+                for batch in chunks(link_ids):
+                    links = Link.objects.using(db).filter(id__in=batch)
+                    matched = links.update(
+                        usage_count=F('usage_count') + count,
+                        last_followed=now)
+                    if matched < len(batch):
+                        # some were deleted or archived since they were
+                        # clicked
+                        batch = links.values_list('id', flat=True)
+                    updated.update(batch)
+        return updated
+
+    def insert_events(self, events):
+        """
+        Inserts ClickEvent rows for the given (link id, clicked_at) pairs.
+        """
+        if not events:
+            return
+        by_link = {}
+        for link_id, clicked_at in events:
+            by_link.setdefault(link_id, []).append(clicked_at)
+        for db, link_ids in group_by_shard(by_link).iteritems():
+            try:
+                with transaction.commit_on_success(using=db):
+                    ClickEvent.objects.using(db).bulk_create([
+                        ClickEvent(link_id=link_id, clicked_at=clicked_at)
+                        for link_id in link_ids
+                        for clicked_at in by_link[link_id]],
+                        batch_size=QUERY_BATCH_SIZE)
+            except IntegrityError:
+                # one of the links was deleted since its count was written.
+                # the counts stand, but the events of every link in the
+                # shard are lost
+                pass
+
+    def merge_sketches(self, sketches):
+        """
+        Merges the visitor sketches, a dict mapping (link id, day) to a
+        HyperLogLog, into the stored ones.
+        """
+        by_link = {}
+        for (link_id, day), sketch in sketches.iteritems():
+            by_link.setdefault(link_id, {})[link_id, day] = sketch
+        for db, link_ids in group_by_shard(by_link).iteritems():
+            shard_sketches = {}
+            for link_id in link_ids:
+                shard_sketches.update(by_link[link_id])
+            # a second attempt merges into the rows that another process
+            # created first
+            for attempt in xrange(2):
+                try:
+                    with transaction.commit_on_success(using=db):
+                        add_sketches(shard_sketches, using=db)
+                except IntegrityError:
+                    # or one of the links was deleted since it was clicked
+                    continue
+                break
+
+    def update_leaderboard(self, link_ids):
+        """
+        Merges the new counts of the given links into the most popular links
+        leaderboard.
+        """
+        if not popular_links.is_cached():
+            return
+        for db, link_ids in group_by_shard(link_ids).iteritems():
+            for batch in chunks(link_ids):
+                popular_links.update(Link.objects.using(db).filter(
+                    id__in=batch).values_list(*popular_links.fields))
+
+    def clear(self):
+        """
+        Discards all pending clicks.
+        """
+        with self._lock:
+            self._pending = {}
+            self._events = []
+            self._sketches = {}
+            self._pending_total = 0
+
+
+def visitor_fingerprint(meta):
+    """
+    Returns a string identifying the client of a request from the address
+    and user agent in its ``meta`` (request.META or a WSGI environ), for
+    counting unique visitors.
+    """
+    return '%s|%s' % (meta.get('REMOTE_ADDR', ''),
+                      meta.get('HTTP_USER_AGENT', ''))
+
+
+click_buffer = ClickBuffer()
+
+
+def flush_clicks():
+    """
+    Flushes this process's click buffer. Call this from your WSGI server's
+    worker shutdown hook; it is also run when the interpreter exits.
+    """
+    return click_buffer.flush()
+
+
+atexit.register(flush_clicks)
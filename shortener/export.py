@@ -0,0 +1,91 @@
+import csv
+import datetime
+import heapq
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shortener.baseconv import base62
+from shortener.batches import iter_rows
+from shortener.models import Link
+from shortener.routers import databases_for
+
+
+DEFAULT_EXPORT_CHUNK_SIZE = 1000
+EXPORT_FIELDS = ('code', 'url', 'date_submitted', 'usage_count')
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def parse_bound(value):
+    """
+    Parses a date or datetime filter value, returning an aware datetime (a
+    date means its midnight in the current time zone), or None if ``value``
+    cannot be parsed.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        parsed = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+def iter_links(submitted_after=None, submitted_before=None,
+               min_usage_count=None, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Yields (id, url, date_submitted, usage_count) tuples for every link
+    matching the filters, in id order. Links are read ``chunk_size`` at a
+    time, continuing after the last id read rather than using OFFSET, so
+    every chunk is an index range scan and memory use does not grow with
+    the table.
+    """
+    links = Link.objects.order_by('id')
+    if submitted_after is not None:
+        links = links.filter(date_submitted__gte=submitted_after)
+    if submitted_before is not None:
+        links = links.filter(date_submitted__lt=submitted_before)
+    if min_usage_count is not None:
+        links = links.filter(usage_count__gte=min_usage_count)
+    links = links.values_list('id', 'url', 'date_submitted', 'usage_count')
+    return heapq.merge(*[iter_rows(links.using(db), chunk_size)
+                         for db in databases_for(Link)])
+
+
+class Echo(object):
+    """
+    A file-like object whose write() returns what it was given, so that
+    csv.writer can format one row at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for link_id, url, date_submitted, usage_count in rows:
+        yield writer.writerow([base62.from_decimal(link_id),
+                               url.encode('utf-8'),
+                               date_submitted.isoformat(), usage_count])
+
+
+def jsonl_lines(rows):
+    for link_id, url, date_submitted, usage_count in rows:
+        yield json.dumps({
+            'code': base62.from_decimal(link_id), 'url': url,
+            'date_submitted': date_submitted.isoformat(),
+            'usage_count': usage_count}) + '\n'
+
+
+def export_lines(export_format, rows):
+    """
+    Returns an iterator of the lines of ``rows`` exported in
+    ``export_format``, one of EXPORT_FORMATS.
+    """
+    if export_format == 'csv':
+        return csv_lines(rows)
+    return jsonl_lines(rows)
@@ -0,0 +1,96 @@
+import re
+import time
+import urlparse
+
+from django.core import signals
+from django.http import parse_cookie
+from django.utils.encoding import iri_to_uri
+
+from shortener import metrics
+from shortener.baseconv import base62, DecodingError
+from shortener.clicks import click_buffer, visitor_fingerprint
+from shortener.httpcache import count_redirects, redirect_cache_control
+from shortener.models import Link
+from shortener.routers import PIN_COOKIE_NAME, pin_for_cookie, unpin
+from shortener.throttle import check, retry_after
+
+
+class RedirectFastPath(object):
+    """
+    WSGI middleware that answers GET requests for short codes with a
+    permanent redirect without running Django's middleware or URL resolution.
+
+    The code is resolved through the redirect cache and the click is
+    buffered exactly as the ``follow`` view does. Anything else, including
+    codes that do not resolve, is passed on to the wrapped application so
+    that errors are rendered as usual.
+
+    Enabled in ``django_url_shortener/wsgi.py`` by the
+    ``SHORTENER_FAST_REDIRECTS`` setting.
+    """
+    path_pattern = re.compile(r'^/(\w+)$')
+    allowed_schemes = ('http', 'https', 'ftp')
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') == 'GET':
+            match = self.path_pattern.match(environ.get('PATH_INFO', ''))
+            if match is not None:
+                started = time.time()
+                wait = check('follow', environ)
+                if wait:
+                    metrics.responses.inc(view='follow_fastpath', status=429)
+                    start_response('429 TOO MANY REQUESTS', [
+                        ('Content-Type', 'text/plain'),
+                        ('Retry-After', retry_after(wait)),
+                    ])
+                    return [b'Too many requests']
+                # as ReplicaPinMiddleware would
+                unpin()
+                cookie = environ.get('HTTP_COOKIE', '')
+                if PIN_COOKIE_NAME in cookie:
+                    pin_for_cookie(parse_cookie(cookie).get(PIN_COOKIE_NAME))
+                url = self.resolve(match.group(1), environ)
+                if url is not None:
+                    metrics.request_duration.observe(
+                        time.time() - started, view='follow_fastpath')
+                    metrics.responses.inc(view='follow_fastpath', status=301)
+                    headers = [
+                        ('Content-Type', 'text/html; charset=utf-8'),
+                        ('Content-Length', '0'),
+                        ('Location', iri_to_uri(url)),
+                    ]
+                    cache_control = redirect_cache_control()
+                    if cache_control is not None:
+                        headers.append(('Cache-Control', cache_control))
+                    start_response('301 MOVED PERMANENTLY', headers)
+                    return []
+        return self.application(environ, start_response)
+
+    def resolve(self, base62_id, environ=None):
+        """
+        Returns the URL to redirect to, or None if the request should be left
+        to Django.
+        """
+        try:
+            link_id = base62.to_decimal(base62_id)
+        except DecodingError:
+            return None
+        # let Django reset queries and release its connections as it would
+        # for a request it handled itself
+        signals.request_started.send(sender=self.__class__)
+        try:
+            url, archived = Link.objects.follow(link_id)
+            if url is None:
+                return None
+            if urlparse.urlparse(url).scheme not in self.allowed_schemes:
+                # HttpResponseRedirect refuses these, so let Django do so
+                return None
+            if count_redirects() and not archived:
+                click_buffer.record(link_id, visitor=visitor_fingerprint(
+                    environ or {}))
+            return url
+        finally:
+            signals.request_finished.send(sender=self.__class__)
@@ -0,0 +1,94 @@
+"""
+Files shared by the processes on a host, such as the compiled redirect map
+and the link filter: they are replaced atomically by one process and mapped
+again by the others when they notice the change.
+"""
+import contextlib
+import os
+import tempfile
+import threading
+import time
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode=0o644):
+    """
+    Yields a temporary file in the directory of ``path`` that is flushed to
+    disk and renamed over ``path`` when the block completes, so that readers
+    see either the old or the new file. The temporary file is removed if the
+    block raises.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_id(path):
+    """
+    Returns the inode, mtime and size of the file at ``path``, which change
+    when it is replaced, or None if there is no file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+class WatchedFile(object):
+    """
+    The file at ``path`` as loaded by ``load``, loaded again when the file
+    has been replaced. The file is checked for a new version at most every
+    ``check_interval`` seconds.
+    """
+    check_interval = 5
+
+    def __init__(self, path, load):
+        self.path = path
+        self.load = load
+        self._value = None
+        self._file_id = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def modified_at(self):
+        """
+        The mtime of the loaded file, or 0 if none is loaded.
+        """
+        return self._file_id[1] if self._file_id is not None else 0
+
+    def current(self):
+        """
+        Returns the loaded file, or None if there is none.
+        """
+        now = time.time()
+        if now - self._checked_at > self.check_interval:
+            with self._lock:
+                self._checked_at = now
+                new_id = file_id(self.path)
+                if new_id != self._file_id:
+                    # the old map is left to the garbage collector, since
+                    # other threads may still be reading it
+                    self._value = None
+                    if new_id is not None:
+                        self._value = self.load(self.path)
+                    self._file_id = new_id
+        return self._value
+
+    def reset(self):
+        """
+        Forgets the loaded file so that it is checked on next use.
+        """
+        with self._lock:
+            self._value = self._file_id = None
+            self._checked_at = 0
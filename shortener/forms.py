@@ -1,10 +1,23 @@
 from django import forms
 
 from shortener.baseconv import base62, DecodingError
-from shortener.models import Link
 
 
 too_long_error = "Your custom name is too long. Are you sure you wanted a shortening service? :)"
+taken_error = '"%s" is already taken'
+
+
+def decode_custom(custom):
+    """
+    Returns the link id for the custom short name ``custom``, raising a
+    ValidationError if it cannot be used as one.
+    """
+    try:
+        return base62.to_decimal(custom)
+    except OverflowError:
+        raise forms.ValidationError(too_long_error)
+    except DecodingError as e:
+        raise forms.ValidationError(e)
 
 
 class LinkSubmitForm(forms.Form):
@@ -20,15 +33,16 @@ class LinkSubmitForm(forms.Form):
             return
 
         # they specified a custom url to shorten to. verify that we can decode
-        # that shortened form, and that it's not already taken
-        try:
-            id = base62.to_decimal(custom)
-        except DecodingError as e:
-            raise forms.ValidationError(e)
-
-        try:
-            if Link.objects.filter(id=id).exists():
-                raise forms.ValidationError('"%s" is already taken' % custom)
-        except OverflowError:
-            raise forms.ValidationError(too_long_error)
+        # that shortened form. whether it is already taken is only known once
+        # the link is inserted, see custom_taken()
+        decode_custom(custom)
         return custom
+
+    def custom_taken(self):
+        """
+        Marks the form invalid because the custom name turned out to be taken
+        when the link was created.
+        """
+        self._errors['custom'] = self.error_class(
+            [taken_error % self.cleaned_data['custom']])
+        del self.cleaned_data['custom']
@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import math
+import struct
+
+
+# 2 ** 10 one byte registers, for a standard error of about 3%
+DEFAULT_PRECISION = 10
+
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog sketch estimating the number of distinct values added to
+    it, in ``2 ** precision`` bytes however many values there are. The
+    standard error of the estimate is about ``1.04 / sqrt(2 ** precision)``.
+
+    Sketches of the same precision can be merged, giving the sketch of the
+    union of their values, so sketches built by different processes or for
+    different periods can be combined.
+
+    >>> sketch = HyperLogLog()
+    >>> for i in xrange(1000):
+    ...     sketch.add(str(i % 100))
+    >>> sketch.count()
+    101
+    """
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        elif len(registers) != self.size:
+            raise ValueError('expected %d registers' % self.size)
+        self.registers = registers
+
+    def add(self, value):
+        """
+        Adds the string ``value``.
+        """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        hashed = struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+        bits = 64 - self.precision
+        index = hashed >> bits
+        # the position of the first 1 bit in the remaining bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Adds the values of ``other`` to this sketch.
+        """
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of different precisions')
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values added.
+        """
+        size = self.size
+        if size >= 128:
+            alpha = 0.7213 / (1 + 1.079 / size)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[size]
+        estimate = alpha * size * size / sum(
+            2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(b'\0')
+        if estimate <= 2.5 * size and zeros:
+            # few values: linear counting of the empty registers is closer
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+    def encode(self):
+        """
+        Returns the sketch as an ASCII string, for storing in a text column.
+        """
+        return base64.b64encode(
+            bytes(bytearray([self.precision]) + self.registers))
+
+    @classmethod
+    def decode(cls, value):
+        data = bytearray(base64.b64decode(value))
+        return cls(data[0], data[1:])
@@ -0,0 +1,95 @@
+"""
+HTTP caching headers for the shortener's views.
+
+``info`` pages carry an ETag and are answered with 304 Not Modified when the
+client's copy is current. The index page and redirects can be given a
+``Cache-Control`` lifetime so that browsers, proxies and CDNs serve them
+without reaching Django. Redirects answered by a CDN are not counted by
+``follow``; set ``SHORTENER_COUNT_REDIRECTS = False`` and count them from
+the CDN's access logs with ``manage.py ingest_clicks`` instead.
+"""
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.utils import timezone
+
+from shortener.analytics import rollup_version, truncate_to_hour
+from shortener.clicks import click_buffer
+
+
+DEFAULT_INFO_MAX_AGE = 0
+
+
+def info_etag(request, link, check=None):
+    """
+    Returns the ETag of the info page of ``link``, whose usage count must
+    include the pending clicks, and of its LinkCheck ``check``. The page
+    also changes when clicks are rolled up, when the pending clicks and
+    their visitors are flushed and when its 24 hour window moves on to the
+    next hour.
+    """
+    parts = [link.id, link.url, link.usage_count, link.date_submitted,
+             click_buffer.pending(link.id),
+             truncate_to_hour(timezone.now()), rollup_version(),
+             request.get_host(), check and check.checked_at]
+    return hashlib.md5(
+        u'|'.join(map(unicode, parts)).encode('utf-8')).hexdigest()
+
+
+def not_modified(request, etag):
+    """
+    Returns a 304 response if the request's If-None-Match matches ``etag``,
+    otherwise None.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is None:
+        return None
+    etags = parse_etags(if_none_match)
+    if etag not in etags and '*' not in etags:
+        return None
+    response = HttpResponseNotModified()
+    set_info_headers(response, etag)
+    return response
+
+
+def set_info_headers(response, etag):
+    response['ETag'] = quote_etag(etag)
+    patch_cache_control(response, public=True, max_age=getattr(
+        settings, 'SHORTENER_INFO_MAX_AGE', DEFAULT_INFO_MAX_AGE))
+
+
+def set_index_headers(request, response):
+    """
+    Lets caches keep the index page for ``SHORTENER_INDEX_MAX_AGE`` seconds.
+    The page embeds the client's CSRF token, so CsrfViewMiddleware makes it
+    vary on Cookie, and the response that hands a new client its token is
+    kept private.
+    """
+    max_age = getattr(settings, 'SHORTENER_INDEX_MAX_AGE', None)
+    if not max_age:
+        return
+    if settings.CSRF_COOKIE_NAME in request.COOKIES:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+
+
+def redirect_cache_control():
+    """
+    Returns the Cache-Control header of redirects, or None to send none.
+    """
+    max_age = getattr(settings, 'SHORTENER_REDIRECT_MAX_AGE', None)
+    if max_age is None:
+        return None
+    return 'public, max-age=%d' % max_age
+
+
+def count_redirects():
+    """
+    Returns whether redirects are counted as they are served, rather than
+    from access logs.
+    """
+    return getattr(settings, 'SHORTENER_COUNT_REDIRECTS', True)
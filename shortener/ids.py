@@ -0,0 +1,94 @@
+import threading
+
+from django.conf import settings
+from django.db import router
+
+from shortener.routers import databases_for
+
+
+DEFAULT_ID_BLOCK_SIZE = 100
+
+
+class IdAllocator(object):
+    """
+    Hands out ids for new links from blocks reserved in the IdSequence table
+    (hi/lo allocation), so that auto-generated ids never need the database's
+    own sequence.
+
+    Each process reserves ``block_size`` ids at a time with a compare and
+    swap UPDATE on its IdSequence row, which is safe without a surrounding
+    transaction. When a block is reserved, the ids in it already taken by
+    custom codes are looked up with a single query and skipped. A custom
+    code claimed after that is caught by the primary key when the link is
+    inserted; Link.save() then simply takes the next id. Ids held by
+    ``archive_model`` are skipped as well, so that archived codes are never
+    handed out again.
+
+    Configured with the ``SHORTENER_ID_BLOCK_SIZE`` setting.
+    """
+    def __init__(self, sequence_model, model, name, block_size=None,
+                 archive_model=None):
+        if block_size is None:
+            block_size = getattr(
+                settings, 'SHORTENER_ID_BLOCK_SIZE', DEFAULT_ID_BLOCK_SIZE)
+        self.sequence_model = sequence_model
+        self.model = model
+        self.archive_model = archive_model
+        self.name = name
+        self.block_size = block_size
+        self._next = self._end = 0
+        self._taken = frozenset()
+        self._lock = threading.Lock()
+
+    def reserve_block(self):
+        """
+        Reserves the next block of ids, returning its (start, end) range.
+        """
+        # a replica could hand out a stale value, which would never swap
+        sequence = self.sequence_model.objects.db_manager(
+            router.db_for_write(self.sequence_model))
+        while True:
+            start = sequence.filter(name=self.name).values_list(
+                'next_value', flat=True)[:1]
+            if not start:
+                sequence.get_or_create(name=self.name,
+                                       defaults={'next_value': 1})
+                continue
+            start = start[0]
+            end = start + self.block_size
+            if sequence.filter(name=self.name, next_value=start).update(
+                    next_value=end):
+                return start, end
+
+    def taken_ids(self, start, end):
+        taken = set()
+        for model in (self.model, self.archive_model):
+            if model is None:
+                continue
+            for db in databases_for(model):
+                links = model.objects.using(db or router.db_for_write(model))
+                taken.update(links.filter(
+                    id__gte=start, id__lt=end).values_list('id', flat=True))
+        return frozenset(taken)
+
+    def next_id(self):
+        with self._lock:
+            while True:
+                if self._next >= self._end:
+                    self._next, self._end = self.reserve_block()
+                    self._taken = self.taken_ids(self._next, self._end)
+                link_id = self._next
+                self._next += 1
+                if link_id not in self._taken:
+                    return link_id
+
+    def allocate(self, count, exclude=()):
+        """
+        Returns a list of ``count`` ids, none of which are in ``exclude``.
+        """
+        ids = []
+        while len(ids) < count:
+            link_id = self.next_id()
+            if link_id not in exclude:
+                ids.append(link_id)
+        return ids
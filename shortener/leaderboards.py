@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from shortener.routers import databases_for
+
+
+DEFAULT_LEADERBOARD_SIZE = 5
+DEFAULT_LEADERBOARD_TIMEOUT = 5 * 60
+
+
+class Leaderboard(object):
+    """
+    The top links by ``field`` in descending order, kept in Django's cache so
+    that they can be displayed without querying the link table.
+
+    The board is rebuilt from the database with one indexed query per shard
+    when it is missing from the cache, which happens at least every
+    ``SHORTENER_LEADERBOARD_TIMEOUT`` seconds, and is updated in place as
+    links are created and clicked. Only increases can be merged in place;
+    a board is rebuilt when one of its links decreases or is deleted.
+    """
+    fields = ('id', 'url', 'usage_count', 'date_submitted')
+    key_prefix = 'shortener:leaderboard:'
+
+    def __init__(self, model, name, field, size=None, timeout=None):
+        if size is None:
+            size = getattr(
+                settings, 'SHORTENER_LEADERBOARD_SIZE',
+                DEFAULT_LEADERBOARD_SIZE)
+        if timeout is None:
+            timeout = getattr(
+                settings, 'SHORTENER_LEADERBOARD_TIMEOUT',
+                DEFAULT_LEADERBOARD_TIMEOUT)
+        self.model = model
+        self.key = self.key_prefix + name
+        self.field = field
+        self.index = self.fields.index(field)
+        self.size = size
+        self.timeout = timeout
+
+    def sort_key(self, entry):
+        return entry[self.index], entry[0]
+
+    def is_cached(self):
+        return cache.get(self.key) is not None
+
+    def entries(self):
+        entries = cache.get(self.key)
+        if entries is None:
+            entries = self.refresh()
+        return entries
+
+    def links(self):
+        """
+        Returns the board as a list of unsaved model instances.
+        """
+        return [self.model(**dict(zip(self.fields, entry)))
+                for entry in self.entries()]
+
+    def refresh(self):
+        """
+        Rebuilds the board from the database, or from the top of each shard.
+        """
+        entries = []
+        for db in databases_for(self.model):
+            entries.extend(self.model.objects.using(db).order_by(
+                '-' + self.field, '-id').values_list(*self.fields)[:self.size])
+        entries = sorted(entries, key=self.sort_key, reverse=True)[:self.size]
+        cache.set(self.key, entries, self.timeout)
+        return entries
+
+    def update(self, rows):
+        """
+        Merges ``rows`` of (id, url, usage_count, date_submitted) values into
+        the board.
+        """
+        entries = cache.get(self.key)
+        if entries is None:
+            # rebuilt from the database on the next read
+            return
+        merged = dict((entry[0], entry) for entry in entries)
+        for row in rows:
+            row = tuple(row)
+            old = merged.get(row[0])
+            if old is not None and old[self.index] > row[self.index]:
+                cache.delete(self.key)
+                return
+            merged[row[0]] = row
+        entries = sorted(merged.values(), key=self.sort_key, reverse=True)
+        cache.set(self.key, entries[:self.size], self.timeout)
+
+    def update_links(self, links):
+        self.update([tuple(getattr(link, field) for field in self.fields)
+                     for link in links])
+
+    def remove(self, link_id):
+        entries = cache.get(self.key)
+        if entries is not None and link_id in [entry[0] for entry in entries]:
+            cache.delete(self.key)
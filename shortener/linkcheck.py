@@ -0,0 +1,390 @@
+"""
+Checking link targets in the background.
+
+``manage.py check_links`` reads the links in id order, a batch at a time,
+checks the targets of each batch concurrently with a LinkChecker and writes
+the results to LinkCheck in one transaction per batch. The info page shows
+whether a link's target was reachable and where it redirects to.
+
+Since the results are public, targets and redirects on loopback, private,
+link-local and reserved addresses are refused before connecting, so that
+links cannot be used to probe the network the checker runs in.
+"""
+import binascii
+import functools
+import httplib
+import json
+import os
+import socket
+import threading
+import time
+import urlparse
+from collections import OrderedDict
+from multiprocessing.dummy import Pool
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
+
+from shortener.batches import iter_batches
+from shortener.files import atomic_write
+from shortener.models import Link, LinkCheck
+from shortener.routers import databases_for
+
+
+DEFAULT_USER_AGENT = 'django-url-shortener link checker'
+CHECK_BATCH_SIZE = 100
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# statuses of servers that do not answer HEAD requests
+HEAD_REFUSED_STATUSES = (405, 501)
+# bytes of a GET response read before the connection is dropped instead
+MAX_BODY_SIZE = 64 * 1024
+CONNECTION_CLASSES = {
+    'http': httplib.HTTPConnection,
+    'https': httplib.HTTPSConnection,
+}
+
+# loopback, private, shared, link-local (including cloud metadata services),
+# documentation, multicast and reserved networks, which are never checked
+REFUSED_NETWORKS = (
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8',
+    '169.254.0.0/16', '172.16.0.0/12', '192.0.0.0/24', '192.0.2.0/24',
+    '192.168.0.0/16', '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24',
+    '224.0.0.0/4', '240.0.0.0/4',
+    # unspecified, loopback, IPv4-compatible and IPv4-mapped addresses
+    '::/96', '::ffff:0:0/96', '64:ff9b::/96', '100::/64', '2001::/23',
+    '2001:db8::/32', 'fc00::/7', 'fe80::/10', 'fec0::/10', 'ff00::/8',
+)
+
+
+class RefusedAddressError(socket.error):
+    """
+    The host of a target resolves to an address that is not checked
+    """
+    pass
+
+
+def address_bits(family, address):
+    """
+    Returns the IPv4 or IPv6 ``address`` as an integer and its width.
+    """
+    packed = socket.inet_pton(family, address.split('%', 1)[0])
+    return int(binascii.hexlify(packed), 16), len(packed) * 8
+
+
+def parse_networks(networks):
+    parsed = []
+    for network in networks:
+        address, prefix = network.split('/')
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        value, width = address_bits(family, address)
+        shift = width - int(prefix)
+        parsed.append((family, value >> shift, shift))
+    return parsed
+
+
+_refused_networks = parse_networks(REFUSED_NETWORKS)
+
+
+def is_public_address(address):
+    """
+    Returns False if the IPv4 or IPv6 ``address`` is in one of the
+    REFUSED_NETWORKS.
+
+    >>> is_public_address('169.254.169.254'), is_public_address('8.8.8.8')
+    (False, True)
+    """
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    value, width = address_bits(family, address)
+    for network_family, network, shift in _refused_networks:
+        if network_family == family and value >> shift == network:
+            return False
+    return True
+
+
+def connect_to(addresses, address, timeout, source_address=None):
+    """
+    Connects to the first of ``addresses``, a list of (host, port) pairs,
+    that accepts. Stands in for socket.create_connection, which would
+    resolve ``address`` again and might get a different answer.
+    """
+    for i, sockaddr in enumerate(addresses):
+        try:
+            return socket.create_connection(sockaddr, timeout, source_address)
+        except socket.error:
+            if i == len(addresses) - 1:
+                raise
+
+
+class HostPool(object):
+    """
+    Connections to one host, kept open between requests. At most ``limit``
+    requests are made to the host at a time, and each starts at least
+    ``delay`` seconds after the previous one. New connections only go to
+    addresses that ``address_allowed(host, address)`` accepts.
+    """
+    def __init__(self, scheme, netloc, limit, delay, timeout,
+                 address_allowed):
+        self.connection_class = CONNECTION_CLASSES[scheme]
+        self.netloc = netloc
+        self.delay = delay
+        self.timeout = timeout
+        self.address_allowed = address_allowed
+        self._slots = threading.BoundedSemaphore(limit)
+        self._idle = []
+        self._closed = False
+        self._next_at = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, path, headers):
+        """
+        Makes a request, returning its response with the body read.
+        """
+        with self._slots:
+            with self._lock:
+                now = time.time()
+                wait = self._next_at - now
+                self._next_at = max(self._next_at, now) + self.delay
+                connection = self._idle.pop() if self._idle else None
+            if wait > 0:
+                time.sleep(wait)
+            if connection is not None:
+                try:
+                    return self._send(connection, method, path, headers)
+                except (socket.error, httplib.HTTPException):
+                    # the server closed the idle connection
+                    pass
+            return self._send(self.connect(), method, path, headers)
+
+    def connect(self):
+        """
+        Returns a new connection to the host, which connects to the addresses
+        it resolves to, or raises RefusedAddressError if any of them is not
+        allowed.
+        """
+        connection = self.connection_class(self.netloc, timeout=self.timeout)
+        addresses = []
+        for family, type_, proto, canonname, sockaddr in socket.getaddrinfo(
+                connection.host, connection.port, 0, socket.SOCK_STREAM):
+            if not self.address_allowed(connection.host, sockaddr[0]):
+                raise RefusedAddressError('refused address')
+            addresses.append(sockaddr[:2])
+        if not addresses:
+            raise socket.gaierror('no address')
+        # HTTPS still verifies the certificate against the host name
+        connection._create_connection = functools.partial(
+            connect_to, addresses)
+        return connection
+
+    def _send(self, connection, method, path, headers):
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            response.read(MAX_BODY_SIZE)
+        except Exception:
+            connection.close()
+            raise
+        with self._lock:
+            keep = (response.isclosed() and not response.will_close and
+                    not self._closed)
+            if keep:
+                self._idle.append(connection)
+        if not keep:
+            connection.close()
+        return response
+
+    def close_idle(self):
+        """
+        Closes the connections kept open between requests.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def close(self):
+        """
+        Closes the idle connections, and those in use once their requests
+        are done.
+        """
+        with self._lock:
+            self._closed = True
+        self.close_idle()
+
+
+class LinkChecker(object):
+    """
+    Checks URLs from a pool of ``workers`` threads, following up to
+    ``max_redirects`` redirects. Requests to each host go through a
+    HostPool, so that connections are reused and no host gets more than
+    ``per_host`` requests at a time or more than one every ``host_delay``
+    seconds. The pools of the ``max_hosts`` most recently requested hosts
+    are kept, and the connections of the others closed.
+
+    Unless ``allow_private`` (by default the
+    ``SHORTENER_LINK_CHECK_ALLOW_PRIVATE`` setting), hosts resolving to an
+    address in REFUSED_NETWORKS are not connected to.
+    """
+    def __init__(self, workers=10, per_host=2, host_delay=1.0, timeout=10,
+                 max_redirects=5, user_agent=DEFAULT_USER_AGENT,
+                 allow_private=None, max_hosts=1000):
+        if allow_private is None:
+            allow_private = getattr(
+                settings, 'SHORTENER_LINK_CHECK_ALLOW_PRIVATE', False)
+        self.allow_private = allow_private
+        self.workers = workers
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+        self.max_hosts = max_hosts
+        self._hosts = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = Pool(workers)
+
+    def host(self, scheme, netloc):
+        key = (scheme, netloc.lower())
+        evicted = None
+        with self._lock:
+            host = self._hosts.pop(key, None)
+            if host is None:
+                host = HostPool(
+                    scheme, netloc, self.per_host, self.host_delay,
+                    self.timeout, self.address_allowed)
+                if len(self._hosts) >= self.max_hosts:
+                    evicted = self._hosts.popitem(last=False)[1]
+            # re-insert so that the host becomes the most recently used
+            self._hosts[key] = host
+        if evicted is not None:
+            evicted.close()
+        return host
+
+    def address_allowed(self, host, address):
+        return self.allow_private or is_public_address(address)
+
+    def fetch(self, url):
+        """
+        Requests ``url`` with HEAD, or GET if the server refuses HEAD.
+        Returns the response.
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        host = self.host(scheme, netloc)
+        path = urlparse.urlunsplit(('', '', path or '/', query, ''))
+        headers = {'User-Agent': self.user_agent}
+        response = host.request('HEAD', path, headers)
+        if response.status in HEAD_REFUSED_STATUSES:
+            response = host.request('GET', path, headers)
+        return response
+
+    def check(self, url):
+        """
+        Returns the (status, final URL, error) of ``url``: the status of the
+        last response, or None if there was none; where it redirects to, or
+        '' if it does not; and what went wrong, or ''. Where a redirect to a
+        refused address leads is not returned.
+        """
+        url = current = iri_to_uri(url)
+        status = None
+        for i in xrange(self.max_redirects + 1):
+            if urlparse.urlsplit(current).scheme not in CONNECTION_CLASSES:
+                return status, '', 'unsupported scheme'
+            try:
+                response = self.fetch(current)
+            except RefusedAddressError:
+                if current == url:
+                    return None, '', 'refused address'
+                return status, '', 'redirects to a refused address'
+            except (socket.error, httplib.HTTPException) as e:
+                return None, '', (unicode(e) or e.__class__.__name__)[:200]
+            status = response.status
+            location = response.getheader('location')
+            if status not in REDIRECT_STATUSES or not location:
+                return status, '' if current == url else current, ''
+            current = urlparse.urljoin(current, iri_to_uri(location))
+        return status, current, 'too many redirects'
+
+    def check_many(self, urls):
+        """
+        Checks ``urls`` concurrently, returning their results in order.
+        """
+        return self._pool.map(self.check, urls)
+
+    def close_idle(self):
+        """
+        Closes the connections kept open to every host, so that a long run
+        does not hold a file descriptor for each host it has checked.
+        """
+        with self._lock:
+            hosts = self._hosts.values()
+        for host in hosts:
+            host.close_idle()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        for host in self._hosts.values():
+            host.close()
+
+
+def read_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, progress):
+    # replaced atomically, so that an interrupted write loses no progress
+    with atomic_write(path) as f:
+        json.dump(progress, f)
+
+
+def save_results(db, results):
+    """
+    Replaces the LinkCheck rows of the links in database ``db`` with
+    ``results``, a list of (link id, (status, final URL, error)) pairs, in
+    one transaction.
+    """
+    checked_at = timezone.now()
+    with transaction.commit_on_success(using=db):
+        checks = LinkCheck.objects.using(db)
+        # links deleted while their targets were checked are skipped
+        existing = set(Link.objects.using(db).filter(
+            id__in=[link_id for link_id, result in results]
+        ).values_list('id', flat=True))
+        checks.filter(link__in=existing).delete()
+        checks.bulk_create([
+            LinkCheck(link_id=link_id, status=status, final_url=final_url,
+                      error=error, checked_at=checked_at)
+            for link_id, (status, final_url, error) in results
+            if link_id in existing])
+
+
+def check_links(checker, batch_size=CHECK_BATCH_SIZE, checkpoint=None):
+    """
+    Checks the target of every link with ``checker``, ``batch_size`` links
+    at a time. Returns the number of links checked.
+
+    With ``checkpoint``, the path of a file, the last link id saved in each
+    database is written to it after each batch, and a run finding the file
+    resumes from there. The file is removed once every link is checked.
+    """
+    progress = read_checkpoint(checkpoint)
+    checked = 0
+    for db in databases_for(Link):
+        key = db or DEFAULT_DB_ALIAS
+        links = Link.objects.using(db).values_list('id', 'url')
+        for batch in iter_batches(links, batch_size, after=progress.get(key)):
+            results = checker.check_many([url for link_id, url in batch])
+            save_results(db, zip([link_id for link_id, url in batch],
+                                 results))
+            checker.close_idle()
+            checked += len(batch)
+            progress[key] = batch[-1][0]
+            if checkpoint is not None:
+                write_checkpoint(checkpoint, progress)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return checked
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.archive import ARCHIVE_BATCH_SIZE, archive_cutoff, archive_links
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves links that have not been followed for a long time into the '
+        'archive table. Their short codes keep working, and a link is moved '
+        'back once it is followed often enough again. Run this periodically, e.g. daily '
+        'from cron.')
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', default=None,
+            help='Archive links not followed for this many days. Default: '
+                 'SHORTENER_ARCHIVE_AFTER_DAYS, or 365.'),
+        make_option('--batch-size', type='int', default=ARCHIVE_BATCH_SIZE,
+            help='Number of links archived per transaction. Default: %d.' %
+                 ARCHIVE_BATCH_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['days'] is not None and options['days'] < 30:
+            raise CommandError(
+                '--days must be at least 30, the days of clicks shown on '
+                'info pages.')
+        archived = archive_links(archive_cutoff(options['days']),
+                                 options['batch_size'])
+        self.stdout.write('Archived %d links' % archived)
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shortener.batches import iter_batches
+from shortener.models import hash_url, Link
+from shortener.routers import databases_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills in Link.url_hash for links created before URL deduplication '
+        'was added. Links are processed in id order, one transaction per '
+        'batch, so the command can be interrupted and run again.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+            help='Number of links updated per transaction. Default: 1000.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        updated = 0
+        for db in databases_for(Link):
+            updated = self.backfill(db, batch_size, updated)
+        self.stdout.write('Done, hashed %d links' % updated)
+
+    def backfill(self, db, batch_size, updated):
+        links = Link.objects.using(db).filter(url_hash='')
+        for batch in iter_batches(links.values_list('id', 'url'), batch_size):
+            with transaction.commit_on_success(using=db):
+                for link_id, url in batch:
+                    Link.objects.using(db).filter(id=link_id).update(
+                        url_hash=hash_url(url))
+            updated += len(batch)
+            self.stdout.write('Hashed %d links' % updated)
+        return updated
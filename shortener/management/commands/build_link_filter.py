@@ -0,0 +1,18 @@
+from django.core.management.base import CommandError, NoArgsCommand
+
+from shortener.models import link_filter
+
+
+class Command(NoArgsCommand):
+    help = (
+        'Rebuilds the shared link filter file set by '
+        'SHORTENER_LINK_FILTER_PATH from the database. Running processes '
+        'map the new file within a few seconds.')
+
+    def handle_noargs(self, **options):
+        if link_filter.path is None:
+            raise CommandError('SHORTENER_LINK_FILTER_PATH is not set.')
+        link_filter.rebuild()
+        bloom = link_filter.current()
+        self.stdout.write('Wrote %s (%d bits, %d hashes)' % (
+            link_filter.path, bloom.num_bits, bloom.num_hashes))
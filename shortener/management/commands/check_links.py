@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.linkcheck import CHECK_BATCH_SIZE, check_links, LinkChecker
+
+
+class Command(BaseCommand):
+    help = (
+        'Checks the target of every link over HTTP and records its status '
+        'and where it redirects to, shown on the info page. Run this '
+        'periodically, e.g. weekly from cron.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=10,
+            help='Number of targets checked at a time. Default: 10.'),
+        make_option('--per-host', type='int', default=2,
+            help='Number of requests made to one host at a time. '
+                 'Default: 2.'),
+        make_option('--host-delay', type='float', default=1.0,
+            help='Seconds between the requests made to one host. '
+                 'Default: 1.'),
+        make_option('--timeout', type='float', default=10,
+            help='Seconds to wait for a host to answer. Default: 10.'),
+        make_option('--batch-size', type='int', default=CHECK_BATCH_SIZE,
+            help='Number of links checked before their results are '
+                 'saved. Default: %d.' % CHECK_BATCH_SIZE),
+        make_option('--checkpoint',
+            help='File recording progress after each batch; a run finding '
+                 'it resumes where the last one stopped.'),
+    )
+
+    def handle(self, *args, **options):
+        for name in ('workers', 'per_host', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError('--%s must be at least 1.' %
+                                   name.replace('_', '-'))
+        checker = LinkChecker(
+            workers=options['workers'], per_host=options['per_host'],
+            host_delay=options['host_delay'], timeout=options['timeout'])
+        try:
+            checked = check_links(checker, options['batch_size'],
+                                  options['checkpoint'])
+        finally:
+            checker.close()
+        self.stdout.write('Checked %d links' % checked)
@@ -0,0 +1,38 @@
+import heapq
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.batches import iter_rows
+from shortener.models import Link
+from shortener.redirectmap import write_redirect_map
+from shortener.routers import databases_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes every link to the compiled redirect map that follow reads '
+        'without querying the database. The new map replaces the old one '
+        'atomically and running processes pick it up within a few seconds.')
+    option_list = BaseCommand.option_list + (
+        make_option('--output',
+            help='File to write. Default: SHORTENER_REDIRECT_MAP_PATH.'),
+        make_option('--batch-size', type='int', default=10000,
+            help='Number of links read per query. Default: 10000.'),
+    )
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(
+            settings, 'SHORTENER_REDIRECT_MAP_PATH', None)
+        if not path:
+            raise CommandError(
+                'Pass --output or set SHORTENER_REDIRECT_MAP_PATH.')
+        # each shard is read in id order and the streams merged
+        count = write_redirect_map(path, heapq.merge(*[
+            iter_rows(Link.objects.using(db).values_list('id', 'url'),
+                      options['batch_size'])
+            for db in databases_for(Link)]))
+        self.stdout.write('Wrote %d links to %s (%d bytes)' % (
+            count, path, os.path.getsize(path)))
@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.export import (
+    DEFAULT_EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_lines, iter_links,
+    parse_bound)
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes every link with its click count as CSV or JSON lines. Links '
+        'are read in id order a chunk at a time, so memory use stays the '
+        'same however many links there are.')
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=EXPORT_FORMATS, default='csv',
+            help='Output format. Default: csv.'),
+        make_option('--output', default='-',
+            help='File to write to. Default: stdout.'),
+        make_option('--submitted-after',
+            help='Only links submitted at or after this date or datetime.'),
+        make_option('--submitted-before',
+            help='Only links submitted before this date or datetime.'),
+        make_option('--min-usage-count', type='int',
+            help='Only links followed at least this many times.'),
+        make_option('--chunk-size', type='int',
+            default=DEFAULT_EXPORT_CHUNK_SIZE,
+            help='Number of links read per query. Default: %d.' %
+                 DEFAULT_EXPORT_CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        filters = {'min_usage_count': options['min_usage_count'],
+                   'chunk_size': options['chunk_size']}
+        for name in ('submitted_after', 'submitted_before'):
+            if options[name]:
+                filters[name] = parse_bound(options[name])
+                if filters[name] is None:
+                    raise CommandError('Invalid --%s: %s' % (
+                        name.replace('_', '-'), options[name]))
+
+        if options['output'] == '-':
+            outfile = self.stdout
+        else:
+            outfile = open(options['output'], 'wb')
+        try:
+            for line in export_lines(options['format'],
+                                     iter_links(**filters)):
+                outfile.write(line)
+        finally:
+            if outfile is not self.stdout:
+                outfile.close()
@@ -0,0 +1,146 @@
+import codecs
+import csv
+import json
+import sys
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.bulk import create_links
+from shortener.forms import decode_custom, LinkSubmitForm
+
+
+class Command(BaseCommand):
+    args = '<input file>'
+    help = (
+        'Shortens every URL in a CSV or JSON lines file. CSV files need a '
+        'header row with a "url" column and an optional "custom" column; '
+        'JSON lines files hold one {"url": ..., "custom": ...} object per '
+        'line. Use "-" to read from stdin. A code,url mapping of the created '
+        'links is written to --output, and rejected rows are reported on '
+        'stderr.')
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=('csv', 'jsonl'),
+            help='Input format. Guessed from the file extension by default.'),
+        make_option('--output', default='-',
+            help='File to write the code,url mapping to. Default: stdout.'),
+        make_option('--chunk-size', type='int', default=1000,
+            help='Number of links inserted per transaction. Default: 1000.'),
+        make_option('--deduplicate', action='store_true',
+            default=getattr(settings, 'SHORTENER_DEDUPLICATE', False),
+            help='Return existing links for URLs that have already been '
+                 'shortened. Default: the SHORTENER_DEDUPLICATE setting.'),
+        make_option('--progress-interval', type='float', default=5,
+            help='Seconds between progress reports. Default: 5.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Expected exactly one input file.')
+        path = args[0]
+        input_format = options['format']
+        if input_format is None:
+            if path.endswith('.csv'):
+                input_format = 'csv'
+            elif path.endswith('.jsonl') or path.endswith('.json'):
+                input_format = 'jsonl'
+            else:
+                raise CommandError(
+                    'Cannot guess the format of %s, use --format.' % path)
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        infile = sys.stdin if path == '-' else open(path, 'rb')
+        if options['output'] == '-':
+            outfile = sys.stdout
+        else:
+            outfile = open(options['output'], 'wb')
+        writer = csv.writer(outfile)
+        self.url_field = LinkSubmitForm.base_fields['url']
+        self.deduplicate = options['deduplicate']
+        self.progress_interval = options['progress_interval']
+        self.created = self.rejected = 0
+        self.started = self.last_report = time.time()
+
+        try:
+            if input_format == 'csv':
+                rows = self.read_csv(infile)
+            else:
+                rows = self.read_jsonl(infile)
+            chunk = []
+            for line, url, custom in rows:
+                entry = self.clean_row(line, url, custom)
+                if entry is None:
+                    continue
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    self.import_chunk(chunk, writer, outfile)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk, writer, outfile)
+        finally:
+            if infile is not sys.stdin:
+                infile.close()
+            if outfile is not sys.stdout:
+                outfile.close()
+        self.report(final=True)
+
+    def read_csv(self, infile):
+        reader = csv.DictReader(infile)
+        if 'url' not in (reader.fieldnames or ()):
+            raise CommandError('The CSV header has no "url" column.')
+        for row in reader:
+            yield (reader.line_num, row['url'].decode('utf-8'),
+                   (row.get('custom') or '').decode('utf-8'))
+
+    def read_jsonl(self, infile):
+        for line, data in enumerate(codecs.getreader('utf-8')(infile), 1):
+            if not data.strip():
+                continue
+            try:
+                row = json.loads(data)
+                yield line, row['url'], row.get('custom') or u''
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.reject(line, 'not a JSON object with a "url" key')
+
+    def clean_row(self, line, url, custom):
+        """
+        Validates a row the way LinkSubmitForm does, returning a
+        (line, url, custom, custom_id) entry or None if it was rejected.
+        """
+        try:
+            url = self.url_field.clean(url)
+            custom_id = decode_custom(custom) if custom else None
+        except ValidationError as e:
+            self.reject(line, '; '.join(e.messages))
+            return None
+        return line, url, custom, custom_id
+
+    def import_chunk(self, chunk, writer, outfile):
+        links = create_links([(url, custom_id)
+                              for line, url, custom, custom_id in chunk],
+                             deduplicate=self.deduplicate)
+        for (line, url, custom, custom_id), link in zip(chunk, links):
+            if link is None:
+                self.reject(line, '"%s" is already taken' % custom)
+            else:
+                writer.writerow([link.to_base62(), link.url.encode('utf-8')])
+                self.created += 1
+        outfile.flush()
+        if time.time() - self.last_report >= self.progress_interval:
+            self.report()
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        self.stderr.write('line %d: %s' % (line, reason))
+
+    def report(self, final=False):
+        self.last_report = time.time()
+        elapsed = self.last_report - self.started
+        self.stderr.write('%s %d links, rejected %d rows in %.1fs (%.0f links/s)' % (
+            'Imported' if final else 'Importing:', self.created,
+            self.rejected, elapsed, self.created / max(elapsed, 1e-6)))
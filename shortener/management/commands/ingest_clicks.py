@@ -0,0 +1,41 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.accesslog import (
+    DEFAULT_INGEST_BATCH_SIZE, DEFAULT_LOG_PATTERN, ingest_clicks)
+
+
+class Command(BaseCommand):
+    args = '<log file> [<log file> ...]'
+    help = (
+        'Counts the redirects recorded in access logs, for redirects served '
+        'by a CDN or another cache in front of the application. Use "-" to '
+        'read from stdin. Each log must only be ingested once.')
+    option_list = BaseCommand.option_list + (
+        make_option('--pattern', default=DEFAULT_LOG_PATTERN,
+            help='Regular expression matching the log lines of redirects, '
+                 'with a "code" group and an optional "time" group. '
+                 'Default: redirects in the combined log format.'),
+        make_option('--batch-size', type='int',
+            default=DEFAULT_INGEST_BATCH_SIZE,
+            help='Number of lines whose codes are looked up per query. '
+                 'Default: %d.' % DEFAULT_INGEST_BATCH_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Expected at least one log file.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        for path in args:
+            infile = sys.stdin if path == '-' else open(path, 'rb')
+            try:
+                counted, skipped = ingest_clicks(
+                    infile, options['pattern'], options['batch_size'])
+            finally:
+                if infile is not sys.stdin:
+                    infile.close()
+            self.stdout.write('%s: counted %d clicks, skipped %d lines' % (
+                path, counted, skipped))
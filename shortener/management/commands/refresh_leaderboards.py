@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+
+from shortener.models import popular_links, recent_links
+
+
+class Command(NoArgsCommand):
+    help = (
+        'Rebuilds the most recent and most popular links shown on the index '
+        'page from the database. Run this periodically to correct any drift '
+        'from concurrent updates.')
+
+    def handle_noargs(self, **options):
+        for leaderboard in (recent_links, popular_links):
+            leaderboard.refresh()
+            self.stdout.write('Refreshed %s' % leaderboard.key)
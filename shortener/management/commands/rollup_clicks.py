@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.analytics import compact_hourly_clicks, roll_up_clicks
+
+
+class Command(BaseCommand):
+    help = (
+        'Aggregates recorded redirects into hourly and daily click counts and '
+        'deletes the raw events. Run this periodically, e.g. every few '
+        'minutes from cron.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=10000,
+            help='Number of events rolled up per transaction. '
+                 'Default: 10000.'),
+        make_option('--keep-hourly-days', type='int', default=None,
+            help='Delete hourly counts older than this many days. Daily '
+                 'counts are always kept. Default: keep everything.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        rolled_up = roll_up_clicks(options['batch_size'])
+        self.stdout.write('Rolled up %d click events' % rolled_up)
+        if options['keep_hourly_days'] is not None:
+            compact_hourly_clicks(options['keep_hourly_days'])
+            self.stdout.write('Deleted hourly counts older than %d days' %
+                              options['keep_hourly_days'])
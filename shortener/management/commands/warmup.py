@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the steps that django_url_shortener/wsgi.py runs in new worker '
+        'processes when SHORTENER_WARMUP is set, and reports how long each '
+        'took. This also fills the shared cache with the most followed links '
+        'before a deploy.')
+    option_list = BaseCommand.option_list + (
+        make_option('--links', type='int', default=None,
+            help='Number of links to preload into the redirect cache. '
+                 'Default: SHORTENER_WARMUP_LINKS, or 1000.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['links'] is not None and options['links'] < 0:
+            raise CommandError('--links must not be negative.')
+        total = 0
+        for name, seconds, items in warm_up(options['links']):
+            total += seconds
+            self.stdout.write('%-12s %5d items %9.1f ms' % (
+                name, items, seconds * 1000))
+        self.stdout.write('%-12s %15.1f ms' % ('total', total * 1000))
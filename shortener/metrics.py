@@ -0,0 +1,262 @@
+"""
+A small in-process metrics registry rendered in the Prometheus text format.
+
+Metrics are kept per process; with several worker processes each one has to
+be scraped, or the values aggregated by whatever collects them.
+"""
+import bisect
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.util import CursorWrapper
+
+from shortener.cache import link_cache
+from shortener.clicks import click_buffer
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def label_values(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self):
+        """
+        Returns a list of (name suffix, label names, label values, value).
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, names, values, value in self.samples():
+            lines.append('%s%s%s %s' % (
+                self.name, suffix, format_labels(names, values),
+                format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super(Counter, self).__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', self.label_names, key, value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """
+    A value read from ``function`` every time the metric is rendered.
+    ``function`` returns either a number or, for labelled gauges, a dict
+    mapping tuples of label values to numbers.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, function, labels=()):
+        super(Gauge, self).__init__(name, help, labels)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        if not self.label_names:
+            return [('', (), (), value)]
+        return [('', self.label_names, key, value)
+                for key, value in sorted(value.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def samples(self):
+        names = self.label_names + ('le',)
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', names,
+                                    key + (format_value(bound),), cumulative))
+                samples.append(('_sum', self.label_names, key, total))
+                samples.append(('_count', self.label_names, key, cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+class TimingCursor(CursorWrapper):
+    def __init__(self, cursor, db, timer):
+        super(TimingCursor, self).__init__(cursor, db)
+        self.timer = timer
+
+    def execute(self, sql, params=()):
+        self.set_dirty()
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.timer.add(time.time() - started)
+
+    def executemany(self, sql, param_list):
+        self.set_dirty()
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.timer.add(time.time() - started)
+
+
+class QueryTimer(object):
+    """
+    Counts the queries run on each of the thread's database connections
+    between ``start`` and ``stop``, and the time they take. Unlike Django's
+    debug cursor, which it wraps when it was already enabled, it does not
+    format or log the queries.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._saved = []
+
+    def add(self, duration):
+        self.count += 1
+        self.duration += duration
+
+    def start(self):
+        for connection in connections.all():
+            self._saved.append((connection, connection.use_debug_cursor,
+                                connection.__dict__.get('make_debug_cursor')))
+            debugging = connection.use_debug_cursor or (
+                connection.use_debug_cursor is None and settings.DEBUG)
+            make_cursor = connection.make_debug_cursor if debugging else None
+            connection.make_debug_cursor = functools.partial(
+                self.wrap, connection, make_cursor)
+            connection.use_debug_cursor = True
+
+    def wrap(self, connection, make_cursor, cursor):
+        if make_cursor is not None:
+            cursor = make_cursor(cursor)
+        return TimingCursor(cursor, connection, self)
+
+    def stop(self):
+        for connection, use_debug_cursor, make_cursor in self._saved:
+            connection.use_debug_cursor = use_debug_cursor
+            if make_cursor is not None:
+                connection.make_debug_cursor = make_cursor
+            else:
+                del connection.make_debug_cursor
+        self._saved = []
+
+
+registry = Registry()
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1,
+                   2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+request_duration = registry.register(Histogram(
+    'shortener_request_duration_seconds',
+    'Time spent handling a request, by view.',
+    LATENCY_BUCKETS, labels=('view',)))
+responses = registry.register(Counter(
+    'shortener_responses_total',
+    'Responses sent, by view and status code.',
+    labels=('view', 'status')))
+db_queries = registry.register(Histogram(
+    'shortener_request_db_queries',
+    'Database queries run while handling a request, by view.',
+    QUERY_COUNT_BUCKETS, labels=('view',)))
+db_duration = registry.register(Histogram(
+    'shortener_request_db_duration_seconds',
+    'Time spent in database queries while handling a request, by view.',
+    LATENCY_BUCKETS, labels=('view',)))
+
+
+def link_cache_samples():
+    stats = link_cache.stats()
+    return {('local',): stats['local_hits'], ('shared',): stats['shared_hits'],
+            ('miss',): stats['misses']}
+
+
+def link_cache_hit_ratio():
+    stats = link_cache.stats()
+    hits = stats['local_hits'] + stats['shared_hits']
+    total = hits + stats['misses']
+    return float(hits) / total if total else 0.0
+
+
+registry.register(Gauge(
+    'shortener_link_cache_lookups',
+    'Redirect cache lookups since the process started, by result.',
+    link_cache_samples, labels=('result',)))
+registry.register(Gauge(
+    'shortener_link_cache_hit_ratio',
+    'Fraction of redirect cache lookups served from either tier.',
+    link_cache_hit_ratio))
+registry.register(Gauge(
+    'shortener_click_buffer_pending',
+    'Clicks counted but not yet written to the database.',
+    click_buffer.pending_total))
+registry.register(Gauge(
+    'shortener_click_flush_lag_seconds',
+    'Age of the oldest click not yet written to the database.',
+    click_buffer.lag))
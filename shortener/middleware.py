@@ -0,0 +1,105 @@
+import cProfile
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+
+from shortener import metrics
+from shortener.routers import (
+    last_write, PIN_COOKIE_NAME, pin_for_cookie, replica_pin_seconds, unpin)
+
+
+class MetricsMiddleware(object):
+    """
+    Records request latency, response status and database usage per view in
+    ``shortener.metrics.registry``. Put it first in MIDDLEWARE_CLASSES so
+    that the time spent in other middleware is included.
+
+    Queries on every database are counted and timed with a QueryTimer
+    unless ``SHORTENER_METRICS_TRACK_QUERIES`` is False.
+
+    With ``SHORTENER_PROFILE_SAMPLE_RATE`` above 0, that fraction of requests
+    to the views in ``SHORTENER_PROFILE_VIEWS`` is run under cProfile, and
+    the profile is written to ``SHORTENER_PROFILE_DIR`` if the request took
+    at least ``SHORTENER_PROFILE_MIN_DURATION`` seconds.
+    """
+    def __init__(self):
+        self.track_queries = getattr(
+            settings, 'SHORTENER_METRICS_TRACK_QUERIES', True)
+        self.profile_sample_rate = getattr(
+            settings, 'SHORTENER_PROFILE_SAMPLE_RATE', 0)
+        self.profile_views = getattr(
+            settings, 'SHORTENER_PROFILE_VIEWS', ('follow', 'submit'))
+        self.profile_min_duration = getattr(
+            settings, 'SHORTENER_PROFILE_MIN_DURATION', 0.1)
+        self.profile_dir = getattr(
+            settings, 'SHORTENER_PROFILE_DIR', tempfile.gettempdir())
+
+    def process_request(self, request):
+        request._metrics_started = time.time()
+        if self.track_queries:
+            request._metrics_queries = metrics.QueryTimer()
+            request._metrics_queries.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_func.__name__
+        if (self.profile_sample_rate and
+                view_func.__name__ in self.profile_views and
+                random.random() < self.profile_sample_rate):
+            request._metrics_profiler = cProfile.Profile()
+            request._metrics_profiler.enable()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            # an earlier middleware answered before process_request ran
+            return response
+        duration = time.time() - started
+        view = getattr(request, '_metrics_view', 'unresolved')
+
+        profiler = getattr(request, '_metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if duration >= self.profile_min_duration:
+                self.dump_profile(profiler, view, duration)
+
+        metrics.request_duration.observe(duration, view=view)
+        metrics.responses.inc(view=view, status=response.status_code)
+        queries = getattr(request, '_metrics_queries', None)
+        if queries is not None:
+            queries.stop()
+            metrics.db_queries.observe(queries.count, view=view)
+            metrics.db_duration.observe(queries.duration, view=view)
+        return response
+
+    def dump_profile(self, profiler, view, duration):
+        filename = '%s-%d-%d-%dms.prof' % (
+            view, time.time(), os.getpid(), duration * 1000)
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Gives a client that has just written, for example by submitting a link,
+    a cookie that sends its reads to the primary for
+    ``SHORTENER_REPLICA_PIN_SECONDS``, so that it does not find its own link
+    missing from a lagging replica. Used with
+    ``shortener.routers.ReplicaRouter``.
+    """
+    def process_request(self, request):
+        request._replica_started = time.time()
+        # the thread's earlier requests were for other clients
+        unpin()
+        if PIN_COOKIE_NAME in request.COOKIES:
+            pin_for_cookie(request.COOKIES[PIN_COOKIE_NAME])
+
+    def process_response(self, request, response):
+        started = getattr(request, '_replica_started', None)
+        if started is not None and last_write() >= started:
+            seconds = replica_pin_seconds()
+            response.set_cookie(
+                PIN_COOKIE_NAME, '%d' % (time.time() + seconds + 1),
+                max_age=seconds, httponly=True)
+        return response
@@ -1,16 +1,391 @@
-from django.db import models
+import hashlib
+import urlparse
+
+from django.db import (IntegrityError, connections, models, router,
+                       transaction)
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 
 from shortener.baseconv import base62
+from shortener.bloom import LinkFilter
+from shortener.cache import link_cache, links_version
+from shortener.ids import IdAllocator
+from shortener.leaderboards import Leaderboard
+from shortener.redirectmap import redirect_map
+from shortener.routers import databases_for, group_by_shard, shard_for
+
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+DEFAULT_ARCHIVE_RESTORE_HITS = 10
+DEFAULT_ARCHIVE_RESTORE_WINDOW = 24 * 60 * 60
+
+
+def normalize_url(url):
+    """
+    Returns a canonical form of ``url`` for duplicate detection: the scheme
+    and host are lowercased, default ports are dropped and an empty path
+    becomes "/".
+
+    >>> normalize_url('HTTP://WWW.Python.org:80')
+    'http://www.python.org/'
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    scheme = scheme.lower()
+    userinfo, at, host = netloc.rpartition('@')
+    host = host.lower()
+    if host.endswith(':' + DEFAULT_PORTS.get(scheme, '')):
+        host = host.rsplit(':', 1)[0]
+    return urlparse.urlunsplit(
+        (scheme, userinfo + at + host, path or '/', query, fragment))
+
+
+def hash_url(url):
+    """
+    Returns the fixed-length hash of the normalized ``url`` that is stored in
+    Link.url_hash.
+    """
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+class LinkQuerySet(models.query.QuerySet):
+    """
+    Sends queries for a single link id to the shard holding it, unless a
+    database was chosen with using().
+    """
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        clone = super(LinkQuerySet, self)._filter_or_exclude(
+            negate, *args, **kwargs)
+        if not negate and clone._db is None:
+            link_id = kwargs.get('id', kwargs.get('pk'))
+            if isinstance(link_id, (int, long)):
+                clone._db = shard_for(link_id)
+        return clone
+
+
+class ShardedManager(models.Manager):
+    """
+    Manager of the models whose primary key is a link id, whose queries for
+    a single id go to the shard holding it.
+    """
+    def get_query_set(self):
+        return LinkQuerySet(self.model, using=self._db)
+
+
+class LinkManager(ShardedManager):
+    def create(self, **kwargs):
+        # QuerySet.create() would pick the database before the id is known
+        link = self.model(**kwargs)
+        link.save(force_insert=True, using=self._db)
+        return link
+
+    def find_by_url(self, url):
+        """
+        Returns the oldest link whose URL normalizes to the same value as
+        ``url``, or None.
+        """
+        normalized = normalize_url(url)
+        found = None
+        for db in databases_for(self.model):
+            links = self.using(db).filter(url_hash=hash_url(url))
+            for link in links.order_by('id')[:10]:
+                if normalize_url(link.url) == normalized:
+                    if found is None or link.id < found.id:
+                        found = link
+                    break
+        return found
+
+    def create_with_id(self, link_id, url):
+        """
+        Creates a link with the given id, returning None instead if the id
+        is already taken.
+        """
+        link = self.model(id=link_id, url=url)
+        if not self.insert(link):
+            return None
+        return link
+
+    def insert(self, link):
+        """
+        Inserts the unsaved ``link`` with the id it was given, returning
+        False if the id is already taken by a link or an archived link.
+        Relies on the primary key rather than a separate check so that
+        concurrent claims of the same id are safe, and the INSERT itself
+        skips ids in the archive, which shares the link's database.
+        """
+        using = router.db_for_write(self.model, instance=link)
+        sid = transaction.savepoint(using=using)
+        try:
+            inserted = self._insert_unless_archived(link, using)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=using)
+            # without savepoints (SQLite) the failed insert's transaction
+            # would hold the write lock until the connection is closed
+            transaction.rollback_unless_managed(using=using)
+            return False
+        transaction.savepoint_commit(sid, using=using)
+        return inserted
+
+    def _insert_unless_archived(self, link, using):
+        """
+        Saves ``link`` like ``save(force_insert=True)``, signals included,
+        with an INSERT ... SELECT that adds no row if the id is archived.
+        Returns False in that case.
+        """
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        link.url_hash = hash_url(link.url)
+        pre_save.send(sender=self.model, instance=link, raw=False,
+                      using=using, update_fields=None)
+        fields = self.model._meta.local_fields
+        values = [field.get_db_prep_save(field.pre_save(link, True),
+                                         connection=connection)
+                  for field in fields]
+        cursor = connection.cursor()
+        cursor.execute(
+            'INSERT INTO %s (%s) SELECT %s%s WHERE NOT EXISTS '
+            '(SELECT 1 FROM %s WHERE id = %%s)' % (
+                quote_name(self.model._meta.db_table),
+                ', '.join(quote_name(field.column) for field in fields),
+                ', '.join(['%s'] * len(fields)),
+                # MySQL only takes a WHERE clause after a FROM clause
+                ' FROM DUAL' if connection.vendor == 'mysql' else '',
+                quote_name(ArchivedLink._meta.db_table)),
+            values + [link.id])
+        if not cursor.rowcount:
+            return False
+        transaction.commit_unless_managed(using=using)
+        link._state.db = using
+        link._state.adding = False
+        post_save.send(sender=self.model, instance=link, created=True,
+                       raw=False, using=using, update_fields=None)
+        return True
+
+    def might_exist(self, link_id):
+        """
+        Returns False if there is certainly no link, active or archived, with
+        the given id, according to the redirect cache and the link filter.
+        """
+        return (link_cache.get(link_id) is not None or
+                link_filter.might_exist(link_id))
+
+    def resolve(self, link_id):
+        """
+        Returns the URL that the link with the given id points to, or None if
+        there is no such link. Lookups go through the redirect cache, the
+        compiled redirect map and the link filter before falling back to the
+        database. An archived link is served from the archive, and moved
+        back into the links table once it is followed often enough again.
+        """
+        return self.follow(link_id)[0]
+
+    def follow(self, link_id):
+        """
+        Like ``resolve``, but returns a (url, archived) pair, where archived
+        is True if the URL was served from the archive. Clicks on archived
+        links have no row to be counted in.
+        """
+        url = link_cache.get(link_id)
+        if url is None:
+            url = redirect_map.get(link_id)
+            if url is not None:
+                return url, False
+            if not link_filter.might_exist(link_id):
+                return None, False
+            urls = self.filter(id=link_id).values_list('url', flat=True)[:1]
+            if not urls:
+                url, archived = ArchivedLink.objects.follow(link_id)
+                if url is None:
+                    link_filter.record_miss(link_id)
+                return url, archived
+            url = urls[0]
+            link_cache.set(link_id, url)
+        return url, False
+
+
+    def resolve_many(self, link_ids):
+        """
+        Returns a dict mapping each of ``link_ids`` that belongs to a link to
+        its URL. Ids missing from the redirect cache and the compiled
+        redirect map are looked up with one query per shard, and those not
+        found with another one in the archive. Archived links are not
+        restored.
+        """
+        urls = {}
+        uncached = []
+        for link_id in set(link_ids):
+            url = link_cache.get(link_id)
+            if url is not None:
+                urls[link_id] = url
+            else:
+                uncached.append(link_id)
+        urls.update(redirect_map.get_many(uncached))
+        missing = [link_id for link_id in uncached if link_id not in urls and
+                   link_filter.might_exist(link_id)]
+        for db, ids in group_by_shard(missing).iteritems():
+            urls.update(self.using(db).filter(
+                id__in=ids).values_list('id', 'url'))
+            archived = [link_id for link_id in ids if link_id not in urls]
+            if archived:
+                urls.update(ArchivedLink.objects.using(db).filter(
+                    id__in=archived).values_list('id', 'url'))
+        return urls
 
 
 class Link(models.Model):
     """
     Model that represents a shortened URL
     """
+    # allocated by save(), and as wide as the ids custom codes decode to
+    id = models.BigIntegerField(primary_key=True, editable=False)
+    url = models.URLField(db_index=True)
+    date_submitted = models.DateTimeField(auto_now_add=True, db_index=True)
+    usage_count = models.PositiveIntegerField(default=0, db_index=True)
+    url_hash = models.CharField(
+        max_length=40, db_index=True, blank=True, editable=False)
+    # set when clicks are flushed, so only as precise as the click buffer
+    last_followed = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = LinkManager()
+
+    # attempts at inserting a link with a freshly allocated id before giving
+    # up, in case custom codes keep claiming the allocated ids first
+    save_attempts = 5
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        self.url_hash = hash_url(self.url)
+        if self.id is not None:
+            return super(Link, self).save(
+                force_insert=force_insert, force_update=force_update,
+                using=using, update_fields=update_fields)
+
+        for attempt in xrange(self.save_attempts):
+            self.id = id_allocator.next_id()
+            db = using or router.db_for_write(self.__class__, instance=self)
+            sid = transaction.savepoint(using=db)
+            try:
+                super(Link, self).save(force_insert=True, using=db)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=db)
+                transaction.rollback_unless_managed(using=db)
+                self.id = None
+                if attempt == self.save_attempts - 1:
+                    raise
+            else:
+                transaction.savepoint_commit(sid, using=db)
+                return
+
+    def to_base62(self):
+        return base62.from_decimal(self.id)
+
+    def __unicode__(self):
+        return  '%s : %s' % (self.to_base62(), self.url)
+
+    class Meta:
+        get_latest_by = 'date_submitted'
+
+
+class ArchivedLinkManager(ShardedManager):
+    hits_key_prefix = 'shortener:archived-hits:'
+
+    def follow(self, link_id):
+        """
+        Returns a (url, archived) pair for the archived link with the given
+        id: its URL, and False if it was moved back into the links table by
+        this hit, or (None, False) if there is no such archived link. The
+        link is moved back once it has been followed
+        SHORTENER_ARCHIVE_RESTORE_HITS times within
+        SHORTENER_ARCHIVE_RESTORE_WINDOW seconds, so that a single request,
+        such as a crawler's, does not restore it.
+        """
+        urls = list(self.filter(id=link_id).values_list('url', flat=True)[:1])
+        if not urls:
+            return None, False
+        restore_hits = getattr(settings, 'SHORTENER_ARCHIVE_RESTORE_HITS',
+                               DEFAULT_ARCHIVE_RESTORE_HITS)
+        if self.count_hit(link_id) >= restore_hits:
+            # None if another process restored it first
+            link = self.restore(link_id)
+            cache.delete(self.hits_key_prefix + str(link_id))
+            if link is not None:
+                # post_save has cached it
+                return link.url, False
+        return urls[0], True
+
+    def count_hit(self, link_id):
+        """
+        Counts a redirect to the archived link with the given id in Django's
+        cache and returns the number counted since the window started.
+        """
+        key = self.hits_key_prefix + str(link_id)
+        window = getattr(settings, 'SHORTENER_ARCHIVE_RESTORE_WINDOW',
+                         DEFAULT_ARCHIVE_RESTORE_WINDOW)
+        cache.add(key, 0, window)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # evicted since it was added
+            cache.set(key, 1, window)
+            return 1
+
+    def restore(self, link_id):
+        """
+        Moves the archived link with the given id back into the links table
+        and returns it as a Link, or returns None if there is no such
+        archived link.
+        """
+        using = shard_for(link_id) or router.db_for_write(self.model)
+        with transaction.commit_on_success(using=using):
+            archived = list(self.using(using).select_for_update().filter(
+                id=link_id)[:1])
+            if not archived:
+                return None
+            link = archived[0].to_link()
+            link.last_followed = timezone.now()
+            self.using(using).filter(id=link_id).delete()
+            if Link.objects.insert(link):
+                # auto_now_add replaced the submission date
+                link.date_submitted = archived[0].date_submitted
+                Link.objects.using(using).filter(id=link_id).update(
+                    date_submitted=link.date_submitted)
+        # an older date drops the link from the board
+        recent_links.update_links([link])
+        return link
+
+
+class ArchivedLink(models.Model):
+    """
+    A link that has not been followed for a long time, moved out of the
+    links table by ``manage.py archive_links``. It keeps its id, so its
+    short code still works, but none of the links table's indexes.
+    """
+    id = models.BigIntegerField(primary_key=True)
     url = models.URLField()
-    date_submitted = models.DateTimeField(auto_now_add=True)
+    date_submitted = models.DateTimeField()
     usage_count = models.PositiveIntegerField(default=0)
+    last_followed = models.DateTimeField(null=True)
+
+    objects = ArchivedLinkManager()
+
+    @classmethod
+    def from_link(cls, link):
+        return cls(id=link.id, url=link.url,
+                   date_submitted=link.date_submitted,
+                   usage_count=link.usage_count,
+                   last_followed=link.last_followed)
+
+    def to_link(self):
+        """
+        Returns an unsaved Link with the fields of this archived link.
+        """
+        return Link(id=self.id, url=self.url,
+                    date_submitted=self.date_submitted,
+                    usage_count=self.usage_count,
+                    last_followed=self.last_followed)
 
     def to_base62(self):
         return base62.from_decimal(self.id)
@@ -18,5 +393,131 @@ class Link(models.Model):
     def __unicode__(self):
         return  '%s : %s' % (self.to_base62(), self.url)
 
+
+class IdSequence(models.Model):
+    """
+    The next id that IdAllocator will hand out for a sequence
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField()
+
+
+class ClickEvent(models.Model):
+    """
+    A single redirect, kept until it is rolled up into HourlyClicks and
+    DailyClicks
+    """
+    link = models.ForeignKey(Link, related_name='click_events')
+    clicked_at = models.DateTimeField()
+
+
+class HourlyClicks(models.Model):
+    """
+    Number of redirects of a link during an hour (UTC)
+    """
+    link = models.ForeignKey(Link, related_name='hourly_clicks')
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
     class Meta:
-        get_latest_by = 'date_submitted'
+        unique_together = ('link', 'hour')
+
+
+class DailyClicks(models.Model):
+    """
+    Number of redirects of a link during a day (UTC)
+    """
+    link = models.ForeignKey(Link, related_name='daily_clicks')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('link', 'day')
+
+
+class DailyVisitors(models.Model):
+    """
+    HyperLogLog sketch of the visitors of a link during a day (UTC)
+    """
+    link = models.ForeignKey(Link, related_name='daily_visitors')
+    day = models.DateField()
+    sketch = models.TextField()
+
+    class Meta:
+        unique_together = ('link', 'day')
+
+
+class LinkCheck(models.Model):
+    """
+    The result of the last check of a link's target by ``manage.py
+    check_links``
+    """
+    link = models.OneToOneField(
+        Link, primary_key=True, related_name='target_check')
+    # the status of the last response, or None if there was none
+    status = models.PositiveSmallIntegerField(null=True)
+    # where the target redirects to, if anywhere
+    final_url = models.TextField(blank=True)
+    error = models.CharField(max_length=200, blank=True)
+    checked_at = models.DateTimeField()
+
+    objects = ShardedManager()
+
+
+id_allocator = IdAllocator(
+    IdSequence, Link, 'link', archive_model=ArchivedLink)
+link_filter = LinkFilter(Link, archive_model=ArchivedLink)
+recent_links = Leaderboard(Link, 'recent', 'date_submitted')
+popular_links = Leaderboard(Link, 'popular', 'usage_count')
+
+
+@receiver(post_save, sender=Link)
+def refresh_cached_link(sender, instance, **kwargs):
+    link_cache.set(instance.id, instance.url)
+
+
+@receiver(post_save, sender=Link)
+def add_to_link_filter(sender, instance, **kwargs):
+    link_filter.add(instance.id)
+
+
+@receiver(post_save, sender=Link)
+def update_leaderboards(sender, instance, **kwargs):
+    if isinstance(instance.usage_count, (int, long)):
+        recent_links.update_links([instance])
+        popular_links.update_links([instance])
+    else:
+        # saved with an F() expression, so the new count is unknown
+        popular_links.remove(instance.id)
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def bump_links_version(sender, instance, **kwargs):
+    links_version.bump()
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def forget_compiled_link(sender, instance, created=False, **kwargs):
+    # a new link is only in the map if a link with its id was deleted,
+    # which was recorded then
+    if not created:
+        redirect_map.forget(instance.id)
+
+
+@receiver(post_delete, sender=Link)
+def invalidate_cached_link(sender, instance, **kwargs):
+    link_cache.delete(instance.id)
+
+
+@receiver(post_delete, sender=Link)
+def remember_deleted_link(sender, instance, **kwargs):
+    # Bloom filters cannot forget ids; the next rebuild drops it
+    link_filter.record_miss(instance.id)
+
+
+@receiver(post_delete, sender=Link)
+def remove_from_leaderboards(sender, instance, **kwargs):
+    recent_links.remove(instance.id)
+    popular_links.remove(instance.id)
@@ -0,0 +1,180 @@
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from shortener.cache import cache_is_shared
+from shortener.files import WatchedFile, atomic_write
+
+
+MAGIC = b'SRM1'
+# magic, number of links, offset of the URL blob
+HEADER = struct.Struct('<4sQQ')
+# link id, offset of the URL in the blob, length of the URL
+RECORD = struct.Struct('<qQI')
+LINK_ID = struct.Struct('<q')
+
+DEFAULT_REDIRECT_MAP_MAX_AGE = 24 * 60 * 60
+
+
+def write_redirect_map(path, links):
+    """
+    Writes the (id, url) pairs from ``links``, which must be in ascending id
+    order, to a redirect map at ``path``. The map is written to a temporary
+    file that replaces ``path`` atomically, so readers see either the old or
+    the new map. Returns the number of links written.
+
+    The file's mtime is set to when writing started, since links changed
+    after that may have been read before the change.
+    """
+    started_at = time.time()
+    directory = os.path.dirname(os.path.abspath(path))
+    with atomic_write(path) as f:
+        # records and URLs are streamed to separate files, then joined
+        with tempfile.TemporaryFile(dir=directory) as blob:
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            count = 0
+            offset = 0
+            last_id = None
+            for link_id, url in links:
+                if last_id is not None and link_id <= last_id:
+                    raise ValueError('links must be in ascending id order')
+                last_id = link_id
+                url = url.encode('utf-8')
+                f.write(RECORD.pack(link_id, offset, len(url)))
+                blob.write(url)
+                offset += len(url)
+                count += 1
+            blob_offset = f.tell()
+            blob.seek(0)
+            shutil.copyfileobj(blob, f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count, blob_offset))
+    os.utime(path, (started_at, started_at))
+    return count
+
+
+class CompiledMap(object):
+    """
+    A read-only memory map of a file written by ``write_redirect_map``.
+    Processes mapping the same file share its pages.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.blob_offset = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.data.close()
+            raise ValueError('%s is not a redirect map' % path)
+
+    def get(self, link_id):
+        """
+        Returns the URL of ``link_id`` by binary search, or None.
+        """
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = HEADER.size + middle * RECORD.size
+            found_id = LINK_ID.unpack_from(data, position)[0]
+            if found_id < link_id:
+                low = middle + 1
+            elif found_id > link_id:
+                high = middle
+            else:
+                found_id, offset, length = RECORD.unpack_from(data, position)
+                start = self.blob_offset + offset
+                return data[start:start + length].decode('utf-8')
+        return None
+
+
+class RedirectMap(WatchedFile):
+    """
+    Looks link ids up in the compiled redirect map at ``path``, written by
+    ``manage.py compile_redirects``, without querying the database.
+
+    Links created after the map was compiled are not in it and have to be
+    looked up elsewhere. Links edited or deleted since are recorded with
+    ``forget`` in Django's cache, and the map's copy of them is ignored; a
+    hit in the map therefore costs one cache lookup. A map older than
+    ``max_age`` seconds, which is also how long changes are remembered, is
+    not used at all, so recompile more often than that.
+
+    The file is checked for a new version every ``check_interval`` seconds
+    and mapped again when it has been replaced.
+
+    Configured with the ``SHORTENER_REDIRECT_MAP_PATH`` and
+    ``SHORTENER_REDIRECT_MAP_MAX_AGE`` settings; lookups always miss when
+    the path is not set. A path is refused unless Django's cache is shared
+    between processes, since the others would keep serving the map's copy
+    of links changed by one of them.
+    """
+    changed_key_prefix = 'shortener:redirect-map-changed:'
+
+    def __init__(self, path=None, max_age=None):
+        if path is None:
+            path = getattr(settings, 'SHORTENER_REDIRECT_MAP_PATH', None)
+        if path is not None and not cache_is_shared():
+            raise ImproperlyConfigured(
+                'SHORTENER_REDIRECT_MAP_PATH needs a CACHES backend shared '
+                'between processes, such as memcached.')
+        super(RedirectMap, self).__init__(path, CompiledMap)
+        self.max_age = max_age or getattr(
+            settings, 'SHORTENER_REDIRECT_MAP_MAX_AGE',
+            DEFAULT_REDIRECT_MAP_MAX_AGE)
+
+    def make_changed_key(self, link_id):
+        return '%s%d' % (self.changed_key_prefix, link_id)
+
+    def current(self):
+        compiled = super(RedirectMap, self).current()
+        if compiled is not None and (
+                time.time() - self.modified_at > self.max_age):
+            # changes made before max_age ago have been forgotten
+            return None
+        return compiled
+
+    def get(self, link_id):
+        return self.get_many([link_id]).get(link_id)
+
+    def get_many(self, link_ids):
+        """
+        Returns a dict mapping each of ``link_ids`` found in the map, and
+        not changed since it was compiled, to its URL.
+        """
+        if self.path is None:
+            return {}
+        compiled = self.current()
+        if compiled is None:
+            return {}
+        urls = {}
+        for link_id in link_ids:
+            url = compiled.get(link_id)
+            if url is not None:
+                urls[link_id] = url
+        if urls:
+            compiled_at = self.modified_at
+            keys = dict((self.make_changed_key(link_id), link_id)
+                        for link_id in urls)
+            for key, changed_at in cache.get_many(keys.keys()).iteritems():
+                if changed_at >= compiled_at:
+                    del urls[keys[key]]
+        return urls
+
+    def forget(self, link_id):
+        """
+        Records that the link with ``link_id`` was edited or deleted, so
+        that the copy in a map compiled before now is no longer used.
+        """
+        if self.path is not None:
+            cache.set(self.make_changed_key(link_id), time.time(),
+                      self.max_age)
+
+
+redirect_map = RedirectMap()
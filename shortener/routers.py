@@ -0,0 +1,227 @@
+"""
+Database routers for running the shortener on several databases.
+
+``ReplicaRouter`` sends reads to the read replicas and writes to the
+primary. ``ShardRouter`` splits the links, and the rows that belong to them,
+between several databases by link id. Enable one of them with
+DATABASE_ROUTERS; see ``django_url_shortener/settings_replicas.py`` and
+``django_url_shortener/settings_sharded.py`` for examples.
+
+Django only passes a router the instance being saved or followed, not the
+filters of a query, so code that queries sharded models by link id picks
+the database itself with ``shard_for``, and code that scans them runs once
+per database returned by ``databases_for``.
+"""
+import bisect
+import random
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+DEFAULT_REPLICA_PIN_SECONDS = 5
+PIN_COOKIE_NAME = 'shortener_primary'
+
+# the sharded models of this app and the attribute holding their link id
+SHARDED_MODELS = {
+    'link': 'id',
+    'archivedlink': 'id',
+    'clickevent': 'link_id',
+    'hourlyclicks': 'link_id',
+    'dailyclicks': 'link_id',
+    'dailyvisitors': 'link_id',
+    'linkcheck': 'link_id',
+}
+
+_state = threading.local()
+
+
+def pin_to_primary(until):
+    """
+    Sends this thread's reads to the primary until the given time.
+    """
+    _state.pinned_until = max(getattr(_state, 'pinned_until', 0), until)
+
+
+def pin_for_cookie(value):
+    """
+    Pins this thread to the primary if ``value``, the value of the
+    PIN_COOKIE_NAME cookie, has not expired.
+    """
+    try:
+        until = float(value)
+    except (TypeError, ValueError):
+        return
+    pin_to_primary(min(until, time.time() + replica_pin_seconds()))
+
+
+def is_pinned():
+    return (getattr(_state, 'forced', 0) > 0 or
+            getattr(_state, 'pinned_until', 0) > time.time())
+
+
+def unpin():
+    """
+    Forgets this thread's writes and its pin to the primary. Called at the
+    start of each request, so that a thread does not keep reading from the
+    primary for the clients it serves after one that wrote.
+    """
+    _state.pinned_until = 0
+    _state.last_write = 0
+
+
+def last_write():
+    """
+    Returns the time this thread last asked for the primary to write to.
+    """
+    return getattr(_state, 'last_write', 0)
+
+
+@contextmanager
+def reading_from_primary():
+    """
+    Sends this thread's reads to the primary within the block, for code
+    that must not see a lagging replica.
+    """
+    _state.forced = getattr(_state, 'forced', 0) + 1
+    try:
+        yield
+    finally:
+        _state.forced -= 1
+
+
+def replica_pin_seconds():
+    return getattr(settings, 'SHORTENER_REPLICA_PIN_SECONDS',
+                   DEFAULT_REPLICA_PIN_SECONDS)
+
+
+def sharding():
+    """
+    Returns the sharding mode, 'hash' or 'range', or None.
+    """
+    return getattr(settings, 'SHORTENER_SHARDING', None)
+
+
+def shards():
+    """
+    Returns the aliases of the databases holding sharded models.
+    """
+    if sharding() == 'range':
+        return [alias for start, alias in settings.SHORTENER_SHARDS]
+    return list(settings.SHORTENER_SHARDS)
+
+
+def is_sharded(model):
+    return (sharding() is not None and
+            model._meta.app_label == 'shortener' and
+            model._meta.object_name.lower() in SHARDED_MODELS)
+
+
+def shard_for(link_id):
+    """
+    Returns the alias of the database holding the link with the given id,
+    or None when links are not sharded, which lets the routers decide.
+
+    In 'hash' mode SHORTENER_SHARDS is a list of aliases and links are
+    spread by a hash of their id. In 'range' mode it is a list of
+    (first id, alias) pairs in ascending order; ids below the first
+    range go to the first database.
+    """
+    mode = sharding()
+    if mode is None:
+        return None
+    if mode == 'hash':
+        aliases = settings.SHORTENER_SHARDS
+        digest = zlib.crc32(struct.pack('<q', link_id)) & 0xffffffff
+        return aliases[digest % len(aliases)]
+    ranges = settings.SHORTENER_SHARDS
+    index = bisect.bisect_right([start for start, alias in ranges], link_id)
+    return ranges[max(index - 1, 0)][1]
+
+
+def group_by_shard(link_ids):
+    """
+    Returns a dict mapping the result of ``shard_for`` to the ids it holds.
+    """
+    groups = {}
+    for link_id in link_ids:
+        groups.setdefault(shard_for(link_id), []).append(link_id)
+    return groups
+
+
+def databases_for(model):
+    """
+    Returns the databases to scan for all rows of ``model``: each shard for
+    sharded models, otherwise [None], letting the routers decide.
+    """
+    if is_sharded(model):
+        return shards()
+    return [None]
+
+
+class ReplicaRouter(object):
+    """
+    Sends writes to the default database and reads to one of the databases
+    in ``SHORTENER_READ_REPLICAS``.
+
+    Reads stay on the default database while a transaction is open on it,
+    within ``reading_from_primary``, and for the rest of a request once it
+    has written, so that a request reads its own writes.
+    ``shortener.middleware.ReplicaPinMiddleware``, which clears the pin at
+    the start of each request, extends it to the following requests of the
+    same client for ``SHORTENER_REPLICA_PIN_SECONDS`` with a cookie.
+    """
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'SHORTENER_READ_REPLICAS', ())
+        if (not replicas or is_pinned() or
+                transaction.is_managed(using=DEFAULT_DB_ALIAS)):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        now = time.time()
+        _state.last_write = now
+        pin_to_primary(now + replica_pin_seconds())
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same rows
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ShardRouter(object):
+    """
+    Routes links, and the click rows belonging to them, to the database
+    chosen by ``shard_for``; every other model lives in the default database.
+    """
+    def shard(self, model, hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        link_id = getattr(
+            instance, SHARDED_MODELS[model._meta.object_name.lower()])
+        if link_id is None:
+            return None
+        return shard_for(link_id)
+
+    def db_for_read(self, model, **hints):
+        return self.shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.shard(model, hints)
+
+    def allow_syncdb(self, db, model):
+        if is_sharded(model):
+            return db in shards()
+        return db == DEFAULT_DB_ALIAS
+
@@ -1,11 +1,79 @@
+import hashlib
+
 from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+from django.utils.http import urlquote
 
 register = template.Library()
 
+DEFAULT_FRAGMENT_CACHE_TIMEOUT = 300
+
+# the most (scheme, host) pairs whose prefix is remembered; the Host header
+# comes from the client, so the memo is emptied when it is full
+MAX_PREFIXES = 100
+_prefixes = {}
+
+
+def short_url_prefix(request):
+    """
+    Returns the scheme and host short URLs of this request start with.
+    """
+    key = (request.META['wsgi.url_scheme'], request.META['HTTP_HOST'])
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        if len(_prefixes) >= MAX_PREFIXES:
+            _prefixes.clear()
+        prefix = _prefixes[key] = '%s://%s/' % key
+    return prefix
+
 
 @register.simple_tag(takes_context=True)
 def short_url(context, link):
-    request = context['request']
-    http_host = request.META['HTTP_HOST']
-    scheme = request.META['wsgi.url_scheme']
-    return '%s://%s/%s' % (scheme, http_host, link.to_base62())
+    return short_url_prefix(context['request']) + link.to_base62()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.vary_on = [template.Variable(var) for var in vary_on]
+
+    def render(self, context):
+        timeout = getattr(settings, 'SHORTENER_FRAGMENT_CACHE_TIMEOUT',
+                          DEFAULT_FRAGMENT_CACHE_TIMEOUT)
+        if not timeout:
+            return self.nodelist.render(context)
+        key = ':'.join(urlquote(var.resolve(context)) for var in self.vary_on)
+        cache_key = 'shortener:fragment:%s:%s' % (
+            self.fragment_name, hashlib.md5(force_bytes(key)).hexdigest())
+        value = cache.get(cache_key)
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(cache_key, value, timeout)
+        return value
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """
+    Caches its contents for ``SHORTENER_FRAGMENT_CACHE_TIMEOUT`` seconds,
+    like Django's ``{% cache %}`` tag, with a key built from the fragment
+    name and the values of the variables that follow it. A timeout of 0
+    turns the cache off.
+
+        {% fragment_cache index_links links_version request.META.HTTP_HOST %}
+            ...
+        {% endfragment_cache %}
+
+    Vary on a version that is bumped when the content changes, such as
+    ``shortener.cache.links_version``, rather than deleting keys.
+    """
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 2:
+        raise template.TemplateSyntaxError(
+            '%r tag requires a fragment name.' % tokens[0])
+    return FragmentCacheNode(nodelist, tokens[1], tokens[2:])
@@ -1,19 +1,112 @@
+import csv
+import datetime
+import json
+import os
 import random
+import shutil
+import socket
 import string
 import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from unittest import skipUnless
 
 
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.handlers.wsgi import WSGIHandler
 from django.core.urlresolvers import reverse
+from django.db import (
+    connection, connections, DatabaseError, DEFAULT_DB_ALIAS, transaction)
+from django.http import HttpResponse
 from django.template import Context, RequestContext, Template
-from django.test import TestCase
+from django.test import (
+    SimpleTestCase, TestCase as DjangoTestCase, TransactionTestCase)
 from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
 
-from shortener.baseconv import base62, DecodingError, EncodingError
+from shortener.admin import EstimatedCountPaginator, LinkAdmin
+from shortener.baseconv import (
+    base62, BaseConverter, DecodingError, DecodingOverflowError,
+    EncodingError)
+from shortener.bloom import BloomFilter, LinkFilter
+from shortener.bulk import create_links
+from shortener.cache import LRUCache, LinkCache, link_cache
+from shortener.clicks import ClickBuffer, click_buffer
+from shortener.fastpath import RedirectFastPath
+from shortener.ids import IdAllocator
+from shortener.redirectmap import (
+    RedirectMap, redirect_map, write_redirect_map)
+from shortener.middleware import ReplicaPinMiddleware
+from shortener.throttle import Throttle, parse_rate
+from shortener.routers import (
+    databases_for, group_by_shard, is_pinned, PIN_COOKIE_NAME,
+    pin_to_primary, reading_from_primary, ReplicaRouter, shard_for, sharding,
+    unpin)
+from shortener.metrics import (
+    Counter, Gauge, Histogram, QueryTimer, Registry)
 from shortener.forms import too_long_error
-from shortener.models import Link
+from shortener.archive import archive_cutoff, archive_links
+from shortener.linkcheck import check_links, is_public_address, LinkChecker
+from shortener.warmup import compile_templates, import_views, warm_up
+from shortener import analytics
+from shortener.analytics import (
+    roll_up_clicks, truncate_to_hour, unique_visitors)
+from shortener.hll import HyperLogLog
+from shortener.models import (
+    ArchivedLink, ClickEvent, LinkCheck, DailyClicks, DailyVisitors, hash_url, HourlyClicks,
+    id_allocator, IdSequence, Link,
+    link_filter, normalize_url, popular_links, recent_links)
 
 # needed for the short_url templatetag
 CUSTOM_HTTP_HOST = 'django.testserver'
+# a backend shared between processes; only checked, never connected to
+MEMCACHED = {'default': {
+    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    'LOCATION': '127.0.0.1:11211',
+}}
+
+
+class TestCase(DjangoTestCase):
+    # roll back every database, for the sharded settings
+    multi_db = True
+
+
+def link_db(link_id):
+    """
+    Returns the alias of the database holding ``link_id``, for counting its
+    queries.
+    """
+    return shard_for(link_id) or DEFAULT_DB_ALIAS
+
+
+def count_links():
+    return sum(Link.objects.using(db).count() for db in databases_for(Link))
+
+
+def enforce_foreign_keys(test):
+    """
+    Turns on SQLite's foreign key checks, which other databases always
+    make, until the end of ``test``.
+    """
+    for alias in databases_for(Link):
+        connection = connections[alias or DEFAULT_DB_ALIAS]
+        if connection.vendor != 'sqlite':
+            continue
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        test.addCleanup(cursor.execute, 'PRAGMA foreign_keys = OFF')
 
 
 class TemplateTagTestCase(TestCase):
@@ -49,10 +142,64 @@ class TemplateTagTestCase(TestCase):
         self.assertEqual(
             out, 'http://%s/%s' % (self.HTTP_HOST, link.to_base62()))
 
+    def test_fragment_cache(self):
+        """
+        the fragment_cache tag renders its contents once per set of values
+        """
+        template = Template(
+            "{% load shortener_helpers %}"
+            "{% fragment_cache test version %}{{ value }}{% endfragment_cache %}")
+        cache.clear()
+        render = lambda **values: template.render(Context(values))
+        self.assertEqual(render(version=1, value='a'), 'a')
+        self.assertEqual(render(version=1, value='b'), 'a')
+        self.assertEqual(render(version=2, value='b'), 'b')
+        with override_settings(SHORTENER_FRAGMENT_CACHE_TIMEOUT=0):
+            self.assertEqual(render(version=1, value='c'), 'c')
+
+
+class FragmentCachingTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        click_buffer.clear()
+        self.link = Link.objects.create(url='http://www.python.org/')
+
+    def test_index_links_are_cached(self):
+        """
+        the index page lists are rendered again once links are created or
+        clicks are flushed
+        """
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, self.link.url)
+        response = self.client.get(reverse('index'))
+        # served from the cache without reading the leaderboards
+        self.assertEqual(response.context['recent_links']._items, None)
+        link = Link.objects.create(url='http://www.djangoproject.com/')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, link.url)
+        click_buffer.record(link.id, 3)
+        click_buffer.flush()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '(Count: 3)')
+
+    def test_info_is_cached(self):
+        """
+        the info page is rendered again once its link is clicked
+        """
+        url = reverse('info', kwargs={'base62_id': self.link.to_base62()})
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['hourly_clicks']._items, None)
+        click_buffer.record(self.link.id)
+        response = self.client.get(url)
+        self.assertContains(response, 'Score: 1')
+
 
 class ViewTestCase(TestCase):
     def setUp(self):
         self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        click_buffer.clear()
 
     def test_submit(self):
         """
@@ -141,6 +288,24 @@ class ViewTestCase(TestCase):
         self.assertTemplateUsed(response, 'shortener/submit_failed.html')
         self.assertFormError(response, 'link_form', 'custom', too_long_error)
 
+    def test_submit_custom_beyond_32_bits(self):
+        """
+        custom shortened urls decoding to ids that do not fit in 32 bits are
+        stored and followed like any other
+        """
+        custom = 'zzzzzzzzzz'
+        self.assertTrue(base62.to_decimal(custom) > 2 ** 31)
+        self.assertEqual(Link._meta.pk.db_type(connection), 'bigint')
+        self.assertEqual(
+            ClickEvent._meta.get_field('link').db_type(connection), 'bigint')
+        response = self.client.post(reverse('submit'), {
+            'url': u'http://www.python.org/', 'custom': custom})
+        self.assertTemplateUsed(response, 'shortener/submit_success.html')
+        response = self.client.get(reverse('follow', kwargs={
+            'base62_id': custom}))
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], 'http://www.python.org/')
+
     def test_follow(self):
         """
         the follow view on a valid url
@@ -155,6 +320,8 @@ class ViewTestCase(TestCase):
         self.assertRedirects(response, url, 301)
 
         # re-fetch link so that we can make sure that usage_count incremented
+        # once the buffered clicks are written
+        click_buffer.flush()
         link = Link.objects.get(id=link.id)
         self.assertEqual(link.usage_count, 1)
 
@@ -178,6 +345,17 @@ class ViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'shortener/link_info.html')
 
+    def test_follow_invalid_code_404(self):
+        """
+        follow on a code that cannot be decoded should return 404
+        """
+        response = self.client.get(reverse('follow', kwargs={
+            'base62_id': 'not_valid'}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('follow', kwargs={
+            'base62_id': 'MyLinkCustomLinkThatIsTooLongOoooooooohYea'}))
+        self.assertEqual(response.status_code, 404)
+
     def test_info_404(self):
         """
         info on an unknown url should return 404
@@ -188,6 +366,92 @@ class ViewTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+
+class HttpCachingTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        click_buffer.clear()
+        self.link = Link.objects.create(url='http://www.python.org/')
+        self.info_url = reverse('info', kwargs={
+            'base62_id': self.link.to_base62()})
+
+    def test_info_not_modified(self):
+        """
+        the info page is not rendered again while it is unchanged
+        """
+        response = self.client.get(self.info_url)
+        etag = response['ETag']
+        self.assertIn('max-age=0', response['Cache-Control'])
+        response = self.client.get(self.info_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertTemplateNotUsed(response, 'shortener/link_info.html')
+        click_buffer.record(self.link.id)
+        response = self.client.get(self.info_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        click_buffer.flush()
+        roll_up_clicks()
+        response = self.client.get(self.info_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SHORTENER_INDEX_MAX_AGE=10)
+    def test_index_max_age(self):
+        """
+        the index page is cached publicly once the client has its CSRF
+        cookie
+        """
+        response = self.client.get(reverse('index'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('max-age=10', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        response = self.client.get(reverse('index'))
+        self.assertIn('public', response['Cache-Control'])
+
+    @override_settings(SHORTENER_REDIRECT_MAX_AGE=3600,
+                       SHORTENER_COUNT_REDIRECTS=False)
+    def test_cacheable_redirects(self):
+        """
+        redirects can be cached by CDNs, leaving the clicks to be counted
+        from their logs
+        """
+        response = self.client.get('/' + self.link.to_base62())
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(click_buffer.pending(self.link.id), 0)
+
+    def test_ingest_clicks(self):
+        """
+        redirects to existing links are counted from access logs
+        """
+        code = self.link.to_base62()
+        lines = [
+            '1.2.3.4 - - [18/Oct/2026:10:00:00 +0200] "GET /%s HTTP/1.1" '
+            '301 0 "-" "curl"' % code,
+            '1.2.3.4 - - [18/Oct/2026:11:00:00 +0200] "GET /%s HTTP/1.1" '
+            '301 0 "-" "curl"' % code,
+            '1.2.3.4 - - [18/Oct/2026:11:00:00 +0200] "GET /%s HTTP/1.1" '
+            '404 0 "-" "curl"' % code,
+            '1.2.3.4 - - [18/Oct/2026:11:00:00 +0200] "GET /ZZZZZZZ HTTP/1.1" '
+            '301 0 "-" "curl"',
+        ]
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as f:
+            f.write('\n'.join(lines))
+        output = StringIO()
+        try:
+            call_command('ingest_clicks', path, stdout=output)
+        finally:
+            os.unlink(path)
+        self.assertIn('counted 2 clicks, skipped 2 lines', output.getvalue())
+        self.assertEqual(Link.objects.get(id=self.link.id).usage_count, 2)
+        self.assertEqual(sorted(ClickEvent.objects.using(
+            link_db(self.link.id)).values_list('clicked_at', flat=True)), [
+            datetime.datetime(2026, 10, 18, 8, tzinfo=timezone.utc),
+            datetime.datetime(2026, 10, 18, 9, tzinfo=timezone.utc)])
+
 class LinkTestCase(TestCase):
     def test_create(self):
         """
@@ -213,40 +477,2326 @@ class LinkTestCase(TestCase):
         self.assertTrue(url in unicode(link))
 
 
-class BaseconvTestCase(TestCase):
-    def test_symmetry_positive_int(self):
+class LinkCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        link_cache.clear()
+        link_cache.reset_stats()
+        click_buffer.clear()
+
+    def test_lru_evicts_least_recently_used(self):
         """
-        symmetry for encoding/decoding values
+        the local tier never holds more than max_size entries
         """
-        for x in xrange(1000):
-            random_int = random.randint(0, sys.maxint)
-            encoded_int = base62.from_decimal(random_int)
-            self.assertEqual(random_int, base62.to_decimal(encoded_int))
+        lru = LRUCache(max_size=2, timeout=60)
+        lru.set(1, 'a')
+        lru.set(2, 'b')
+        lru.get(1)
+        lru.set(3, 'c')
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get(1), 'a')
+        self.assertEqual(lru.get(2), None)
 
-    def test_symmetry_negative_int(self):
+    def test_shared_timeout_needs_shared_cache(self):
         """
-        symmetry for negative numbers
+        without a shared cache, links are not kept past the local timeout
         """
-        for x in xrange(1000):
-            random_int = random.randint(-1 * sys.maxint - 1, 0)
-            encoded_int = base62.from_decimal(random_int)
-            self.assertEqual(random_int, base62.to_decimal(encoded_int))
+        self.assertEqual(LinkCache(local_timeout=60, timeout=3600).timeout,
+                         60)
+        with override_settings(CACHES=MEMCACHED):
+            self.assertEqual(
+                LinkCache(local_timeout=60, timeout=3600).timeout, 3600)
 
-    def test_encoding_non_int_fails(self):
+    def test_lru_expires_entries(self):
         """
-        calling from_decimal() on letters raises an EncodingError
+        local entries are dropped once their timeout has passed
         """
-        self.assertRaises(EncodingError, base62.from_decimal, string.letters)
+        lru = LRUCache(max_size=2, timeout=-1)
+        lru.set(1, 'a')
+        self.assertEqual(lru.get(1), None)
 
-    def test_decoding_non_str_fails(self):
+    def test_resolve_is_cached(self):
         """
-        decoding a non-str should fail with DecodingError
+        resolving a link twice only queries the database once
         """
-        self.assertRaises(DecodingError, base62.to_decimal, sys.maxint)
+        link = Link.objects.create(url='http://www.python.org/')
+        link_cache.clear()
+        cache.clear()
+        with self.assertNumQueries(1, using=link_db(link.id)):
+            self.assertEqual(Link.objects.resolve(link.id), link.url)
+            self.assertEqual(Link.objects.resolve(link.id), link.url)
+        self.assertEqual(link_cache.stats()['misses'], 1)
+        self.assertEqual(link_cache.stats()['local_hits'], 1)
 
-    def test_illgal_character(self):
+    def test_shared_tier(self):
         """
-        trying to encode a character that is not within base62 raises an
-        EncodingError
+        a miss in the local tier is served from Django's cache
         """
-        self.assertRaises(DecodingError, base62.to_decimal, '@@@@')
+        link = Link.objects.create(url='http://www.python.org/')
+        link_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(Link.objects.resolve(link.id), link.url)
+        self.assertEqual(link_cache.stats()['shared_hits'], 1)
+
+    def test_follow_uses_cache(self):
+        """
+        following a link resolves it through the cache
+        """
+        url = 'http://www.python.org/'
+        link = Link.objects.create(url=url)
+        response = self.client.get(reverse('follow', kwargs={
+            'base62_id': link.to_base62()}))
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], url)
+        self.assertEqual(link_cache.stats()['local_hits'], 1)
+        self.assertEqual(link_cache.stats()['misses'], 0)
+
+    def test_save_refreshes_cache(self):
+        """
+        changing a link's url is picked up by the cache
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        Link.objects.resolve(link.id)
+        link.url = 'http://www.djangoproject.com/'
+        link.save()
+        self.assertEqual(Link.objects.resolve(link.id), link.url)
+
+    def test_delete_invalidates_cache(self):
+        """
+        a deleted link can no longer be resolved
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        link_id = link.id
+        Link.objects.resolve(link_id)
+        link.delete()
+        self.assertEqual(Link.objects.resolve(link_id), None)
+
+
+class ClickBufferTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        self.buffer = ClickBuffer(
+            flush_threshold=10, flush_interval=60, analytics=False)
+        click_buffer.clear()
+
+    def tearDown(self):
+        click_buffer.clear()
+
+    def test_record_is_buffered(self):
+        """
+        clicks are not written until the buffer is flushed
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        with self.assertNumQueries(0):
+            self.buffer.record(link.id)
+            self.buffer.record(link.id)
+        self.assertEqual(self.buffer.pending(link.id), 2)
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.pending(link.id), 0)
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 2)
+
+    def test_flush_groups_updates(self):
+        """
+        links with the same number of pending clicks share one UPDATE
+        """
+        # on one shard, so that all the queries go to one database
+        ids = [i for i in xrange(1000, 1100)
+               if link_db(i) == DEFAULT_DB_ALIAS][:3]
+        links = [Link.objects.create(id=i, url='http://www.python.org/')
+                 for i in ids]
+        for link in links[:2]:
+            self.buffer.record(link.id)
+        self.buffer.record(links[2].id, 3)
+        with self.assertNumQueries(2):
+            self.buffer.flush()
+        self.assertEqual(
+            [Link.objects.get(id=link.id).usage_count for link in links],
+            [1, 1, 3])
+
+    def test_flush_threshold(self):
+        """
+        the buffer flushes itself once enough clicks are pending
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        for x in xrange(10):
+            self.buffer.record(link.id)
+        self.assertEqual(self.buffer.pending(link.id), 0)
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 10)
+
+    def test_flush_interval(self):
+        """
+        the buffer flushes itself once flush_interval has passed
+        """
+        buffer = ClickBuffer(flush_threshold=10, flush_interval=0)
+        link = Link.objects.create(url='http://www.python.org/')
+        buffer.record(link.id)
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 1)
+
+    def test_info_shows_live_count(self):
+        """
+        the info page includes clicks that have not been flushed yet
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        click_buffer.record(link.id)
+        response = self.client.get(reverse('info', kwargs={
+            'base62_id': link.to_base62()}))
+        self.assertEqual(response.context['link'].usage_count, 1)
+
+    def test_failed_flush(self):
+        """
+        a flush that cannot write the counts does not fail the click that
+        made it due, and puts the clicks back with their events and
+        visitors; it is retried after flush_interval
+        """
+        buffer = FailingClickBuffer(flush_threshold=2, flush_interval=60)
+        link = Link.objects.create(url='http://www.python.org/')
+        buffer.record(link.id, visitor='a')
+        buffer.record(link.id, visitor='b')
+        self.assertEqual(buffer.attempts, 1)
+        self.assertEqual(buffer.pending(link.id), 2)
+        self.assertEqual(ClickEvent.objects.using(
+            link_db(link.id)).filter(link=link.id).count(), 0)
+
+        # not retried on every click
+        buffer.record(link.id, visitor='c')
+        self.assertEqual(buffer.attempts, 1)
+
+        buffer.fail = False
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 3)
+        self.assertEqual(ClickEvent.objects.using(
+            link_db(link.id)).filter(link=link.id).count(), 3)
+        self.assertEqual(unique_visitors(link), 3)
+
+    def test_background_flush(self):
+        """
+        with background flushing, recording clicks never queries the
+        database; a separate thread flushes once enough are pending
+        """
+        buffer = RecordingClickBuffer(flush_threshold=2, flush_interval=60,
+                                      background=True)
+        try:
+            with self.assertNumQueries(0):
+                buffer.record(1)
+                buffer.record(1)
+            self.assertTrue(buffer.flushed.wait(5))
+            self.assertNotEqual(buffer.flush_threads[0],
+                                threading.current_thread())
+        finally:
+            buffer.stop_flusher()
+
+    def test_background_flush_interval(self):
+        """
+        the background thread also flushes every flush_interval seconds
+        """
+        buffer = RecordingClickBuffer(flush_threshold=10, flush_interval=0.01,
+                                      background=True)
+        try:
+            buffer.record(1)
+            self.assertTrue(buffer.flushed.wait(5))
+        finally:
+            buffer.stop_flusher()
+
+
+class ForeignKeyTestCase(TransactionTestCase):
+    """
+    Tests run with foreign keys enforced, which on SQLite can only be turned
+    on outside a transaction
+    """
+    multi_db = True
+
+    def setUp(self):
+        enforce_foreign_keys(self)
+
+    def test_clicks_on_missing_links(self):
+        """
+        clicks on links deleted or archived since do not keep the events
+        and visitors of the other links from being written
+        """
+        buffer = ClickBuffer(flush_threshold=10, flush_interval=60)
+        link = Link.objects.create(url='http://www.python.org/')
+        missing_id = link.id + 1
+        while link_db(missing_id) != link_db(link.id):
+            missing_id += 1
+        buffer.record(missing_id, visitor='a')
+        buffer.record(link.id, visitor='a')
+        buffer.record(link.id, visitor='b')
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(ClickEvent.objects.using(
+            link_db(link.id)).filter(link=link.id).count(), 2)
+        self.assertEqual(DailyVisitors.objects.using(
+            link_db(link.id)).filter(link=link.id).count(), 1)
+        self.assertEqual(unique_visitors(link), 2)
+
+class FailingClickBuffer(ClickBuffer):
+    """
+    Fails to write the counts while ``fail`` is set
+    """
+    fail = True
+    attempts = 0
+
+    def update_counts(self, db, pending):
+        self.attempts += 1
+        if self.fail:
+            raise DatabaseError('the database is down')
+        return super(FailingClickBuffer, self).update_counts(db, pending)
+
+
+class RecordingClickBuffer(ClickBuffer):
+    """
+    Discards its clicks when flushed, recording the thread that flushed;
+    the test database cannot be reached from other threads.
+    """
+    def __init__(self, *args, **kwargs):
+        super(RecordingClickBuffer, self).__init__(*args, **kwargs)
+        self.flushed = threading.Event()
+        self.flush_threads = []
+
+    def flush(self):
+        if not self.pending_total():
+            return 0
+        self.flush_threads.append(threading.current_thread())
+        self.clear()
+        self.flushed.set()
+        return 1
+
+
+class RedirectFastPathTestCase(TestCase):
+    def setUp(self):
+        self.application = RedirectFastPath(WSGIHandler())
+        click_buffer.clear()
+
+    def tearDown(self):
+        click_buffer.clear()
+
+    def request(self, path, method='GET'):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'SCRIPT_NAME': '',
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': CUSTOM_HTTP_HOST,
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': StringIO(),
+            'wsgi.errors': StringIO(),
+        }
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        body = ''.join(self.application(environ, start_response))
+        return response['status'], response['headers'], body
+
+    def test_redirect(self):
+        """
+        a known code is redirected and counted by the fast path
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        with self.assertNumQueries(0):
+            status, headers, body = self.request('/' + link.to_base62())
+        self.assertEqual(status, '301 MOVED PERMANENTLY')
+        self.assertEqual(headers['Location'], link.url)
+        self.assertEqual(click_buffer.pending(link.id), 1)
+
+    def test_previous_pin_is_dropped(self):
+        """
+        a pin to the primary left by the thread's previous request does not
+        carry over to the next client
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        pin_to_primary(time.time() + 60)
+        try:
+            self.request('/' + link.to_base62())
+            self.assertFalse(is_pinned())
+        finally:
+            unpin()
+
+    def test_fall_through(self):
+        """
+        anything the fast path cannot answer is handled by Django
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        status, headers, body = self.request('/fails')
+        self.assertTrue(status.startswith('404'))
+        status, headers, body = self.request('/')
+        self.assertTrue(status.startswith('200'))
+        status, headers, body = self.request(
+            '/' + link.to_base62(), method='POST')
+        self.assertFalse(status.startswith('301'))
+        self.assertEqual(click_buffer.pending(link.id), 0)
+
+
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+
+    def test_parse_rate(self):
+        """
+        rates are a number of requests per second, minute, hour or day
+        """
+        self.assertEqual(parse_rate('5/s'), (5, 1))
+        self.assertEqual(parse_rate('100/hour'), (100, 3600))
+        self.assertRaises(ValueError, parse_rate, '5 per minute')
+
+    def test_bucket(self):
+        """
+        each key may make ``limit`` requests at once, then waits for the
+        bucket to refill
+        """
+        throttle = Throttle('test', 3, 60)
+        self.assertEqual([throttle.allow('a') for i in xrange(3)], [0, 0, 0])
+        self.assertAlmostEqual(throttle.allow('a'), 20, delta=1)
+        self.assertEqual(throttle.allow('b'), 0)
+
+    def test_shared_bucket(self):
+        """
+        shared buckets hold across processes
+        """
+        processes = [Throttle('test', 2, 60, shared=True) for i in xrange(2)]
+        self.assertEqual(processes[0].allow('a'), 0)
+        self.assertEqual(processes[1].allow('a'), 0)
+        self.assertTrue(processes[0].allow('a') > 0)
+        self.assertTrue(processes[1].allow('a') > 0)
+        self.assertEqual(processes[1].allow('b'), 0)
+
+    @override_settings(SHORTENER_THROTTLE_RATES={'submit': '2/m'})
+    def test_submit_is_throttled(self):
+        """
+        submissions beyond the rate are refused before any query
+        """
+        for i in xrange(2):
+            response = self.client.post(reverse('submit'), {
+                'url': 'http://www.python.org/%d' % i})
+            self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('submit'), {
+                'url': 'http://www.python.org/'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(count_links(), 2)
+        response = self.client.post(reverse('submit'), {
+            'url': 'http://www.python.org/'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SHORTENER_THROTTLE_RATES={'api_resolve': '1/m'},
+                       SHORTENER_THROTTLE_API_KEY_HEADER='X-Api-Key')
+    def test_api_key(self):
+        """
+        requests sending an API key are also limited per key
+        """
+        def resolve(address):
+            return self.client.post(
+                reverse('api_resolve'), json.dumps({'codes': []}),
+                content_type='application/json', REMOTE_ADDR=address,
+                HTTP_X_API_KEY='secret').status_code
+        self.assertEqual(resolve('10.0.0.1'), 200)
+        self.assertEqual(resolve('10.0.0.2'), 429)
+
+    @override_settings(SHORTENER_THROTTLE_RATES={'api_shorten': '5/m'})
+    def test_api_shorten_is_throttled_per_link(self):
+        """
+        each link shortened through the API takes a token
+        """
+        def shorten(count):
+            return self.client.post(
+                reverse('api_shorten'), json.dumps({'links': [
+                    {'url': 'http://www.python.org/%d' % i}
+                    for i in xrange(count)]}),
+                content_type='application/json').status_code
+        self.assertEqual(shorten(6), 400)
+        self.assertEqual(shorten(3), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(shorten(3), 429)
+        self.assertEqual(count_links(), 3)
+        self.assertEqual(shorten(2), 200)
+
+    @override_settings(SHORTENER_THROTTLE_RATES={'follow': '1/m'})
+    def test_fast_path_is_throttled(self):
+        """
+        the WSGI fast path applies the follow view's rate
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        application = RedirectFastPath(WSGIHandler())
+        environ = {'REQUEST_METHOD': 'GET', 'REMOTE_ADDR': '10.0.0.3',
+                   'PATH_INFO': '/' + link.to_base62()}
+        statuses = []
+        for i in xrange(2):
+            application(dict(environ),
+                        lambda status, headers: statuses.append(status))
+        self.assertEqual(statuses[0], '301 MOVED PERMANENTLY')
+        self.assertEqual(statuses[1], '429 TOO MANY REQUESTS')
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        click_buffer.clear()
+
+    def test_render(self):
+        """
+        metrics are rendered in the Prometheus text format
+        """
+        registry = Registry()
+        counter = registry.register(Counter('c', 'A counter', ('view',)))
+        histogram = registry.register(Histogram('h', 'A histogram', (1, 2)))
+        registry.register(Gauge('g', 'A gauge', lambda: 3))
+        counter.inc(view='follow')
+        counter.inc(2, view='follow')
+        histogram.observe(1)
+        histogram.observe(1.5)
+        histogram.observe(5)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP c A counter',
+            '# TYPE c counter',
+            'c{view="follow"} 3.0',
+            '# HELP h A histogram',
+            '# TYPE h histogram',
+            'h_bucket{le="1.0"} 1.0',
+            'h_bucket{le="2.0"} 2.0',
+            'h_bucket{le="+Inf"} 3.0',
+            'h_sum 7.5',
+            'h_count 3.0',
+            '# HELP g A gauge',
+            '# TYPE g gauge',
+            'g 3.0',
+        ]) + '\n')
+
+    def test_metrics_view(self):
+        """
+        requests are recorded per view and exposed by the metrics view
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        self.client.get(reverse('info', kwargs={
+            'base62_id': link.to_base62()}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('shortener_responses_total{view="info",status="200"}',
+                      response.content)
+        self.assertIn('shortener_request_db_queries_count{view="info"}',
+                      response.content)
+        self.assertIn('shortener_link_cache_hit_ratio', response.content)
+        self.assertIn('shortener_click_flush_lag_seconds', response.content)
+
+    def test_query_timer(self):
+        """
+        queries on every database are counted without Django's debug cursor
+        logging them
+        """
+        databases = [connections[db or DEFAULT_DB_ALIAS]
+                     for db in databases_for(Link)]
+        logged = [len(db.queries) for db in databases]
+        timer = QueryTimer()
+        timer.start()
+        try:
+            for db in databases_for(Link):
+                Link.objects.using(db).count()
+        finally:
+            timer.stop()
+        self.assertEqual(timer.count, len(databases))
+        self.assertEqual([len(db.queries) for db in databases], logged)
+        for db in databases:
+            self.assertFalse(db.use_debug_cursor)
+            self.assertNotIn('make_debug_cursor', db.__dict__)
+
+    @override_settings(SHORTENER_METRICS_ALLOWED_IPS=('10.0.0.1',))
+    def test_metrics_allowed_ips(self):
+        """
+        the metrics view can be restricted to some addresses
+        """
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_profile_slow_requests(self):
+        """
+        sampled requests that are slow enough are profiled
+        """
+        profile_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(SHORTENER_PROFILE_SAMPLE_RATE=1,
+                               SHORTENER_PROFILE_MIN_DURATION=0,
+                               SHORTENER_PROFILE_DIR=profile_dir):
+                client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+                client.get(reverse('index'))
+                self.assertEqual(os.listdir(profile_dir), [])
+                client.post(reverse('submit'), {
+                    'url': 'http://www.python.org/'})
+            profiles = os.listdir(profile_dir)
+            self.assertEqual(len(profiles), 1)
+            self.assertTrue(profiles[0].startswith('submit-'))
+        finally:
+            shutil.rmtree(profile_dir)
+
+
+class AnalyticsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        self.buffer = ClickBuffer(flush_threshold=100, flush_interval=60)
+        click_buffer.clear()
+
+    def test_flush_records_events(self):
+        """
+        flushing the click buffer inserts one event per click
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        self.buffer.record(link.id)
+        self.buffer.record(link.id, 2)
+        self.assertEqual(ClickEvent.objects.count(), 0)
+        self.buffer.flush()
+        self.assertEqual(ClickEvent.objects.filter(link=link).count(), 3)
+
+    def test_analytics_can_be_disabled(self):
+        """
+        no events are recorded when analytics is off
+        """
+        buffer = ClickBuffer(analytics=False)
+        link = Link.objects.create(url='http://www.python.org/')
+        buffer.record(link.id)
+        buffer.flush()
+        self.assertEqual(ClickEvent.objects.count(), 0)
+
+    def test_roll_up(self):
+        """
+        events are aggregated into hourly and daily buckets and deleted
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        other = Link.objects.create(url='http://www.djangoproject.com/')
+        now = timezone.now()
+        hour = truncate_to_hour(now)
+        earlier = hour - datetime.timedelta(hours=1)
+        for link_id, clicked_at in [(link.id, now), (link.id, hour),
+                                    (link.id, earlier), (other.id, now)]:
+            ClickEvent.objects.create(link_id=link_id, clicked_at=clicked_at)
+        self.assertEqual(roll_up_clicks(batch_size=3), 4)
+        self.assertEqual(ClickEvent.objects.count(), 0)
+        self.assertEqual(HourlyClicks.objects.get(link=link, hour=hour).count, 2)
+        self.assertEqual(
+            HourlyClicks.objects.get(link=link, hour=earlier).count, 1)
+        self.assertEqual(
+            sum(DailyClicks.objects.filter(link=link).values_list(
+                'count', flat=True)), 3)
+
+        # rolling up more events adds to the existing buckets
+        ClickEvent.objects.create(link_id=link.id, clicked_at=now)
+        call_command('rollup_clicks', stdout=StringIO())
+        self.assertEqual(HourlyClicks.objects.get(link=link, hour=hour).count, 3)
+
+    def test_roll_up_keeps_events_committed_meanwhile(self):
+        """
+        an event with a lower id committed while a batch is being rolled up
+        is not deleted with the batch
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        now = timezone.now()
+        for event_id in (10, 20):
+            ClickEvent.objects.create(id=event_id, link_id=link.id,
+                                      clicked_at=now)
+
+        def add_to_buckets(*args, **kwargs):
+            if not ClickEvent.objects.filter(id=15).exists():
+                ClickEvent.objects.create(id=15, link_id=link.id,
+                                          clicked_at=now)
+            return original(*args, **kwargs)
+        original = analytics.add_to_buckets
+        analytics.add_to_buckets = add_to_buckets
+        self.addCleanup(setattr, analytics, 'add_to_buckets', original)
+
+        roll_up_clicks(batch_size=2)
+        self.assertFalse(ClickEvent.objects.exists())
+        self.assertEqual(sum(DailyClicks.objects.filter(
+            link=link).values_list('count', flat=True)), 3)
+
+    def test_info_shows_rollups(self):
+        """
+        the info page shows hourly and daily clicks from the rollups
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        ClickEvent.objects.create(link_id=link.id, clicked_at=timezone.now())
+        roll_up_clicks()
+        response = self.client.get(reverse('info', kwargs={
+            'base62_id': link.to_base62()}))
+        hourly = response.context['hourly_clicks']
+        daily = response.context['daily_clicks']
+        self.assertEqual(len(hourly), 24)
+        self.assertEqual(hourly[-1][1], 1)
+        self.assertEqual(len(daily), 30)
+        self.assertEqual(daily[-1][1], 1)
+
+
+class UniqueVisitorsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        click_buffer.clear()
+        self.link = Link.objects.create(url='http://www.python.org/')
+
+    def test_sketch(self):
+        """
+        sketches estimate the number of distinct values and can be merged
+        and stored
+        """
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in xrange(10000):
+            first.add(str(i))
+            second.add(str(i + 5000))
+        self.assertAlmostEqual(first.count(), 10000, delta=500)
+        first.merge(second)
+        self.assertAlmostEqual(first.count(), 15000, delta=750)
+        self.assertEqual(HyperLogLog.decode(first.encode()).registers,
+                         first.registers)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(precision=8))
+
+    def test_follow_counts_visitors(self):
+        """
+        redirects add their client to the link's sketch, which is merged
+        into the stored one by each process's flush
+        """
+        path = '/' + self.link.to_base62()
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.1'):
+            self.client.get(path, REMOTE_ADDR=address)
+        click_buffer.flush()
+        other_process = ClickBuffer()
+        other_process.record(self.link.id, visitor='10.0.0.3|')
+        other_process.record(self.link.id, visitor='10.0.0.1|')
+        other_process.flush()
+        self.assertEqual(DailyVisitors.objects.using(
+            link_db(self.link.id)).filter(link=self.link.id).count(), 1)
+        link = Link.objects.get(id=self.link.id)
+        self.assertEqual(unique_visitors(link), 3)
+        response = self.client.get(reverse('info', kwargs={
+            'base62_id': link.to_base62()}))
+        self.assertContains(response, 'Unique visitors in the last 30 days: about 3')
+
+    def test_sketches_are_kept_per_day(self):
+        """
+        visitors are counted over the days in the window
+        """
+        old = timezone.now() - datetime.timedelta(days=40)
+        click_buffer.record(self.link.id, clicked_at=old, visitor='a')
+        click_buffer.record(self.link.id, visitor='b')
+        click_buffer.record(self.link.id, visitor='c')
+        click_buffer.flush()
+        link = Link.objects.get(id=self.link.id)
+        self.assertEqual(unique_visitors(link), 2)
+        self.assertEqual(unique_visitors(link, days=60), 3)
+
+
+class WarmupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        link_cache.clear()
+        self.links = [
+            Link.objects.create(url='http://www.python.org/%d' % i,
+                                usage_count=i)
+            for i in xrange(3)]
+        cache.clear()
+        link_cache.clear()
+
+    def test_preloads_most_followed_links(self):
+        """
+        the most followed links are in the redirect cache after warming up
+        """
+        timings = warm_up(link_count=2)
+        self.assertEqual([name for name, seconds, items in timings],
+                         ['views', 'templates', 'databases', 'links',
+                          'leaderboards'])
+        self.assertEqual(dict((name, items)
+                              for name, seconds, items in timings)['links'], 2)
+        with self.assertNumQueries(0):
+            for link in self.links[1:]:
+                self.assertEqual(Link.objects.resolve(link.id), link.url)
+        self.assertEqual(link_cache.get(self.links[0].id), None)
+        self.assertTrue(popular_links.is_cached())
+
+    def test_views_and_templates(self):
+        """
+        every view imports and every listed template compiles
+        """
+        self.assertTrue(import_views() > 0)
+        self.assertTrue(compile_templates() > 0)
+
+    def test_command(self):
+        """
+        warmup reports the time taken by each step
+        """
+        output = StringIO()
+        call_command('warmup', links=10, stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines],
+                         ['views', 'templates', 'databases', 'links',
+                          'leaderboards', 'total'])
+        self.assertIn('    3 items', lines[3])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the link checker's requests like the targets of links would
+    """
+    protocol_version = 'HTTP/1.1'
+    # status, location, whether HEAD is refused
+    pages = {
+        '/ok': (200, None, False),
+        '/moved': (301, '/ok', False),
+        '/gone': (404, None, False),
+        '/no-head': (200, None, True),
+        '/loop': (302, '/loop', False),
+        '/internal': (302, 'http://localhost:%(port)d/ok', False),
+    }
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_HEAD(self):
+        self.answer(head=True)
+
+    def do_GET(self):
+        self.answer(head=False)
+
+    def answer(self, head):
+        self.server.requests.append((self.command, self.path, time.time()))
+        status, location, head_refused = self.pages.get(
+            self.path, (404, None, False))
+        if head and head_refused:
+            status = 405
+        self.send_response(status)
+        if location is not None:
+            self.send_header(
+                'Location', location % {'port': self.server.server_port})
+        self.send_header('Content-Length', '0' if head else '2')
+        self.end_headers()
+        if not head:
+            self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LoopbackOnlyChecker(LinkChecker):
+    """
+    Treats the stand-in server's address as public, but not when it is
+    reached as localhost
+    """
+    def address_allowed(self, host, address):
+        return host == '127.0.0.1'
+
+
+class LinkCheckTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        link_cache.clear()
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.checker = LinkChecker(workers=4, per_host=2, host_delay=0,
+                                   timeout=5, allow_private=True)
+
+    def tearDown(self):
+        self.checker.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_check(self):
+        """
+        targets get their final status and where they redirect to
+        """
+        url = self.base_url
+        self.assertEqual(self.checker.check(url + '/ok'), (200, '', ''))
+        self.assertEqual(self.checker.check(url + '/moved'),
+                         (200, url + '/ok', ''))
+        self.assertEqual(self.checker.check(url + '/gone'), (404, '', ''))
+        self.assertEqual(self.checker.check(url + '/no-head'), (200, '', ''))
+        self.assertEqual(self.checker.check(url + '/loop'),
+                         (302, url + '/loop', 'too many redirects'))
+        self.assertEqual(self.checker.check('ftp://127.0.0.1/'),
+                         (None, '', 'unsupported scheme'))
+
+    def test_unreachable(self):
+        """
+        hosts that cannot be connected to have no status
+        """
+        # a port nothing listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        status, final_url, error = self.checker.check(
+            'http://127.0.0.1:%d/ok' % port)
+        self.assertEqual((status, final_url), (None, ''))
+        self.assertTrue(error)
+
+    def test_connections_are_reused(self):
+        """
+        requests to a host share its connections, no more than per_host of
+        them at a time
+        """
+        results = self.checker.check_many([self.base_url + '/ok'] * 20)
+        self.assertEqual(results, [(200, '', '')] * 20)
+        self.assertTrue(self.server.connections <= 2)
+
+    def test_host_pools_are_bounded(self):
+        """
+        the connections of the least recently requested hosts beyond
+        max_hosts are closed
+        """
+        checker = LinkChecker(host_delay=0, allow_private=True, max_hosts=1)
+        other_url = 'http://localhost:%d' % self.server.server_port
+        try:
+            for url in (self.base_url, other_url, self.base_url):
+                self.assertEqual(checker.check(url + '/ok'), (200, '', ''))
+        finally:
+            checker.close()
+        self.assertEqual(self.server.connections, 3)
+
+    def test_private_addresses_are_refused(self):
+        """
+        targets on loopback, private, link-local and reserved addresses are
+        not requested
+        """
+        checker = LinkChecker(host_delay=0)
+        try:
+            self.assertEqual(checker.check(self.base_url + '/ok'),
+                             (None, '', 'refused address'))
+            self.assertEqual(
+                checker.check('http://169.254.169.254/latest/meta-data/'),
+                (None, '', 'refused address'))
+        finally:
+            checker.close()
+        self.assertEqual(self.server.requests, [])
+
+    def test_redirects_to_refused_addresses(self):
+        """
+        a redirect to a refused address is not followed, and where it leads
+        is not reported
+        """
+        checker = LoopbackOnlyChecker(host_delay=0)
+        try:
+            self.assertEqual(checker.check(self.base_url + '/internal'),
+                             (302, '', 'redirects to a refused address'))
+        finally:
+            checker.close()
+        self.assertEqual([path for method, path, at in self.server.requests],
+                         ['/internal'])
+
+    def test_public_addresses(self):
+        """
+        only addresses outside the refused networks are public
+        """
+        for address in ('127.0.0.1', '10.1.2.3', '172.31.255.255',
+                        '192.168.0.1', '169.254.169.254', '100.64.0.1',
+                        '0.0.0.0', '255.255.255.255', '::', '::1',
+                        '::ffff:127.0.0.1', 'fe80::1%eth0', 'fd00::1'):
+            self.assertFalse(is_public_address(address), address)
+        for address in ('8.8.8.8', '172.32.0.1', '151.101.1.69',
+                        '2606:4700:4700::1111'):
+            self.assertTrue(is_public_address(address), address)
+
+    def test_host_delay(self):
+        """
+        requests to a host are spaced by host_delay
+        """
+        checker = LinkChecker(workers=4, per_host=4, host_delay=0.05,
+                              allow_private=True)
+        try:
+            checker.check_many([self.base_url + '/ok'] * 4)
+        finally:
+            checker.close()
+        times = sorted(at for method, path, at in self.server.requests)
+        self.assertTrue(times[-1] - times[0] >= 0.14)
+
+    def create_links(self, paths):
+        return [Link.objects.create(url=self.base_url + path)
+                for path in paths]
+
+    def get_check(self, link):
+        return LinkCheck.objects.using(link_db(link.id)).get(link=link.id)
+
+    def test_check_links(self):
+        """
+        results are saved for every link and shown on its info page
+        """
+        ok, moved, gone = self.create_links(['/ok', '/moved', '/gone'])
+        self.assertEqual(check_links(self.checker, batch_size=2), 3)
+        self.assertEqual(self.get_check(ok).status, 200)
+        self.assertEqual(self.get_check(moved).final_url,
+                         self.base_url + '/ok')
+        self.assertEqual(self.get_check(gone).status, 404)
+
+        client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        response = client.get(reverse('info', kwargs={
+            'base62_id': moved.to_base62()}))
+        self.assertContains(response, 'HTTP 200, redirects to')
+        response = client.get(reverse('info', kwargs={
+            'base62_id': gone.to_base62()}))
+        self.assertContains(response, 'HTTP 404')
+
+        # checking again replaces the results
+        self.assertEqual(check_links(self.checker), 3)
+        self.assertEqual(LinkCheck.objects.using(link_db(ok.id)).filter(
+            link=ok.id).count(), 1)
+
+    def test_checkpoint(self):
+        """
+        a run resumes after the last link saved by an interrupted one
+        """
+        links = self.create_links(['/ok', '/gone', '/moved'])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = os.path.join(directory, 'checkpoint.json')
+        db = link_db(links[1].id)
+        with open(checkpoint, 'w') as f:
+            json.dump({db: links[1].id}, f)
+        checked = check_links(self.checker, checkpoint=checkpoint)
+        self.assertFalse(os.path.exists(checkpoint))
+        checked_ids = set(
+            link_id for db in databases_for(LinkCheck)
+            for link_id in LinkCheck.objects.using(db).values_list(
+                'link', flat=True))
+        # only the links of the checkpoint's database up to its id are skipped
+        expected = set(link.id for link in links
+                       if link_db(link.id) != db or link.id > links[1].id)
+        self.assertEqual(checked_ids, expected)
+        self.assertNotIn(links[1].id, checked_ids)
+        self.assertEqual(checked, len(expected))
+
+    @override_settings(SHORTENER_LINK_CHECK_ALLOW_PRIVATE=True)
+    def test_command(self):
+        """
+        check_links checks every link
+        """
+        self.create_links(['/ok', '/gone'])
+        output = StringIO()
+        call_command('check_links', workers=2, host_delay=0, stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'Checked 2 links')
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        click_buffer.clear()
+
+    def ids(self, leaderboard):
+        return [link.id for link in leaderboard.links()]
+
+    def test_refresh(self):
+        """
+        a missing board is rebuilt from the database
+        """
+        links = [Link.objects.create(url='http://www.python.org/', usage_count=x)
+                 for x in xrange(7)]
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids(popular_links),
+                             [link.id for link in links[:1:-1]])
+        with self.assertNumQueries(0):
+            self.assertEqual(len(popular_links.links()), 5)
+
+    def test_new_links_are_recent(self):
+        """
+        created links are merged into the recent links board
+        """
+        recent_links.refresh()
+        first = Link.objects.create(url='http://www.python.org/')
+        second = Link.objects.create(url='http://www.djangoproject.com/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ids(recent_links), [second.id, first.id])
+
+    def test_flushed_clicks_update_popular(self):
+        """
+        flushing clicks merges the new counts into the popular links board
+        """
+        links = [Link.objects.create(url='http://www.python.org/', usage_count=x)
+                 for x in xrange(6)]
+        popular_links.refresh()
+        self.assertNotIn(links[0].id, self.ids(popular_links))
+        click_buffer.record(links[0].id, 10)
+        click_buffer.flush()
+        self.assertEqual(self.ids(popular_links)[0], links[0].id)
+        self.assertEqual(popular_links.links()[0].usage_count, 10)
+
+    def test_delete_rebuilds(self):
+        """
+        deleting a link on the board removes it
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        popular_links.refresh()
+        link.delete()
+        self.assertEqual(self.ids(popular_links), [])
+
+    def test_index_does_not_query_links(self):
+        """
+        the index page is rendered from the cached boards
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        call_command('refresh_leaderboards', stdout=StringIO())
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [l.id for l in response.context['recent_links']], [link.id])
+        self.assertEqual(
+            [l.id for l in response.context['most_popular_links']], [link.id])
+
+
+class DeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+
+    def submit(self, url, custom=''):
+        response = self.client.post(reverse('submit'), {
+            'url': url, 'custom': custom})
+        self.assertTemplateUsed(response, 'shortener/submit_success.html')
+        return response.context['link']
+
+    def test_normalize_url(self):
+        """
+        equivalent URLs normalize to the same value
+        """
+        self.assertEqual(normalize_url('HTTP://WWW.Python.Org'),
+                         'http://www.python.org/')
+        self.assertEqual(normalize_url('https://python.org:443/a?b#c'),
+                         'https://python.org/a?b#c')
+        self.assertEqual(normalize_url('http://User@Python.org:8000/A'),
+                         'http://User@python.org:8000/A')
+
+    def test_url_hash_is_saved(self):
+        """
+        saving a link stores the hash of its normalized url
+        """
+        link = Link.objects.create(url='http://www.python.org')
+        self.assertEqual(len(link.url_hash), 40)
+        self.assertEqual(link.url_hash, hash_url('http://WWW.python.org/'))
+
+    def test_submit_duplicates_by_default(self):
+        """
+        without SHORTENER_DEDUPLICATE every submit creates a link
+        """
+        first = self.submit('http://www.python.org/')
+        second = self.submit('http://www.python.org/')
+        self.assertNotEqual(first.id, second.id)
+
+    @override_settings(SHORTENER_DEDUPLICATE=True)
+    def test_submit_returns_existing_link(self):
+        """
+        with SHORTENER_DEDUPLICATE an equivalent URL gets the existing link
+        """
+        first = self.submit('http://www.python.org/')
+        second = self.submit('http://WWW.PYTHON.ORG')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(count_links(), 1)
+
+    @override_settings(SHORTENER_DEDUPLICATE=True)
+    def test_submit_with_custom_is_not_deduplicated(self):
+        """
+        a custom name always creates a new link
+        """
+        first = self.submit('http://www.python.org/')
+        second = self.submit('http://www.python.org/', 'python')
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(second.to_base62(), 'python')
+
+    def test_backfill_url_hashes(self):
+        """
+        the backfill command hashes links that have no url_hash
+        """
+        links = [Link.objects.create(url='http://www.python.org/%d' % x)
+                 for x in xrange(5)]
+        Link.objects.update(url_hash='')
+        call_command('backfill_url_hashes', batch_size=2, stdout=StringIO())
+        for link in links:
+            self.assertEqual(Link.objects.get(id=link.id).url_hash,
+                             hash_url(link.url))
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        link_cache.clear()
+        click_buffer.clear()
+        self.long_ago = timezone.now() - datetime.timedelta(days=400)
+        self.old = Link.objects.create(url='http://www.python.org/old',
+                                       usage_count=7)
+        self.followed = Link.objects.create(url='http://www.python.org/')
+        self.new = Link.objects.create(url='http://www.python.org/new')
+        for link in (self.old, self.followed):
+            Link.objects.filter(id=link.id).update(
+                date_submitted=self.long_ago)
+        DailyClicks.objects.create(
+            link_id=self.old.id, day=self.long_ago.date(), count=7)
+        click_buffer.record(self.followed.id)
+        click_buffer.flush()
+
+    def tearDown(self):
+        click_buffer.clear()
+
+    def archive(self):
+        return archive_links(archive_cutoff(), batch_size=1)
+
+    def test_flush_sets_last_followed(self):
+        """
+        flushed clicks mark their links as followed
+        """
+        followed = Link.objects.get(id=self.followed.id)
+        self.assertTrue(timezone.now() - followed.last_followed <
+                        datetime.timedelta(minutes=1))
+        self.assertEqual(Link.objects.get(id=self.old.id).last_followed, None)
+
+    def test_archive_inactive_links(self):
+        """
+        links neither followed nor submitted recently are moved to the
+        archive with their clicks dropped
+        """
+        self.assertEqual(self.archive(), 1)
+        self.assertEqual(self.archive(), 0)
+        self.assertFalse(Link.objects.filter(id=self.old.id).exists())
+        self.assertTrue(Link.objects.filter(id=self.followed.id).exists())
+        self.assertTrue(Link.objects.filter(id=self.new.id).exists())
+        archived = ArchivedLink.objects.get(id=self.old.id)
+        self.assertEqual((archived.url, archived.usage_count),
+                         (self.old.url, 7))
+        self.assertEqual(archived.date_submitted, self.long_ago)
+        daily_clicks = DailyClicks.objects.using(link_db(self.old.id))
+        self.assertFalse(daily_clicks.filter(link_id=self.old.id).exists())
+
+        Link.objects.filter(id=self.followed.id).update(
+            last_followed=self.long_ago)
+        self.assertEqual(self.archive(), 1)
+        self.assertEqual(count_links(), 1)
+
+    def follow(self, link):
+        return self.client.get(reverse('follow', kwargs={
+            'base62_id': link.to_base62()}))
+
+    def test_follow_serves_the_archive(self):
+        """
+        following an archived link once redirects without restoring it
+        """
+        self.archive()
+        response = self.follow(self.old)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], self.old.url)
+        self.assertTrue(ArchivedLink.objects.filter(id=self.old.id).exists())
+        self.assertFalse(Link.objects.filter(id=self.old.id).exists())
+        # there is no row to count the click in
+        self.assertEqual(click_buffer.pending(self.old.id), 0)
+
+    @override_settings(SHORTENER_ARCHIVE_RESTORE_HITS=3)
+    def test_follow_restores(self):
+        """
+        following an archived link often enough redirects and moves it
+        back, with its submission date and count
+        """
+        self.archive()
+        for i in xrange(2):
+            self.assertEqual(self.follow(self.old)['Location'], self.old.url)
+        # clicks on archived links have no row to be counted in
+        click_buffer.flush()
+        self.assertTrue(ArchivedLink.objects.filter(id=self.old.id).exists())
+        response = self.follow(self.old)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], self.old.url)
+        self.assertFalse(ArchivedLink.objects.filter(id=self.old.id).exists())
+        click_buffer.flush()
+        restored = Link.objects.get(id=self.old.id)
+        self.assertEqual(restored.usage_count, 8)
+        self.assertEqual(restored.date_submitted, self.long_ago)
+        self.assertEqual(dict((link.id, link.date_submitted)
+                              for link in recent_links.links())[self.old.id],
+                         self.long_ago)
+        self.assertEqual(self.archive(), 0)
+
+    def test_info_and_api_read_the_archive(self):
+        """
+        info pages and the resolve API show archived links without
+        restoring them
+        """
+        self.archive()
+        code = self.old.to_base62()
+        response = self.client.get(reverse('info', kwargs={'base62_id': code}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.old.url)
+        response = self.client.post(
+            reverse('api_resolve'), json.dumps({'codes': [code]}),
+            content_type='application/json')
+        self.assertEqual(json.loads(response.content)['results'],
+                         [{'code': code, 'url': self.old.url}])
+        self.assertTrue(ArchivedLink.objects.filter(id=self.old.id).exists())
+
+    def test_archived_codes_stay_taken(self):
+        """
+        the id of an archived link is not given to a custom code or a new
+        link
+        """
+        self.archive()
+        self.assertEqual(
+            Link.objects.create_with_id(self.old.id, 'http://www.python.org/'),
+            None)
+        self.assertEqual(
+            create_links([('http://www.python.org/', self.old.id)]), [None])
+        IdSequence.objects.create(name='test', next_value=self.old.id)
+        allocator = IdAllocator(IdSequence, Link, 'test', block_size=10,
+                                archive_model=ArchivedLink)
+        self.assertNotEqual(allocator.allocate(1), [self.old.id])
+
+    def test_custom_codes_checked_by_the_insert(self):
+        """
+        claiming a custom code takes a single query, archive included
+        """
+        self.archive()
+        link_id = base62.to_decimal('freecode')
+        with self.assertNumQueries(1, using=link_db(link_id)):
+            link = Link.objects.create_with_id(link_id, 'http://python.org/')
+        self.assertEqual(Link.objects.get(id=link_id).url, link.url)
+        self.assertEqual(Link.objects.resolve(link_id), link.url)
+
+    def test_link_filter_keeps_archived_ids(self):
+        """
+        a rebuilt link filter still lets archived links through
+        """
+        self.archive()
+        with override_settings(SHORTENER_LINK_FILTER=True):
+            link_filter.reset()
+            try:
+                self.assertTrue(link_filter.might_exist(self.old.id))
+                self.assertEqual(Link.objects.resolve(self.old.id),
+                                 self.old.url)
+            finally:
+                link_filter.reset()
+
+    def test_command(self):
+        """
+        archive_links archives links older than --days and refuses to drop
+        clicks still shown on info pages
+        """
+        output = StringIO()
+        call_command('archive_links', days=300, stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'Archived 1 links')
+        self.assertRaises(CommandError, call_command, 'archive_links', days=7,
+                          stdout=StringIO())
+
+
+@override_settings(SHORTENER_LINK_FILTER=True)
+class LinkFilterTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        link_cache.clear()
+        link_filter.reset()
+        click_buffer.clear()
+        self.link = Link.objects.create(url='http://www.python.org/')
+        link_filter.load()
+
+    def tearDown(self):
+        link_filter.reset()
+
+    def test_unknown_codes_skip_the_database(self):
+        """
+        follow and info answer 404 for codes that were never created without
+        querying the database
+        """
+        missing = base62.from_decimal(self.link.id + 1000)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('follow', kwargs={
+                'base62_id': missing}))
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(reverse('info', kwargs={
+                'base62_id': missing}))
+            self.assertEqual(response.status_code, 404)
+
+    def test_existing_links_resolve(self):
+        """
+        links present when the filter was built and links saved since are
+        found
+        """
+        created = Link.objects.create(url='http://www.djangoproject.com/')
+        link_cache.clear()
+        cache.clear()
+        self.assertEqual(Link.objects.resolve(self.link.id), self.link.url)
+        self.assertEqual(Link.objects.resolve(created.id), created.url)
+
+    def test_bulk_created_links_resolve(self):
+        """
+        links inserted in bulk, which does not send post_save, are added to
+        the filter
+        """
+        link, = create_links([('http://www.djangoproject.com/', 5000)])
+        link_cache.clear()
+        cache.clear()
+        self.assertEqual(Link.objects.resolve(5000), link.url)
+
+    def test_bulk_created_links_are_cached(self):
+        """
+        links inserted in bulk are put in the redirect cache, which other
+        processes consult before their filters
+        """
+        link, = create_links([('http://www.djangoproject.com/', 5000)])
+        link_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(Link.objects.resolve(5000), link.url)
+
+    def test_links_added_elsewhere_resolve(self):
+        """
+        a filter built before another process added a link looks ids it
+        does not have up in the database until it is rebuilt
+        """
+        other = LinkFilter(Link, capacity=1000)
+        other.load()
+        self.assertFalse(other.might_exist(5000))
+        link, = create_links([('http://www.djangoproject.com/', 5000)])
+        self.assertTrue(other.might_exist(5000))
+        other.rebuild()
+        self.assertTrue(other.might_exist(5000))
+
+    def test_unknown_ids_rejected_while_links_are_created(self):
+        """
+        links being created elsewhere do not make the filter look every
+        unknown id up
+        """
+        other = LinkFilter(Link, capacity=1000)
+        other.load()
+        for i in xrange(3):
+            Link.objects.create(url='http://www.djangoproject.com/%d' % i)
+            with self.assertNumQueries(0):
+                self.assertFalse(other.might_exist(6000))
+
+    def test_misses_are_remembered(self):
+        """
+        a deleted link is not looked up again while its miss is remembered
+        """
+        link_id = self.link.id
+        self.link.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(Link.objects.resolve(link_id), None)
+        link_filter.misses.clear()
+        # the links table and the archive
+        with self.assertNumQueries(2, using=link_db(link_id)):
+            self.assertEqual(Link.objects.resolve(link_id), None)
+            self.assertEqual(Link.objects.resolve(link_id), None)
+
+    def test_recreated_link_is_not_a_miss(self):
+        """
+        saving a link forgets an earlier miss for its id
+        """
+        link_filter.record_miss(7000)
+        Link.objects.create(id=7000, url='http://www.djangoproject.com/')
+        link_cache.clear()
+        cache.clear()
+        self.assertEqual(Link.objects.resolve(7000),
+                         'http://www.djangoproject.com/')
+
+    def test_shared_file(self):
+        """
+        processes using the same file see each other's additions and pick up
+        a rebuilt file
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'links.bloom')
+        first = LinkFilter(Link, capacity=1000, path=path)
+        first.load()
+        second = LinkFilter(Link, capacity=1000, path=path)
+        second.load()
+        self.assertIn(self.link.id, second.current())
+        first.add(9000)
+        self.assertIn(9000, second.current())
+
+        Link.objects.create(id=9500, url='http://www.djangoproject.com/')
+        third = LinkFilter(Link, capacity=1000, path=path)
+        third.rebuild()
+        second.file.check_interval = -1
+        self.assertIn(9500, second.current())
+        self.assertNotIn(9000, second.current())
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """
+        every added value is reported as present
+        """
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        values = random.sample(xrange(2 ** 40), 1000)
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        false_positives = sum(1 for value in xrange(-1000, 0)
+                              if value in bloom)
+        self.assertLess(false_positives, 50)
+
+
+class RedirectMapTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        link_cache.clear()
+        click_buffer.clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'redirects.map')
+        self.original_path = redirect_map.path
+        redirect_map.path = self.path
+        redirect_map.reset()
+
+    def tearDown(self):
+        redirect_map.path = self.original_path
+        redirect_map.reset()
+        shutil.rmtree(self.directory)
+
+    def compile(self):
+        call_command('compile_redirects', output=self.path, batch_size=2,
+                     stdout=StringIO())
+        redirect_map.reset()
+
+    def test_follow_without_queries(self):
+        """
+        compiled links are followed without querying the database
+        """
+        links = [Link.objects.create(url=u'http://www.python.org/%d/\xe9' % i)
+                 for i in xrange(5)]
+        links.append(Link.objects.create(
+            id=base62.to_decimal('python'), url='http://www.python.org/'))
+        self.compile()
+        link_cache.clear()
+        cache.clear()
+        with self.assertNumQueries(0):
+            for link in links:
+                response = self.client.get(reverse('follow', kwargs={
+                    'base62_id': link.to_base62()}))
+                self.assertEqual(response.status_code, 301)
+                self.assertEqual(response['Location'],
+                                 iri_to_uri(link.url))
+
+    def test_new_links_fall_back_to_the_database(self):
+        """
+        links created after the map was compiled are still found
+        """
+        Link.objects.create(url='http://www.python.org/')
+        self.compile()
+        link = Link.objects.create(url='http://www.djangoproject.com/')
+        link_cache.clear()
+        cache.clear()
+        with self.assertNumQueries(1, using=link_db(link.id)):
+            self.assertEqual(Link.objects.resolve(link.id), link.url)
+
+    def test_changed_links_are_not_served_from_the_map(self):
+        """
+        links edited or deleted after the map was compiled are looked up in
+        the database
+        """
+        edited = Link.objects.create(url='http://www.python.org/')
+        deleted = Link.objects.create(url='http://www.djangoproject.com/')
+        deleted_id = deleted.id
+        kept = Link.objects.create(url='http://docs.python.org/')
+        self.compile()
+        edited.url = 'http://pypi.python.org/'
+        edited.save()
+        deleted.delete()
+        for link_id in (edited.id, deleted_id):
+            link_cache.delete(link_id)
+        self.assertEqual(Link.objects.resolve(edited.id), edited.url)
+        self.assertEqual(Link.objects.resolve(deleted_id), None)
+        link_cache.delete(edited.id)
+        self.assertEqual(
+            Link.objects.resolve_many([edited.id, deleted_id, kept.id]),
+            {edited.id: edited.url, kept.id: kept.url})
+
+    def test_old_map_is_not_used(self):
+        """
+        a map compiled longer than max_age ago is ignored
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        self.compile()
+        self.assertEqual(redirect_map.get(link.id), link.url)
+        compiled_at = time.time() - redirect_map.max_age - 1
+        os.utime(self.path, (compiled_at, compiled_at))
+        redirect_map.reset()
+        self.assertEqual(redirect_map.get(link.id), None)
+        link_cache.clear()
+        self.assertEqual(Link.objects.resolve(link.id), link.url)
+
+    def test_recompile_replaces_map(self):
+        """
+        a recompiled map is picked up once the file has been replaced
+        """
+        write_redirect_map(self.path, [(1, 'http://www.python.org/')])
+        self.assertEqual(redirect_map.get(1), 'http://www.python.org/')
+        write_redirect_map(self.path, [(2, 'http://www.djangoproject.com/')])
+        redirect_map.check_interval = -1
+        try:
+            self.assertEqual(redirect_map.get(1), None)
+            self.assertEqual(redirect_map.get(2),
+                             'http://www.djangoproject.com/')
+        finally:
+            del redirect_map.check_interval
+
+    def test_links_must_be_sorted(self):
+        """
+        writing links out of order fails and leaves the old map in place
+        """
+        write_redirect_map(self.path, [(1, 'http://www.python.org/')])
+        self.assertRaises(ValueError, write_redirect_map, self.path,
+                          [(3, 'http://www.python.org/'),
+                           (2, 'http://www.python.org/')])
+        self.assertEqual(redirect_map.get(1), 'http://www.python.org/')
+        self.assertEqual(os.listdir(self.directory), ['redirects.map'])
+
+    def test_requires_shared_cache(self):
+        """
+        a redirect map is refused when deletions recorded in the cache would
+        not reach the other processes
+        """
+        self.assertRaises(ImproperlyConfigured, RedirectMap, self.path)
+        with override_settings(CACHES=MEMCACHED):
+            self.assertEqual(RedirectMap(self.path).path, self.path)
+
+
+def threads_share_databases():
+    """
+    Returns False if a test database is an in-memory SQLite database, which
+    every thread would open as a separate, empty one.
+    """
+    for database in settings.DATABASES.values():
+        if (database['ENGINE'].endswith('sqlite3') and
+                not database.get('TEST_MIRROR') and
+                database.get('TEST_NAME') in (None, '', ':memory:')):
+            return False
+    return True
+
+
+@skipUnless(threads_share_databases(),
+            'requires test databases shared between threads, such as '
+            'those of django_url_shortener.settings_replicas')
+class ConcurrentSubmitTestCase(TransactionTestCase):
+    multi_db = True
+    threads = 8
+    submits_per_thread = 12
+
+    def setUp(self):
+        # small blocks, so that the threads keep reserving new ones
+        self.block_size = id_allocator.block_size
+        id_allocator.block_size = 5
+        id_allocator._next = id_allocator._end = 0
+
+    def tearDown(self):
+        id_allocator.block_size = self.block_size
+        id_allocator._next = id_allocator._end = 0
+
+    def submit(self, thread, results, errors):
+        client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        for i in xrange(self.submits_per_thread):
+            url = 'http://www.python.org/%d/%d' % (thread, i)
+            data = {'url': url}
+            if i == 2:
+                # every thread claims the same code once
+                data['custom'] = 'shared'
+            elif i % 3 == 1:
+                # the ids the allocator is about to hand out
+                data['custom'] = base62.from_decimal(
+                    thread * self.submits_per_thread + i + 1)
+            try:
+                response = client.post(reverse('submit'), data)
+            except Exception as e:
+                errors.append(e)
+            else:
+                results.append((data, response))
+
+    def test_concurrent_submits(self):
+        """
+        submits from many threads at once, with custom codes claiming the
+        ids being allocated, never fail, lose or duplicate a link
+        """
+        results = []
+        errors = []
+        threads = [threading.Thread(target=self.submit,
+                                    args=(i, results, errors))
+                   for i in xrange(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results),
+                         self.threads * self.submits_per_thread)
+
+        links = dict((link.url, link) for db in databases_for(Link)
+                     for link in Link.objects.using(db))
+        ids = [link.id for link in links.values()]
+        self.assertEqual(len(ids), len(set(ids)))
+        taken = 0
+        for data, response in results:
+            self.assertEqual(response.status_code, 200)
+            if 'is already taken' in response.content:
+                # by another thread's link
+                taken += 1
+                self.assertNotIn(data['url'], links)
+                link_id = base62.to_decimal(data['custom'])
+                self.assertIn(link_id, ids)
+                continue
+            link = links[data['url']]
+            if 'custom' in data:
+                self.assertEqual(link.to_base62(), data['custom'])
+        # only one thread gets the shared code
+        self.assertTrue(taken >= self.threads - 1)
+        self.assertEqual(len(links), len(results) - taken)
+        self.assertEqual(count_links(), len(links))
+
+
+class IdAllocatorTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+
+    def test_blocks(self):
+        """
+        allocators sharing a sequence get disjoint blocks of ids
+        """
+        first = IdAllocator(IdSequence, Link, 'test', block_size=10)
+        second = IdAllocator(IdSequence, Link, 'test', block_size=10)
+        self.assertEqual(first.allocate(3), [1, 2, 3])
+        self.assertEqual(second.allocate(3), [11, 12, 13])
+        self.assertEqual(first.allocate(8), [4, 5, 6, 7, 8, 9, 10, 21])
+        self.assertEqual(IdSequence.objects.get(name='test').next_value, 31)
+
+    def test_skips_taken_ids(self):
+        """
+        ids taken by custom codes are skipped without a query per id
+        """
+        Link.objects.create(id=2, url='http://www.python.org/')
+        Link.objects.create(id=3, url='http://www.python.org/')
+        IdSequence.objects.create(name='test', next_value=1)
+        allocator = IdAllocator(IdSequence, Link, 'test', block_size=10)
+        with self.assertNumQueries(3):
+            self.assertEqual(allocator.allocate(3), [1, 4, 5])
+        self.assertEqual(allocator.allocate(2, exclude=(6,)), [7, 8])
+
+    def test_save_skips_ids_claimed_later(self):
+        """
+        an id claimed by a custom code after its block was reserved is
+        skipped when the link is saved
+        """
+        next_id = Link.objects.create(url='http://www.python.org/').id + 1
+        Link.objects.create(id=next_id, url='http://www.python.org/custom')
+        link = Link.objects.create(url='http://www.python.org/')
+        self.assertNotEqual(link.id, next_id)
+        self.assertEqual(Link.objects.get(id=next_id).url,
+                         'http://www.python.org/custom')
+
+    def test_submit_custom_code_of_next_id(self):
+        """
+        claiming the code of the next auto-generated id through the submit
+        view leaves both links intact
+        """
+        response = self.client.post(reverse('submit'), {
+            'url': 'http://www.python.org/'})
+        next_id = response.context['link'].id + 1
+        response = self.client.post(reverse('submit'), {
+            'url': 'http://www.python.org/custom',
+            'custom': base62.from_decimal(next_id)})
+        self.assertEqual(response.context['link'].id, next_id)
+        response = self.client.post(reverse('submit'), {
+            'url': 'http://www.python.org/auto'})
+        self.assertTemplateUsed(response, 'shortener/submit_success.html')
+        self.assertNotEqual(response.context['link'].id, next_id)
+        self.assertEqual(Link.objects.get(id=next_id).url,
+                         'http://www.python.org/custom')
+
+    def test_create_with_id(self):
+        """
+        create_with_id returns None when the id is taken
+        """
+        self.assertNotEqual(
+            Link.objects.create_with_id(5000, 'http://www.python.org/'), None)
+        self.assertEqual(
+            Link.objects.create_with_id(5000, 'http://www.python.org/'), None)
+        self.assertEqual(Link.objects.get(id=5000).url,
+                         'http://www.python.org/')
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        self.links = [
+            Link.objects.create(url=u'http://www.python.org/%d/\xe9' % i,
+                                usage_count=i)
+            for i in xrange(5)]
+        Link.objects.filter(id=self.links[0].id).update(
+            date_submitted=timezone.now() - datetime.timedelta(days=10))
+
+    def export(self, **options):
+        output = StringIO()
+        call_command('export_links', stdout=output, chunk_size=2, **options)
+        return output.getvalue()
+
+    def test_export_csv(self):
+        """
+        every link is exported in id order, across chunks
+        """
+        rows = list(csv.reader(StringIO(self.export())))
+        self.assertEqual(rows[0], ['code', 'url', 'date_submitted',
+                                   'usage_count'])
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [link.to_base62() for link in self.links])
+        self.assertEqual(rows[2][1].decode('utf-8'), self.links[1].url)
+        self.assertEqual(rows[2][3], '1')
+
+    def test_export_filters(self):
+        """
+        links can be filtered by submission date and usage count
+        """
+        recent = (timezone.now() - datetime.timedelta(days=1)).date()
+        rows = [json.loads(line) for line in self.export(
+            format='jsonl', min_usage_count=2).splitlines()]
+        self.assertEqual([row['usage_count'] for row in rows], [2, 3, 4])
+        rows = self.export(format='jsonl',
+                           submitted_before=recent.isoformat()).splitlines()
+        self.assertEqual([json.loads(row)['code'] for row in rows],
+                         [self.links[0].to_base62()])
+        rows = self.export(format='jsonl',
+                           submitted_after=recent.isoformat()).splitlines()
+        self.assertEqual(len(rows), 4)
+
+    def test_export_view(self):
+        """
+        the export view streams the links to staff members only
+        """
+        response = self.client.get(reverse('export'))
+        self.assertTemplateUsed(response, 'admin/login.html')
+        user = User.objects.create_user('staff', password='secret')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='secret')
+        response = self.client.get(reverse('export'), {
+            'format': 'jsonl', 'min_usage_count': '3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in
+                ''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['code'] for row in rows],
+                         [link.to_base62() for link in self.links[3:]])
+        response = self.client.get(reverse('export'), {
+            'submitted_after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST=CUSTOM_HTTP_HOST)
+        cache.clear()
+        link_cache.clear()
+
+    def post(self, name, data):
+        return self.client.post(reverse(name), json.dumps(data),
+                                content_type='application/json')
+
+    def test_shorten(self):
+        """
+        the shorten API creates valid links and reports errors per item
+        without rendering templates
+        """
+        Link.objects.create(id=base62.to_decimal('taken'),
+                            url='http://www.python.org/')
+        response = self.post('api_shorten', {'links': [
+            {'url': 'http://www.python.org/1'},
+            {'url': 'not a url'},
+            {'url': 'http://www.python.org/2', 'custom': 'mine'},
+            {'url': 'http://www.python.org/3', 'custom': 'mine'},
+            {'url': 'http://www.python.org/4', 'custom': 'taken'},
+            {'url': 'http://www.python.org/5', 'custom': 'bad_code'},
+            'http://www.python.org/6',
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.templates, [])
+        results = json.loads(response.content)['results']
+        self.assertEqual(len(results), 7)
+
+        link = Link.objects.get(id=base62.to_decimal(results[0]['code']))
+        self.assertEqual(link.url, 'http://www.python.org/1')
+        self.assertEqual(results[0]['short_url'],
+                         'http://%s/%s' % (CUSTOM_HTTP_HOST, link.to_base62()))
+        self.assertIn('url', results[1]['errors'])
+        self.assertEqual(results[2]['code'], 'mine')
+        self.assertEqual(results[3]['errors'],
+                         {'custom': ['"mine" is already taken']})
+        self.assertEqual(results[4]['errors'],
+                         {'custom': ['"taken" is already taken']})
+        self.assertIn('custom', results[5]['errors'])
+        self.assertIn('__all__', results[6]['errors'])
+        self.assertEqual(count_links(), 3)
+
+    def test_resolve(self):
+        """
+        the resolve API looks codes up with one query, and the codes not
+        found with another one in the archive
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        link_cache.clear()
+        cache.clear()
+        archive_queries = int(
+            link_db(base62.to_decimal('missing')) == link_db(link.id))
+        with self.assertNumQueries(1 + archive_queries,
+                                   using=link_db(link.id)):
+            response = self.post('api_resolve', {'codes': [
+                link.to_base62(), 'missing', 'bad_code', link.to_base62()]})
+        self.assertEqual(json.loads(response.content)['results'], [
+            {'code': link.to_base62(), 'url': 'http://www.python.org/'},
+            {'code': 'missing', 'error': 'not found'},
+            {'code': 'bad_code', 'error': 'invalid code'},
+            {'code': link.to_base62(), 'url': 'http://www.python.org/'},
+        ])
+        self.assertEqual(Link.objects.get(id=link.id).usage_count, 0)
+
+    def test_bad_requests(self):
+        """
+        malformed bodies and too many items are rejected as a whole
+        """
+        response = self.client.post(reverse('api_resolve'), 'not json',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.post('api_resolve', {'codes': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        with self.settings(SHORTENER_API_MAX_ITEMS=2):
+            response = self.post('api_shorten', {'links': [
+                {'url': 'http://www.python.org/'}] * 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(count_links(), 0)
+        response = self.client.get(reverse('api_shorten'))
+        self.assertEqual(response.status_code, 405)
+
+
+class RouterTestCase(SimpleTestCase):
+    def setUp(self):
+        unpin()
+
+    def tearDown(self):
+        unpin()
+
+    @override_settings(SHORTENER_SHARDING='hash',
+                       SHORTENER_SHARDS=['default', 'shard1'])
+    def test_hash_sharding(self):
+        """
+        ids are spread evenly between the shards, always to the same one
+        """
+        groups = group_by_shard(xrange(1, 1001))
+        self.assertEqual(sorted(groups), ['default', 'shard1'])
+        self.assertTrue(400 < len(groups['default']) < 600)
+        self.assertEqual(shard_for(42), shard_for(42))
+
+    @override_settings(SHORTENER_SHARDING='range',
+                       SHORTENER_SHARDS=[(0, 'default'), (100, 'shard1')])
+    def test_range_sharding(self):
+        """
+        ids go to the range they fall in, and ids below the first range to
+        the first shard
+        """
+        self.assertEqual([shard_for(i) for i in (-5, 0, 99, 100, 2 ** 62)],
+                         ['default', 'default', 'default', 'shard1', 'shard1'])
+        self.assertEqual(databases_for(Link), ['default', 'shard1'])
+        self.assertEqual(databases_for(IdSequence), [None])
+
+    @override_settings(SHORTENER_SHARDING=None)
+    def test_no_sharding(self):
+        """
+        without sharding the routers pick the database
+        """
+        self.assertEqual(group_by_shard([1, 2]), {None: [1, 2]})
+        self.assertEqual(databases_for(Link), [None])
+
+    @override_settings(SHORTENER_READ_REPLICAS=['replica'])
+    def test_replica_reads(self):
+        """
+        reads go to a replica unless the thread has just written, is in a
+        transaction or asked for the primary
+        """
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Link), 'replica')
+        self.assertEqual(router.db_for_write(Link), 'default')
+        self.assertEqual(router.db_for_read(Link), 'default')
+        unpin()
+        with reading_from_primary():
+            self.assertEqual(router.db_for_read(Link), 'default')
+        with transaction.commit_on_success():
+            self.assertEqual(router.db_for_read(Link), 'default')
+        self.assertEqual(router.db_for_read(Link), 'replica')
+
+    @override_settings(SHORTENER_READ_REPLICAS=['replica'])
+    def test_pin_cookie(self):
+        """
+        a client that wrote reads from the primary on its next requests
+        """
+        router = ReplicaRouter()
+        middleware = ReplicaPinMiddleware()
+        factory = RequestFactory()
+
+        request = factory.post('/submit/')
+        middleware.process_request(request)
+        router.db_for_write(Link)
+        response = middleware.process_response(request, HttpResponse())
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+        unpin()
+        request = factory.get('/info/')
+        request.COOKIES[PIN_COOKIE_NAME] = response.cookies[
+            PIN_COOKIE_NAME].value
+        middleware.process_request(request)
+        self.assertEqual(router.db_for_read(Link), 'default')
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+        unpin()
+        request = factory.get('/info/')
+        request.COOKIES[PIN_COOKIE_NAME] = '0'
+        middleware.process_request(request)
+        self.assertEqual(router.db_for_read(Link), 'replica')
+
+    @override_settings(SHORTENER_READ_REPLICAS=['replica'])
+    def test_pin_ends_with_the_request(self):
+        """
+        a write pins the thread to the primary for the rest of its request,
+        not for the next client it serves
+        """
+        router = ReplicaRouter()
+        middleware = ReplicaPinMiddleware()
+        factory = RequestFactory()
+
+        request = factory.post('/submit/')
+        middleware.process_request(request)
+        router.db_for_write(Link)
+        self.assertEqual(router.db_for_read(Link), 'default')
+        middleware.process_response(request, HttpResponse())
+
+        request = factory.get('/info/')
+        middleware.process_request(request)
+        self.assertEqual(router.db_for_read(Link), 'replica')
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+
+class LinkAdminTestCase(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        # on one shard, which is the one the admin lists
+        ids = [i for i in xrange(2000, 2100)
+               if link_db(i) == DEFAULT_DB_ALIAS][:5]
+        self.links = [Link.objects.create(
+            id=i, url='http://www.python.org/%d' % i, usage_count=i)
+            for i in ids]
+        self.link_admin = admin.site._registry[Link]
+        self.link_admin.list_per_page = 2
+        self.url = reverse('admin:shortener_link_changelist')
+
+    def tearDown(self):
+        self.link_admin.list_per_page = LinkAdmin.list_per_page
+
+    def changelist(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_keyset_pages(self):
+        """
+        pages continue after the last id of the previous page
+        """
+        cl = self.changelist()
+        self.assertEqual([link.id for link in cl.result_list],
+                         [link.id for link in self.links[:-3:-1]])
+        self.assertEqual(cl.first_page_url, None)
+        self.assertIn('id__lt=%d' % self.links[3].id, cl.next_page_url)
+        cl = self.changelist(id__lt=self.links[1].id)
+        self.assertEqual([link.id for link in cl.result_list],
+                         [self.links[0].id])
+        self.assertEqual(cl.next_page_url, None)
+        self.assertEqual(cl.first_page_url, '?')
+
+    def test_other_orderings_are_numbered(self):
+        """
+        orderings other than by id fall back to numbered pages
+        """
+        cl = self.changelist(o='3')
+        self.assertEqual(cl.lookup, None)
+        self.assertEqual(cl.paginator.num_pages, 3)
+        cl = self.changelist(o='3', p='2')
+        self.assertEqual([link.id for link in cl.result_list],
+                         [self.links[4].id])
+
+    def test_counts_are_bounded(self):
+        """
+        filtered changelists count rows only up to the paginator's limit
+        """
+        links = Link.objects.filter(usage_count__gte=0)
+        paginator = EstimatedCountPaginator(links, 2)
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.capped)
+        paginator = EstimatedCountPaginator(links, 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.capped)
+
+    def test_search(self):
+        """
+        searches match a short code or the start of a URL
+        """
+        link = self.links[2]
+        cl = self.changelist(q=link.to_base62())
+        self.assertEqual([found.id for found in cl.result_list], [link.id])
+        cl = self.changelist(q=link.url)
+        self.assertEqual([found.id for found in cl.result_list], [link.id])
+        cl = self.changelist(q='www.python.org')
+        self.assertEqual(list(cl.result_list), [])
+
+    def test_actions(self):
+        """
+        bulk actions work through the selected ids in batches
+        """
+        self.assertNotIn('delete_selected',
+                         self.link_admin.get_actions(RequestFactory().get('/')))
+        self.client.post(self.url, {
+            'action': 'reset_usage_count', 'index': 0,
+            '_selected_action': [link.id for link in self.links[:2]]})
+        self.assertEqual(
+            [Link.objects.get(id=link.id).usage_count for link in self.links],
+            [0, 0] + [link.usage_count for link in self.links[2:]])
+        data = {'action': 'delete_links', 'index': 0, 'select_across': 1,
+                '_selected_action': [self.links[0].id]}
+        response = self.client.post(self.url, data)
+        self.assertTemplateUsed(
+            response, 'admin/shortener/link/delete_links_confirmation.html')
+        self.assertContains(response, 'delete 5 links, every link matching')
+        self.assertContains(response, 'name="select_across" value="1"')
+        self.assertEqual(count_links(), 5)
+        data['post'] = 'yes'
+        self.client.post(self.url, data)
+        self.assertEqual(count_links(), 0)
+
+    def test_delete_confirmation_counts_selected(self):
+        """
+        deleting selected links asks first, with their count
+        """
+        data = {'action': 'delete_links', 'index': 0,
+                '_selected_action': [link.id for link in self.links[:2]]}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'delete 2 links?')
+        self.assertEqual(count_links(), 5)
+        data['post'] = 'yes'
+        self.client.post(self.url, data)
+        self.assertEqual(count_links(), 3)
+
+
+@skipUnless(sharding(), 'requires django_url_shortener.settings_sharded')
+class ShardingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        link_cache.clear()
+        click_buffer.clear()
+
+    def test_links_are_stored_on_their_shard(self):
+        """
+        links, created one by one or in bulk, and their clicks are stored in
+        the database chosen by their id
+        """
+        links = [Link.objects.create(url='http://www.python.org/%d' % i)
+                 for i in xrange(10)]
+        links.extend(create_links(
+            [('http://www.djangoproject.com/%d' % i, None)
+             for i in xrange(10)]))
+        self.assertEqual(len(set(shard_for(link.id) for link in links)), 2)
+        for link in links:
+            self.assertEqual(Link.objects.using(shard_for(link.id)).get(
+                id=link.id).url, link.url)
+            click_buffer.record(link.id)
+        click_buffer.flush()
+        for link in links:
+            self.assertEqual(Link.objects.get(id=link.id).usage_count, 1)
+            self.assertEqual(ClickEvent.objects.using(
+                shard_for(link.id)).filter(link=link.id).count(), 1)
+        self.assertEqual(roll_up_clicks(), 20)
+
+    def test_leaderboards_cover_every_shard(self):
+        """
+        the most popular links are taken from every shard
+        """
+        links = [Link.objects.create(url='http://www.python.org/%d' % i,
+                                     usage_count=i)
+                 for i in xrange(20)]
+        cache.clear()
+        self.assertEqual([link.id for link in popular_links.links()],
+                         [link.id for link in links[:-6:-1]])
+
+
+class ImportLinksTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmpdir, 'out.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def import_links(self, filename, content, **options):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        stderr = StringIO()
+        call_command('import_links', path, output=self.output, stderr=stderr,
+                     **options)
+        with open(self.output, 'rb') as f:
+            mapping = [line.split(',', 1) for line in f.read().splitlines()]
+        return mapping, stderr.getvalue()
+
+    def test_import_csv(self):
+        """
+        importing a CSV file creates a link per valid row in chunks
+        """
+        Link.objects.create(id=base62.to_decimal('taken'),
+                            url='http://www.python.org/')
+        content = '\n'.join([
+            'url,custom',
+            'http://www.python.org/,',
+            'http://www.djangoproject.com/,django',
+            'not a url,',
+            'http://www.example.com/,taken',
+            'http://www.example.org/,django',
+            'http://www.example.net/,',
+        ])
+        mapping, errors = self.import_links('links.csv', content, chunk_size=2)
+        self.assertEqual(len(mapping), 3)
+        self.assertIn(['django', 'http://www.djangoproject.com/'], mapping)
+        for code, url in mapping:
+            self.assertEqual(Link.objects.get(id=base62.to_decimal(code)).url,
+                             url)
+        self.assertEqual(count_links(), 4)
+        self.assertIn('line 4: ', errors)
+        self.assertIn('line 5: "taken" is already taken', errors)
+        self.assertIn('line 6: "django" is already taken', errors)
+
+    def test_import_jsonl(self):
+        """
+        importing a JSON lines file
+        """
+        content = '\n'.join([
+            json.dumps({'url': 'http://www.python.org/'}),
+            json.dumps({'url': 'http://www.djangoproject.com/',
+                        'custom': 'django'}),
+            '[]',
+        ])
+        mapping, errors = self.import_links('links.jsonl', content)
+        self.assertEqual(len(mapping), 2)
+        self.assertEqual(mapping[1], ['django', 'http://www.djangoproject.com/'])
+        self.assertIn('line 3: ', errors)
+
+    def test_imported_ids_skip_existing(self):
+        """
+        auto-generated ids never clash with existing links
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        mapping, errors = self.import_links(
+            'links.csv', 'url\nhttp://www.example.com/\n')
+        self.assertNotEqual(base62.to_decimal(mapping[0][0]), link.id)
+        self.assertEqual(count_links(), 2)
+
+    def test_import_deduplicate(self):
+        """
+        with --deduplicate, already shortened URLs map to the existing link
+        """
+        link = Link.objects.create(url='http://www.python.org/')
+        mapping, errors = self.import_links('links.csv', '\n'.join([
+            'url',
+            'http://WWW.python.org/',
+            'http://www.example.com/',
+            'http://www.example.com',
+        ]), deduplicate=True)
+        self.assertEqual(mapping[0][0], link.to_base62())
+        self.assertEqual(mapping[1][0], mapping[2][0])
+        self.assertEqual(count_links(), 2)
+
+
+class BaseconvTestCase(TestCase):
+    def test_symmetry_positive_int(self):
+        """
+        symmetry for encoding/decoding values
+        """
+        for x in xrange(1000):
+            random_int = random.randint(0, sys.maxint)
+            encoded_int = base62.from_decimal(random_int)
+            self.assertEqual(random_int, base62.to_decimal(encoded_int))
+
+    def test_symmetry_negative_int(self):
+        """
+        symmetry for negative numbers
+        """
+        for x in xrange(1000):
+            random_int = random.randint(-1 * sys.maxint - 1, 0)
+            encoded_int = base62.from_decimal(random_int)
+            self.assertEqual(random_int, base62.to_decimal(encoded_int))
+
+    def test_encoding_non_int_fails(self):
+        """
+        calling from_decimal() on letters raises an EncodingError
+        """
+        self.assertRaises(EncodingError, base62.from_decimal, string.letters)
+
+    def test_decoding_non_str_fails(self):
+        """
+        decoding a non-str should fail with DecodingError
+        """
+        self.assertRaises(DecodingError, base62.to_decimal, sys.maxint)
+
+    def test_illgal_character(self):
+        """
+        trying to encode a character that is not within base62 raises an
+        EncodingError
+        """
+        self.assertRaises(DecodingError, base62.to_decimal, '@@@@')
+
+    def test_encode_many_decode_many(self):
+        """
+        the batch methods agree with the single value methods
+        """
+        ints = [0, 1, 61, 62, -62, sys.maxint, -1 * sys.maxint - 1]
+        encoded = base62.encode_many(ints)
+        self.assertEqual(encoded, [base62.from_decimal(i) for i in ints])
+        self.assertEqual(base62.decode_many(encoded), ints)
+
+    def test_known_values(self):
+        """
+        encoding matches the original implementation
+        """
+        self.assertEqual(base62.from_decimal(0), '0')
+        self.assertEqual(base62.from_decimal(61), 'Z')
+        self.assertEqual(base62.from_decimal(62), '10')
+        self.assertEqual(base62.from_decimal(-62), '-10')
+        self.assertEqual(
+            BaseConverter.convert(1234, string.digits, '0123456789abcdefghij'),
+            '31e')
+
+    def test_decoding_too_long_fails(self):
+        """
+        codes that do not fit in a 64 bit id raise DecodingOverflowError
+        """
+        self.assertRaises(
+            DecodingOverflowError, base62.to_decimal, 'a' * 12)
+        self.assertRaises(
+            DecodingOverflowError, base62.to_decimal,
+            base62.from_decimal(2 ** 63))
+        self.assertEqual(
+            base62.to_decimal(base62.from_decimal(-2 ** 63)), -2 ** 63)
+        self.assertTrue(issubclass(DecodingOverflowError, OverflowError))
+
+    def test_decoding_empty_fails(self):
+        """
+        decoding an empty string raises a DecodingError
+        """
+        self.assertRaises(DecodingError, base62.to_decimal, '')
+        self.assertRaises(DecodingError, base62.to_decimal, '-')
@@ -0,0 +1,194 @@
+"""
+Rate limiting of the shortener's views.
+
+Each throttled view has a token bucket per client, holding up to ``limit``
+requests and refilled at ``limit`` per ``period``. Requests that find the
+bucket empty are answered with 429 Too Many Requests before the view runs,
+so they cost neither form validation nor database queries.
+
+Limits are set per view name with ``SHORTENER_THROTTLE_RATES``, for example
+``{'submit': '10/m', 'follow': '600/m'}``. Buckets live in each process;
+with ``SHORTENER_THROTTLE_SHARED`` they are also kept in Django's cache so
+that the limits hold across processes.
+"""
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+
+DEFAULT_THROTTLE_MAX_CLIENTS = 100000
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Parses a rate such as "10/m" into a (limit, period in seconds) pair.
+
+    >>> parse_rate('10/m')
+    (10, 60)
+    """
+    try:
+        limit, period = rate.split('/')
+        return int(limit), PERIODS[period[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ValueError('invalid rate %r, expected e.g. "10/m"' % rate)
+
+
+class Throttle(object):
+    """
+    Token buckets allowing each key ``limit`` requests per ``period``
+    seconds, in bursts of up to ``limit``.
+
+    A bucket is stored as the time at which it will be full again (the
+    generic cell rate algorithm): taking a token pushes that time back by
+    ``period / limit`` seconds, and a request is refused when it would be
+    more than ``period`` seconds away. A check is a dict lookup under a lock,
+    plus, with ``shared``, one atomic increment in Django's cache. The
+    shared bucket is approximate: it is reset when the cache evicts it.
+
+    At most ``max_clients`` local buckets are kept; when there are more,
+    the full ones are dropped.
+    """
+    def __init__(self, name, limit, period, shared=False, max_clients=None):
+        self.name = name
+        self.limit = limit
+        self.interval = float(period) / limit
+        self.period = period
+        self.shared = shared
+        if max_clients is None:
+            max_clients = getattr(settings, 'SHORTENER_THROTTLE_MAX_CLIENTS',
+                                  DEFAULT_THROTTLE_MAX_CLIENTS)
+        self.max_clients = max_clients
+        self._full_at = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key, tokens=1):
+        """
+        Takes ``tokens`` tokens from the bucket of ``key``. Returns 0 if
+        there were enough, otherwise the number of seconds until there will
+        be.
+        """
+        now = time.time()
+        interval = self.interval * tokens
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now) + interval
+            wait = full_at - now - self.period
+            if wait > 0:
+                return wait
+            if len(self._full_at) >= self.max_clients:
+                self._prune(now)
+            self._full_at[key] = full_at
+        if self.shared:
+            return self._allow_shared(key, now, interval)
+        return 0
+
+    def _prune(self, now):
+        self._full_at = dict((key, full_at) for key, full_at
+                             in self._full_at.iteritems() if full_at > now)
+        if len(self._full_at) >= self.max_clients:
+            self._full_at = {}
+
+    def _allow_shared(self, key, now, interval):
+        # in milliseconds, since cache.incr only takes integers
+        cache_key = 'shortener:throttle:%s:%s' % (
+            self.name, hashlib.md5(key.encode('utf-8')).hexdigest())
+        now = int(now * 1000)
+        interval = int(interval * 1000)
+        try:
+            full_at = cache.incr(cache_key, interval)
+        except ValueError:
+            full_at = None
+        if full_at is None or full_at < now + interval:
+            # a new or idle bucket
+            cache.set(cache_key, now + interval, self.period + 1)
+            return 0
+        wait = full_at - now - self.period * 1000
+        if wait > 0:
+            # refused requests do not take a token
+            try:
+                cache.decr(cache_key, interval)
+            except ValueError:
+                pass
+            return wait / 1000.0
+        return 0
+
+
+_throttles = {}
+
+
+def throttle_for(view_name):
+    """
+    Returns the Throttle of the view named ``view_name``, or None if it is
+    not throttled.
+    """
+    rate = getattr(settings, 'SHORTENER_THROTTLE_RATES', {}).get(view_name)
+    if rate is None:
+        return None
+    shared = getattr(settings, 'SHORTENER_THROTTLE_SHARED', False)
+    key = (view_name, rate, shared)
+    throttle = _throttles.get(key)
+    if throttle is None:
+        limit, period = parse_rate(rate)
+        throttle = _throttles[key] = Throttle(view_name, limit, period, shared)
+    return throttle
+
+
+def client_keys(meta):
+    """
+    Returns the keys of the buckets a request is counted against: its
+    address, and the API key sent in the SHORTENER_THROTTLE_API_KEY_HEADER
+    header (such as "X-Api-Key") if there is one.
+    """
+    keys = ['ip:%s' % meta.get('REMOTE_ADDR', '')]
+    header = getattr(settings, 'SHORTENER_THROTTLE_API_KEY_HEADER', None)
+    if header is not None:
+        api_key = meta.get('HTTP_' + header.upper().replace('-', '_'))
+        if api_key:
+            keys.append(u'key:%s' % api_key.decode('latin-1'))
+    return keys
+
+
+def check(view_name, meta, tokens=1):
+    """
+    Returns the number of seconds the client of a request to the view named
+    ``view_name``, whose request.META or WSGI environ is ``meta``, must wait
+    before being served, or 0 if it may be served now. The request takes
+    ``tokens`` tokens.
+    """
+    throttle = throttle_for(view_name)
+    if throttle is None:
+        return 0
+    return max(throttle.allow(key, tokens) for key in client_keys(meta))
+
+
+def retry_after(wait):
+    return str(int(math.ceil(wait)))
+
+
+def too_many_requests(wait):
+    response = HttpResponse('Too many requests', status=429,
+                            content_type='text/plain')
+    response['Retry-After'] = retry_after(wait)
+    return response
+
+
+def throttled(view_name):
+    """
+    Decorator answering requests beyond the view's rate with 429 Too Many
+    Requests before calling it.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            wait = check(view_name, request.META)
+            if wait:
+                return too_many_requests(wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
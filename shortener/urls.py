@@ -9,5 +9,9 @@ urlpatterns = patterns('shortener.views',
     url(r'^$', 'index', name='index'),
     url(r'^info/(?P<base62_id>\w+)$', 'info', name='info'),
     url(r'^submit/$', 'submit', name='submit'),
+    url(r'^metrics/$', 'metrics', name='metrics'),
+    url(r'^api/shorten/$', 'api_shorten', name='api_shorten'),
+    url(r'^api/resolve/$', 'api_resolve', name='api_resolve'),
+    url(r'^export/$', 'export', name='export'),
     url(r'^(?P<base62_id>\w+)$', 'follow', name='follow'),
 )
@@ -1,47 +1,150 @@
-from django.db.models import F
-from django.http import HttpResponsePermanentRedirect
-from django.shortcuts import get_object_or_404, render
+import json
+from functools import partial
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+    HttpResponsePermanentRedirect, StreamingHttpResponse)
+from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
 
-from shortener.baseconv import base62
-from shortener.models import Link
-from shortener.forms import LinkSubmitForm
+from shortener.analytics import daily_series, hourly_series, unique_visitors
+from shortener.baseconv import base62, DecodingError
+from shortener.bulk import create_links
+from shortener.cache import links_version
+from shortener.clicks import click_buffer, visitor_fingerprint
+from shortener.export import (
+    EXPORT_FORMATS, export_lines, iter_links, parse_bound)
+from shortener.models import (
+    ArchivedLink, link_filter, Link, LinkCheck, popular_links, recent_links)
+from shortener.forms import LinkSubmitForm, taken_error
+from shortener.httpcache import (
+    count_redirects, info_etag, not_modified, redirect_cache_control,
+    set_index_headers, set_info_headers)
+from shortener.metrics import registry
+from shortener.throttle import (
+    check, throttle_for, throttled, too_many_requests)
+
+
+def decode_or_404(base62_id):
+    """
+    Returns the link id encoded by base62_id, raising Http404 if it is not a
+    valid code.
+    """
+    try:
+        return base62.to_decimal(base62_id)
+    except DecodingError:
+        raise Http404
+
+
+class LazySequence(object):
+    """
+    The list returned by ``func(*args)``, computed when a template first
+    uses it, so that fragments served from the cache do not pay for it.
+    """
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self._items = None
+
+    def items(self):
+        if self._items is None:
+            self._items = list(self.func(*self.args))
+        return self._items
+
+    def __iter__(self):
+        return iter(self.items())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __getitem__(self, index):
+        return self.items()[index]
+
+
+def leaderboard_links(board):
+    return click_buffer.apply_pending(board.links())
 
 
 @require_GET
+@throttled('follow')
 def follow(request, base62_id):
     """
     View which gets the link for the given base62_id value
     and redirects to it.
     """
-    link = get_object_or_404(Link, id=base62.to_decimal(base62_id))
-    link.usage_count = F('usage_count') + 1
-    link.save()
-    return HttpResponsePermanentRedirect(link.url)
+    link_id = decode_or_404(base62_id)
+    url, archived = Link.objects.follow(link_id)
+    if url is None:
+        raise Http404
+    if count_redirects() and not archived:
+        click_buffer.record(link_id, visitor=visitor_fingerprint(request.META))
+    response = HttpResponsePermanentRedirect(url)
+    cache_control = redirect_cache_control()
+    if cache_control is not None:
+        response['Cache-Control'] = cache_control
+    return response
 
 
 @require_GET
+@throttled('info')
 def info(request, base62_id):
     """
     View which shows information on a particular link
     """
-    link = get_object_or_404(Link, id=base62.to_decimal(base62_id))
-    return render(request, 'shortener/link_info.html', {'link': link})
+    link_id = decode_or_404(base62_id)
+    if not Link.objects.might_exist(link_id):
+        raise Http404
+    try:
+        link = Link.objects.get(id=link_id)
+    except Link.DoesNotExist:
+        try:
+            link = ArchivedLink.objects.get(id=link_id).to_link()
+        except ArchivedLink.DoesNotExist:
+            link_filter.record_miss(link_id)
+            raise Http404
+    click_buffer.apply_pending([link])
+    checks = list(LinkCheck.objects.filter(pk=link_id)[:1])
+    check = checks[0] if checks else None
+    etag = info_etag(request, link, check)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    response = render(request, 'shortener/link_info.html', {
+        'link': link,
+        'check': check,
+        'etag': etag,
+        'hourly_clicks': LazySequence(hourly_series, link),
+        'daily_clicks': LazySequence(daily_series, link),
+        'unique_visitors': partial(unique_visitors, link)})
+    set_info_headers(response, etag)
+    return response
 
 
 @require_POST
+@throttled('submit')
 def submit(request):
     """
     View for submitting a URL to be shortened
     """
     form = LinkSubmitForm(request.POST)
     if form.is_valid():
-        kwargs = {'url': form.cleaned_data['url']}
+        url = form.cleaned_data['url']
         custom = form.cleaned_data['custom']
+        link = None
         if custom:
             # specify an explicit id corresponding to the custom url
-            kwargs.update({'id': base62.to_decimal(custom)})
-        link = Link.objects.create(**kwargs)
+            link = Link.objects.create_with_id(base62.to_decimal(custom), url)
+            if link is None:
+                form.custom_taken()
+                return render(request, 'shortener/submit_failed.html',
+                              {'link_form': form})
+        elif getattr(settings, 'SHORTENER_DEDUPLICATE', False):
+            link = Link.objects.find_by_url(url)
+        if link is None:
+            link = Link.objects.create(url=url)
         return render(request, 'shortener/submit_success.html', {'link': link})
     else:
         return render(request, 'shortener/submit_failed.html', {'link_form': form})
@@ -54,6 +157,165 @@ def index(request):
     """
     values = {
         'link_form': LinkSubmitForm(),
-        'recent_links': Link.objects.all().order_by('-date_submitted')[:5],
-        'most_popular_links': Link.objects.all().order_by('-usage_count')[:5]}
-    return render(request, 'shortener/index.html', values)
+        'links_version': links_version.get(),
+        'recent_links': LazySequence(leaderboard_links, recent_links),
+        'most_popular_links': LazySequence(leaderboard_links, popular_links)}
+    response = render(request, 'shortener/index.html', values)
+    set_index_headers(request, response)
+    return response
+
+
+DEFAULT_API_MAX_ITEMS = 500
+
+
+def json_response(data, response_class=HttpResponse):
+    return response_class(json.dumps(data), content_type='application/json')
+
+
+def read_items(request, key, max_items=None):
+    """
+    Returns the list under ``key`` in the JSON object posted to an API view,
+    or an error response if there is none or it is longer than
+    SHORTENER_API_MAX_ITEMS or ``max_items``.
+    """
+    try:
+        items = json.loads(request.body)[key]
+    except (ValueError, KeyError, TypeError):
+        return json_response(
+            {'error': 'expected a JSON object with a "%s" list' % key},
+            HttpResponseBadRequest)
+    if not isinstance(items, list):
+        return json_response({'error': '"%s" must be a list' % key},
+                             HttpResponseBadRequest)
+    max_items = min(max_items or DEFAULT_API_MAX_ITEMS, getattr(
+        settings, 'SHORTENER_API_MAX_ITEMS', DEFAULT_API_MAX_ITEMS))
+    if len(items) > max_items:
+        return json_response(
+            {'error': 'at most %d items are allowed' % max_items},
+            HttpResponseBadRequest)
+    return items
+
+
+@csrf_exempt
+@require_POST
+def api_shorten(request):
+    """
+    View shortening every URL in the posted {"links": [{"url": ...,
+    "custom": ...}, ...]} object with bulk inserts. Returns a result for
+    each link, in order: {"code": ..., "short_url": ..., "url": ...} or
+    {"errors": {field: [message, ...]}}.
+
+    Its rate is in links rather than requests, so each link takes a token
+    and a request may hold no more links than the rate's limit.
+    """
+    throttle = throttle_for('api_shorten')
+    items = read_items(request, 'links',
+                       throttle.limit if throttle is not None else None)
+    if isinstance(items, HttpResponse):
+        return items
+    wait = check('api_shorten', request.META, tokens=max(len(items), 1))
+    if wait:
+        return too_many_requests(wait)
+    results = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {'errors': {'__all__': ['expected a JSON object']}}
+            continue
+        form = LinkSubmitForm(item)
+        if not form.is_valid():
+            results[i] = {'errors': dict(
+                (field, [unicode(message) for message in messages])
+                for field, messages in form.errors.items())}
+            continue
+        custom = form.cleaned_data['custom']
+        valid.append((i, form.cleaned_data['url'], custom))
+
+    links = create_links(
+        [(url, base62.to_decimal(custom) if custom else None)
+         for i, url, custom in valid],
+        deduplicate=getattr(settings, 'SHORTENER_DEDUPLICATE', False))
+    base_url = request.build_absolute_uri('/')
+    for (i, url, custom), link in zip(valid, links):
+        if link is None:
+            results[i] = {'errors': {'custom': [taken_error % custom]}}
+        else:
+            code = link.to_base62()
+            results[i] = {'code': code, 'short_url': base_url + code,
+                          'url': link.url}
+    return json_response({'results': results})
+
+
+@csrf_exempt
+@require_POST
+@throttled('api_resolve')
+def api_resolve(request):
+    """
+    View resolving every short code in the posted {"codes": [...]} object
+    with one query. Returns a result for each code, in order:
+    {"code": ..., "url": ...} or {"code": ..., "error": ...}. Clicks are not
+    counted.
+    """
+    codes = read_items(request, 'codes')
+    if isinstance(codes, HttpResponse):
+        return codes
+    link_ids = []
+    for code in codes:
+        try:
+            link_ids.append(base62.to_decimal(code))
+        except (DecodingError, TypeError):
+            link_ids.append(None)
+    urls = Link.objects.resolve_many(
+        link_id for link_id in link_ids if link_id is not None)
+    results = []
+    for code, link_id in zip(codes, link_ids):
+        if link_id is None:
+            results.append({'code': code, 'error': 'invalid code'})
+        elif link_id in urls:
+            results.append({'code': code, 'url': urls[link_id]})
+        else:
+            results.append({'code': code, 'error': 'not found'})
+    return json_response({'results': results})
+
+
+@staff_member_required
+@require_GET
+def export(request):
+    """
+    View streaming every link as CSV or JSON lines, optionally filtered by
+    the submitted_after, submitted_before and min_usage_count parameters
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown format')
+    filters = {}
+    for name in ('submitted_after', 'submitted_before'):
+        if request.GET.get(name):
+            filters[name] = parse_bound(request.GET[name])
+            if filters[name] is None:
+                return HttpResponseBadRequest('Invalid %s' % name)
+    if request.GET.get('min_usage_count'):
+        try:
+            filters['min_usage_count'] = int(request.GET['min_usage_count'])
+        except ValueError:
+            return HttpResponseBadRequest('Invalid min_usage_count')
+    content_type = {'csv': 'text/csv',
+                    'jsonl': 'application/x-ndjson'}[export_format]
+    response = StreamingHttpResponse(
+        export_lines(export_format, iter_links(**filters)),
+        content_type=content_type)
+    response['Content-Disposition'] = (
+        'attachment; filename="links.%s"' % export_format)
+    return response
+
+
+@require_GET
+def metrics(request):
+    """
+    View exposing the metrics registry in the Prometheus text format
+    """
+    allowed_ips = getattr(settings, 'SHORTENER_METRICS_ALLOWED_IPS', None)
+    if allowed_ips is not None and request.META['REMOTE_ADDR'] not in allowed_ips:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
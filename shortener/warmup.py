@@ -0,0 +1,133 @@
+"""
+Warming up new worker processes.
+
+A fresh process imports the views on the first request to each, compiles
+each template on its first render, connects to the databases on its first
+query and starts with empty caches, so its first requests are slow.
+``warm_up`` does all of that before the process takes traffic:
+``django_url_shortener/wsgi.py`` calls it when ``SHORTENER_WARMUP`` is set,
+and ``manage.py warmup`` runs it and reports how long each step took.
+"""
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import get_resolver
+from django.db import connections, transaction
+from django.template.loader import get_template
+
+from shortener.cache import link_cache, links_version
+from shortener.models import Link, popular_links, recent_links
+from shortener.routers import databases_for
+
+
+DEFAULT_WARMUP_LINKS = 1000
+
+# every template the shortener renders, including those only extended or
+# included by others
+TEMPLATES = (
+    'base.html',
+    '404.html',
+    'shortener/form.inc.html',
+    'shortener/index.html',
+    'shortener/link_info.html',
+    'shortener/submit_success.html',
+    'shortener/submit_failed.html',
+)
+
+
+def iter_callbacks(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for callback in iter_callbacks(pattern.url_patterns):
+                yield callback
+        else:
+            yield pattern.callback
+
+
+def import_views():
+    """
+    Imports the view of every URL pattern. Returns the number of patterns.
+    """
+    return len(list(iter_callbacks(get_resolver(None).url_patterns)))
+
+
+def compile_templates():
+    """
+    Compiles the shortener's templates, which the cached template loader
+    (used when DEBUG is off) then keeps. Returns the number of templates.
+    """
+    for name in TEMPLATES:
+        get_template(name)
+    return len(TEMPLATES)
+
+
+def connect_databases():
+    """
+    Connects to every database, loading its driver and failing early if it
+    cannot be reached. Returns the number of databases.
+
+    Django 1.5 closes connections at the end of each request, so they are
+    closed again; keeping them open needs Django 1.6's CONN_MAX_AGE or a
+    pooler such as pgbouncer.
+    """
+    for alias in settings.DATABASES:
+        connections[alias].cursor().close()
+    close_connections()
+    return len(settings.DATABASES)
+
+
+def close_connections():
+    for alias in settings.DATABASES:
+        # closing a connection would roll back its transaction
+        if not transaction.is_managed(using=alias):
+            connections[alias].close()
+
+
+def preload_links(count):
+    """
+    Caches the ``count`` most followed links, read with one indexed query
+    per shard. Returns the number of links cached.
+    """
+    top = []
+    for db in databases_for(Link):
+        links = Link.objects.using(db).order_by('-usage_count')
+        top.extend(links.values_list('usage_count', 'id', 'url')[:count])
+    top = sorted(top, reverse=True)[:count]
+    link_cache.set_many(dict((link_id, url) for usage, link_id, url in top))
+    return len(top)
+
+
+def load_leaderboards():
+    """
+    Makes sure the index page's leaderboards are in Django's cache. Returns
+    the number of links on them.
+    """
+    links_version.get()
+    return len(recent_links.entries()) + len(popular_links.entries())
+
+
+def warm_up(link_count=None):
+    """
+    Runs each warm-up step, returning a list of (step, seconds, items)
+    tuples. ``link_count`` links, by default ``SHORTENER_WARMUP_LINKS``, are
+    preloaded into the redirect cache.
+    """
+    if link_count is None:
+        link_count = getattr(settings, 'SHORTENER_WARMUP_LINKS',
+                             DEFAULT_WARMUP_LINKS)
+    steps = [
+        ('views', import_views),
+        ('templates', compile_templates),
+        ('databases', connect_databases),
+        ('links', lambda: preload_links(link_count)),
+        ('leaderboards', load_leaderboards),
+    ]
+    timings = []
+    for name, step in steps:
+        started = time.time()
+        items = step()
+        timings.append((name, time.time() - started, items))
+    # the queries above opened connections again; a server that forks
+    # workers after loading the application must not share them
+    close_connections()
+    return timings